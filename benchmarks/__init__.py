@@ -0,0 +1,10 @@
+"""Benchmarks for pyre
+
+Run them through the command line interface, e.g.
+
+    python -m benchmarks throughput --nodes 2,4 --sizes 16,4096
+    python -m benchmarks throughput --output before.json
+
+Each benchmark prints a table and can save its results as JSON, so runs
+can be compared.
+"""
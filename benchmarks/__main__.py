@@ -0,0 +1,50 @@
+"""Command line interface, run python -m benchmarks --help"""
+
+import argparse
+import logging
+import sys
+
+from . import churn
+from . import codec
+from . import common
+from . import footprint
+from . import importtime
+from . import startup
+from . import throughput
+
+BENCHMARKS = [
+    ("throughput", throughput),
+    ("codec", codec),
+    ("churn", churn),
+    ("footprint", footprint),
+    ("startup", startup),
+    ("importtime", importtime),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--output", help="save results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="log pyre debug output")
+    commands = parser.add_subparsers(dest="benchmark")
+    for name, module in BENCHMARKS:
+        sub = commands.add_parser(name, help=module.__doc__.splitlines()[0],
+                                  description=module.__doc__,
+                                  formatter_class=argparse.RawDescriptionHelpFormatter)
+        module.add_arguments(sub)
+        sub.set_defaults(module=module)
+    args = parser.parse_args(argv)
+    if not args.benchmark:
+        parser.print_help()
+        return 1
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    results = args.module.main(args)
+    if args.output:
+        params = dict((k, v) for k, v in vars(args).items() if k not in ("module", "output"))
+        common.save_results(args.output, args.benchmark, params, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
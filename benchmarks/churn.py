@@ -0,0 +1,145 @@
+"""Discovery convergence under join/leave storms
+
+Runs on the in-process simulator (pyre.pyre_sim), so hundreds of nodes
+fit in one process and times are virtual: they follow from the beacon
+interval, peer timeouts and --latency, not from the speed of this host.
+Every node joins one group. Scenarios:
+
+    start       all nodes start at once
+    stop        half of the nodes stop at once, sending their zero port
+                "going away" beacons
+    restart     a rolling restart, --batch nodes at a time every
+                --spacing seconds, each replaced by a new node on the
+                same host
+
+Each scenario runs until every running node's peers() and
+peers_by_group() agree. It reports the virtual time from the start of
+the churn until then, the
+mailbox messages and beacons exchanged, and the real CPU time spent
+in require_peer, recv_beacon and join_peer_group, measured with
+cProfile. CPU times are cumulative, recv_beacon includes the
+require_peer calls it makes.
+"""
+
+import cProfile
+import pstats
+import time
+
+from pyre.pyre_sim import SimNetwork
+
+from . import common
+
+GROUP = "CHURN"
+PROFILED = ("require_peer", "recv_beacon", "join_peer_group")
+
+
+class Scenario(object):
+
+    def __init__(self, name, nodes, args):
+        self.name = name
+        self.count = nodes
+        self.args = args
+        self.net = SimNetwork(seed=args.seed, latency=args.latency)
+
+    def add_node(self, address=None):
+        node = self.net.add_node(keep_events=False, address=address)
+        node.join(GROUP)
+        return node
+
+    def converge(self):
+        return self.net.run_until(lambda: self.net.converged(GROUP), timeout=self.args.timeout,
+                                  step=self.args.step)
+
+    # Set up the cluster the scenario starts from
+    def prepare(self):
+        self.nodes = [self.add_node() for i in range(self.count)]
+        if self.name == "start":
+            return
+        for node in self.nodes:
+            node.start()
+        if self.converge() is None:
+            raise RuntimeError("cluster of {0} didn't converge".format(self.count))
+
+    # Cause the churn
+    def churn(self):
+        if self.name == "start":
+            for node in self.nodes:
+                node.start()
+        elif self.name == "stop":
+            for node in self.nodes[:self.count // 2]:
+                node.stop()
+        elif self.name == "restart":
+            for i in range(0, self.count, self.args.batch):
+                for node in self.nodes[i:i + self.args.batch]:
+                    node.stop()
+                    self.add_node(node.node._ctx.address).start()
+                self.net.run(self.args.spacing)
+        else:
+            raise SystemExit("unknown scenario {0}".format(self.name))
+
+    def run(self):
+        self.prepare()
+        stats = dict(self.net.stats)
+        start = self.net.now
+        profile = cProfile.Profile()
+        wall = time.perf_counter()
+        profile.enable()
+        self.churn()
+        converged = self.converge()
+        profile.disable()
+        wall = time.perf_counter() - wall
+
+        result = {
+            "scenario": self.name,
+            "nodes": self.count,
+            "converged": converged is not None,
+            "converge_s": self.net.now - start if converged is not None else None,
+            "messages": self.net.stats["messages"] - stats["messages"],
+            "beacons": self.net.stats["beacons"] - stats["beacons"],
+            "wall_s": wall,
+        }
+        result.update(profiled_cpu(profile))
+        return result
+
+
+# Return cumulative CPU seconds of the profiled node methods
+def profiled_cpu(profile):
+    cpu = dict(("cpu_" + name, 0.0) for name in PROFILED)
+    for (filename, lineno, funcname), (cc, nc, tt, ct, callers) in pstats.Stats(profile).stats.items():
+        if funcname in PROFILED and filename.endswith("pyre_node.py"):
+            cpu["cpu_" + funcname] += ct
+    return cpu
+
+
+COLUMNS = ["scenario", "nodes", "converge_s", "messages", "beacons", "wall_s"] + \
+          ["cpu_" + name for name in PROFILED]
+
+
+def add_arguments(parser):
+    parser.add_argument("--scenarios", type=common.str_list, default=["start", "stop", "restart"],
+                        help="comma separated: start,stop,restart")
+    parser.add_argument("--nodes", type=common.int_list, default=[25, 50, 100],
+                        help="comma separated cluster sizes")
+    parser.add_argument("--batch", type=int, default=10,
+                        help="nodes restarted at a time in a rolling restart")
+    parser.add_argument("--spacing", type=float, default=1.0,
+                        help="virtual seconds between restart batches")
+    parser.add_argument("--latency", type=float, default=0.001,
+                        help="virtual seconds per message")
+    parser.add_argument("--step", type=float, default=0.05,
+                        help="virtual seconds between convergence checks")
+    parser.add_argument("--timeout", type=float, default=120.0,
+                        help="virtual seconds before a scenario is given up")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed for the simulator")
+
+
+def main(args):
+    results = []
+    for nodes in args.nodes:
+        for name in args.scenarios:
+            results.append(Scenario(name, nodes, args).run())
+            common.print_table(results[-1:], COLUMNS)
+    print()
+    common.print_table(results, COLUMNS)
+    return results
@@ -0,0 +1,110 @@
+"""Encode and decode cost of the ZreMsg wire codec, per message type
+
+Messages are sent to and received from in-memory fake sockets, so only
+the codec is measured. HELLO is timed with varying group and header
+counts, WHISPER and SHOUT with varying payload sizes. Times are the best
+of --repeat runs of --number messages, in microseconds per message.
+"""
+
+import itertools
+import timeit
+import uuid
+
+import zmq
+
+from pyre.zre_msg import ZreMsg
+
+from . import common
+
+
+class FakeSocket(object):
+    """Enough of a zmq socket for ZreMsg.send and ZreMsg.recv"""
+
+    def __init__(self, type=zmq.ROUTER):
+        self.type = type
+        self.frames = None
+
+    def send_multipart(self, frames):
+        self.frames = frames
+
+    def recv_multipart(self):
+        # ZreMsg.recv pops frames, so hand out a copy
+        return list(self.frames)
+
+
+# Build a message of the given type filled in as the node would
+def make_msg(id, groups=0, headers=0, header_size=16, size=0):
+    msg = ZreMsg(id)
+    msg.set_address(uuid.uuid4())
+    msg.set_sequence(1234)
+    if id == ZreMsg.HELLO:
+        msg.set_endpoint("tcp://192.168.100.100:49152")
+        msg.set_groups(["group-{0}".format(i) for i in range(groups)])
+        msg.set_name("node-name")
+        msg.set_status(7)
+        msg.set_headers(dict(("X-HEADER-{0}".format(i), "v" * header_size) for i in range(headers)))
+    elif id in (ZreMsg.SHOUT, ZreMsg.JOIN, ZreMsg.LEAVE):
+        msg.set_group("group-name")
+        msg.set_status(7)
+    elif id == ZreMsg.NACK:
+        msg.set_count(3)
+    if id in (ZreMsg.WHISPER, ZreMsg.SHOUT):
+        msg.content = [b"x" * size]
+    return msg
+
+
+# Time encoding and decoding one message, returns microseconds per message
+def measure(msg, number, repeat):
+    out = FakeSocket()
+    encode = min(timeit.repeat(lambda: msg.send(out), number=number, repeat=repeat)) / number
+
+    # Prepend the routing id as a ROUTER inbox would see it
+    out.frames = [b"\x01" + msg.get_address().bytes] + out.frames[1:]
+    decode = min(timeit.repeat(lambda: ZreMsg().recv(out), number=number, repeat=repeat)) / number
+    return {
+        "encode_us": encode * 1e6,
+        "decode_us": decode * 1e6,
+        "wire_bytes": sum(len(f) for f in out.frames[1:]),
+    }
+
+
+# Return the list of cases to measure
+def cases(args):
+    for groups, headers in itertools.product(args.groups, args.headers):
+        yield "HELLO", make_msg(ZreMsg.HELLO, groups=groups, headers=headers,
+                                header_size=args.header_size), {"groups": groups, "headers": headers}
+    for name, id in (("WHISPER", ZreMsg.WHISPER), ("SHOUT", ZreMsg.SHOUT)):
+        for size in args.sizes:
+            yield name, make_msg(id, size=size), {"size": size}
+    for name, id in (("JOIN", ZreMsg.JOIN), ("LEAVE", ZreMsg.LEAVE), ("PING", ZreMsg.PING),
+                     ("PING_OK", ZreMsg.PING_OK), ("NACK", ZreMsg.NACK)):
+        yield name, make_msg(id), {}
+
+
+COLUMNS = ["type", "groups", "headers", "size", "wire_bytes", "encode_us", "decode_us"]
+
+
+def add_arguments(parser):
+    parser.add_argument("--groups", type=common.int_list, default=[0, 10, 100],
+                        help="comma separated group counts for HELLO")
+    parser.add_argument("--headers", type=common.int_list, default=[0, 10, 100],
+                        help="comma separated header counts for HELLO")
+    parser.add_argument("--header-size", type=int, default=32,
+                        help="bytes per header value")
+    parser.add_argument("--sizes", type=common.int_list, default=[0, 1024, 65536],
+                        help="comma separated payload sizes for WHISPER and SHOUT")
+    parser.add_argument("--number", type=int, default=2000,
+                        help="messages per timing run")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timing runs, the best one is reported")
+
+
+def main(args):
+    results = []
+    for name, msg, params in cases(args):
+        result = {"type": name}
+        result.update(params)
+        result.update(measure(msg, args.number, args.repeat))
+        results.append(result)
+    common.print_table(results, COLUMNS)
+    return results
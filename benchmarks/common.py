@@ -0,0 +1,113 @@
+"""Helpers shared by the benchmarks"""
+
+import json
+import math
+import platform
+import sys
+import time
+
+import zmq
+
+import pyre
+
+
+PERCENTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+
+
+# Return the nearest-rank percentiles of a list of samples
+def percentiles(samples):
+    ordered = sorted(samples)
+    result = {}
+    for key, fraction in PERCENTILES:
+        if not ordered:
+            result[key] = None
+            continue
+        rank = max(1, int(math.ceil(fraction * len(ordered))))
+        result[key] = ordered[rank - 1]
+    return result
+
+
+# Start a number of Pyre nodes in one group on their own beacon port, and
+# wait until they all see each other. setup is called with each node
+# before it starts.
+def start_nodes(count, port, group, interface=None, timeout=10.0, ctx=None, setup=None):
+    ctx = ctx or zmq.Context.instance()
+    nodes = []
+    for i in range(count):
+        node = pyre.Pyre("bench{0}".format(i), ctx=ctx)
+        node.set_port(str(port).encode('utf-8'))
+        if interface:
+            node.set_interface(interface)
+        node.join(group)
+        if setup:
+            setup(node)
+        node.start()
+        nodes.append(node)
+    wait_for_peers(nodes, group, timeout)
+    return nodes
+
+
+# Wait until every node sees all others in the group
+def wait_for_peers(nodes, group, timeout=10.0):
+    deadline = time.time() + timeout
+    for node in nodes:
+        while len(node.peers_by_group(group)) < len(nodes) - 1:
+            if time.time() > deadline:
+                raise RuntimeError("nodes didn't discover each other in {0}s".format(timeout))
+            time.sleep(0.05)
+
+
+def stop_nodes(nodes):
+    for node in nodes:
+        node.stop()
+
+
+# Describe the environment, so results from different runs can be compared
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "pyzmq": zmq.pyzmq_version(),
+        "libzmq": zmq.zmq_version(),
+        "pyre": pyre.__version__,
+    }
+
+
+# Save benchmark results as JSON
+def save_results(path, benchmark, params, results):
+    data = {
+        "benchmark": benchmark,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "argv": sys.argv,
+        "environment": environment(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+# Print rows of dicts as a table with the given columns
+def print_table(rows, columns):
+    widths = [max([len(c)] + [len(format_value(r.get(c))) for r in rows]) for c in columns]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(format_value(row.get(c)).rjust(w) for c, w in zip(columns, widths)))
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{0:.4g}".format(value)
+    return str(value)
+
+
+# Parse a comma separated list of ints or strings
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def str_list(value):
+    return [v for v in value.split(",") if v]
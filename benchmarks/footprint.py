@@ -0,0 +1,271 @@
+"""Memory and file descriptor footprint of a Pyre node, per peer and group
+
+Every case starts a fresh Pyre node on its own beacon port. A child
+process then plays --peers fake peers: each one connects a DEALER to the
+node and says HELLO, joining --groups groups and carrying one header of
+--header-size bytes. The node connects back to a sink socket in the
+child, so the node side pays for every peer as it would on a real
+network, while the fake peers' own sockets stay out of this process.
+
+Once the node knows all peers, the growth since the case started is
+reported, in total and per peer:
+
+    rss         resident set size of the process, from /proc
+    fds         open file descriptors, from /proc
+    node_py     Python heap allocated in the node thread modules
+                (pyre_node, pyre_peer, pyre_group, zre_msg, ...)
+    front_py    Python heap allocated in the front-end modules
+                (pyre, pyre_event, zactor, zhelper)
+
+With --shared-mailbox the node sends to all peers through one ROUTER
+socket instead of a DEALER socket per peer.
+
+The front-end receives every ENTER and JOIN event while the peers come
+in, as an application would. Heap sizes come from tracemalloc, whose own
+bookkeeping inflates rss; use --no-trace for rss and fds alone.
+"""
+
+import gc
+import itertools
+import multiprocessing
+import os
+import time
+import tracemalloc
+import uuid
+
+import zmq
+
+import pyre
+from pyre.zre_msg import ZreMsg
+
+from . import common
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+NODE_FILES = ("pyre_node.py", "pyre_peer.py", "pyre_group.py", "pyre_histogram.py",
+              "zre_msg.py", "zbeacon.py")
+FRONT_FILES = ("pyre.py", "pyre_event.py", "zactor.py", "zhelper.py")
+
+
+# Allow as many open files as the hard limit does
+def raise_fd_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# Return a zmq context that allows the given number of sockets
+def make_context(sockets):
+    ctx = zmq.Context()
+    ctx.set(zmq.MAX_SOCKETS, max(sockets, ctx.get(zmq.MAX_SOCKETS)))
+    return ctx
+
+
+# Return the resident set size of this process in bytes, or None
+def rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+# Return the number of open file descriptors of this process, or None
+def open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+# Return Python heap bytes allocated per set of files, from a tracemalloc
+# snapshot
+def heap(snapshot, *groups):
+    sizes = [0] * len(groups)
+    for stat in snapshot.statistics("filename"):
+        name = os.path.basename(stat.traceback[0].filename)
+        for i, files in enumerate(groups):
+            if name in files:
+                sizes[i] += stat.size
+    return sizes
+
+
+# Take a measurement of the whole process, after freeing what earlier
+# cases left behind
+def measure(trace):
+    gc.collect()
+    result = {"rss": rss(), "fds": open_fds()}
+    if trace:
+        result["node_py"], result["front_py"] = heap(tracemalloc.take_snapshot(),
+                                                     NODE_FILES, FRONT_FILES)
+    return result
+
+
+# Child process: say HELLO to the node from a number of fake peers and keep
+# them around until told to quit
+def fake_peers(conn, endpoint, count, groups, header_size):
+    raise_fd_limit()
+    ctx = make_context(count + 16)
+    sink = ctx.socket(zmq.ROUTER)
+    sink.setsockopt(zmq.LINGER, 0)
+    headers = {"X-FOOTPRINT": "v" * header_size} if header_size else {}
+    group_names = ["group-{0}".format(i) for i in range(groups)]
+
+    conn.recv()
+    sockets = []
+    for i in range(count):
+        identity = uuid.uuid4()
+        s = ctx.socket(zmq.DEALER)
+        s.setsockopt(zmq.LINGER, 0)
+        s.setsockopt(zmq.IDENTITY, b'\x01' + identity.bytes)
+        s.connect(endpoint)
+        msg = ZreMsg(ZreMsg.HELLO)
+        msg.set_sequence(1)
+        # The node purges peers on the same endpoint, so bind the sink
+        # once per peer
+        port = sink.bind_to_random_port("tcp://127.0.0.1")
+        msg.set_endpoint("tcp://127.0.0.1:{0}".format(port))
+        msg.set_groups(group_names)
+        msg.set_name("fake{0}".format(i))
+        msg.set_headers(headers)
+        msg.send(s)
+        sockets.append(s)
+    conn.send(count)
+
+    # Throw away whatever the node sends until we're told to quit
+    poller = zmq.Poller()
+    poller.register(sink, zmq.POLLIN)
+    while not conn.poll(0):
+        if poller.poll(100):
+            sink.recv_multipart()
+    for s in sockets:
+        s.close()
+    sink.close()
+    ctx.term()
+
+
+class Case(object):
+
+    def __init__(self, peers, groups, header_size, trace, shared_mailbox=False):
+        self.peers = peers
+        self.groups = groups
+        self.header_size = header_size
+        self.trace = trace
+        self.shared_mailbox = shared_mailbox
+        self.events = 0
+
+    # Receive events on the front-end until the node knows all peers
+    def wait_for_peers(self, node, timeout):
+        poller = zmq.Poller()
+        poller.register(node.socket(), zmq.POLLIN)
+        deadline = time.time() + timeout
+        known = 0
+        while known < self.peers:
+            if time.time() > deadline:
+                raise RuntimeError("node saw {0} of {1} peers in {2}s".format(known, self.peers, timeout))
+            while poller.poll(100):
+                node.recv()
+                self.events += 1
+            known = len(node.peers())
+        # Pick up the last JOIN events
+        while poller.poll(100):
+            node.recv()
+            self.events += 1
+
+    def run(self, port, interface, timeout):
+        ctx = make_context(self.peers + 64)
+        node = pyre.Pyre("footprint", ctx=ctx)
+        node.set_port(str(port).encode('utf-8'))
+        if interface:
+            node.set_interface(interface)
+        if self.shared_mailbox:
+            node.set_shared_mailbox()
+        node.start()
+
+        # Let the child set up before taking the baseline, so its pipe
+        # doesn't count against the node
+        mp = multiprocessing.get_context("spawn")
+        conn, child_conn = mp.Pipe()
+        child = mp.Process(target=fake_peers,
+                           args=(child_conn, node.endpoint(), self.peers, self.groups, self.header_size))
+        child.start()
+        try:
+            before = measure(self.trace)
+            conn.send("go")
+            conn.recv()
+            start = time.time()
+            self.wait_for_peers(node, timeout)
+            elapsed = time.time() - start
+            after = measure(self.trace)
+        finally:
+            node.stop()
+            conn.send("quit")
+            child.join()
+            ctx.destroy(linger=0)
+
+        result = {
+            "peers": self.peers,
+            "groups": self.groups,
+            "header_size": self.header_size,
+            "shared_mailbox": self.shared_mailbox,
+            "events": self.events,
+            "discovery": elapsed,
+        }
+        for key, value in after.items():
+            if value is None or before[key] is None:
+                result[key] = None
+                result[key + "_per_peer"] = None
+                continue
+            result[key] = value - before[key]
+            result[key + "_per_peer"] = float(value - before[key]) / self.peers if self.peers else None
+        return result
+
+
+COLUMNS = ["peers", "groups", "header_size", "events", "rss", "rss_per_peer", "fds",
+           "fds_per_peer", "node_py", "node_py_per_peer", "front_py", "front_py_per_peer"]
+
+
+def add_arguments(parser):
+    parser.add_argument("--peers", type=common.int_list, default=[10, 100, 500],
+                        help="comma separated peer counts")
+    parser.add_argument("--groups", type=common.int_list, default=[1, 10],
+                        help="comma separated counts of groups every peer joins")
+    parser.add_argument("--header-size", type=common.int_list, default=[0, 1024],
+                        help="comma separated header sizes in bytes, per peer")
+    parser.add_argument("--shared-mailbox", action="store_true",
+                        help="send to peers through one shared ROUTER socket")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="don't measure the Python heap with tracemalloc")
+    parser.add_argument("--port", type=int, default=5681,
+                        help="beacon port, keep it off production clusters")
+    parser.add_argument("--interface", default=None,
+                        help="network interface for beacons")
+    parser.add_argument("--timeout", type=float, default=20.0,
+                        help="seconds before a case is given up")
+
+
+def main(args):
+    raise_fd_limit()
+    trace = not args.no_trace
+    if trace:
+        tracemalloc.start()
+    results = []
+    try:
+        for peers, groups, header_size in itertools.product(args.peers, args.groups, args.header_size):
+            case = Case(peers, groups, header_size, trace, args.shared_mailbox)
+            results.append(case.run(args.port, args.interface, args.timeout))
+            common.print_table(results[-1:], COLUMNS)
+    finally:
+        if trace:
+            tracemalloc.stop()
+    print()
+    common.print_table(results, COLUMNS)
+    return results
@@ -0,0 +1,99 @@
+"""Time taken by import pyre, from python -X importtime
+
+Every run imports pyre in a fresh interpreter with -X importtime and reads
+the report it writes to stderr. A run that imports nothing else first
+pays for zmq too; with --preload zmq is imported before the timing
+starts, so only pyre's own modules and what they pull in are counted.
+Bytecode is written by a first run that isn't counted, unless --cold is
+given, in which case every run compiles from source.
+
+The total row is the cumulative time of the pyre package; the other rows
+are the modules it imports with the highest cumulative time, p50 over
+the runs, in microseconds:
+
+    self        time spent importing the module itself
+    cumulative  the same, plus the modules it imports
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+from . import common
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+# Import pyre in a new interpreter, return its report as a list of
+# (module, self, cumulative, depth)
+def import_once(preload, cold):
+    code = "import pyre"
+    if preload:
+        code = "import zmq; " + code
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [sys.executable, "-X", "importtime"]
+    if cold:
+        command.append("-B")
+    command += ["-c", code]
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode:
+        raise RuntimeError("import pyre failed:\n{0}".format(proc.stderr))
+    report = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative, indent, module = match.groups()
+            report.append((module, int(self_us), int(cumulative), len(indent)))
+    return report
+
+
+# The modules imported while pyre was, the package itself last
+def pyre_modules(report):
+    end = [i for i, entry in enumerate(report) if entry[0] == "pyre"][-1]
+    start = end
+    while start > 0 and report[start - 1][3] > report[end][3]:
+        start -= 1
+    return report[start:end + 1]
+
+
+def run(runs, preload, cold, top):
+    if not cold:
+        import_once(preload, cold)
+    samples = {}
+    for _ in range(runs):
+        for module, self_us, cumulative, _depth in pyre_modules(import_once(preload, cold)):
+            entry = samples.setdefault(module, ([], []))
+            entry[0].append(self_us)
+            entry[1].append(cumulative)
+
+    rows = []
+    for module, (self_us, cumulative) in samples.items():
+        rows.append({"module": module, "runs": len(cumulative),
+                     "self": common.percentiles(self_us)["p50"],
+                     "cumulative": common.percentiles(cumulative)["p50"]})
+    rows.sort(key=lambda row: row["cumulative"], reverse=True)
+    total = dict(rows[0], module="total (pyre)")
+    return [total] + rows[1:top + 1]
+
+
+COLUMNS = ["module", "runs", "self", "cumulative"]
+
+
+def add_arguments(parser):
+    parser.add_argument("--runs", type=int, default=20,
+                        help="interpreters started")
+    parser.add_argument("--preload", action="store_true",
+                        help="import zmq before the timing starts")
+    parser.add_argument("--cold", action="store_true",
+                        help="compile from source on every run")
+    parser.add_argument("--top", type=int, default=15,
+                        help="modules listed besides the total")
+
+
+def main(args):
+    results = run(args.runs, args.preload, args.cold, args.top)
+    common.print_table(results, COLUMNS)
+    return results
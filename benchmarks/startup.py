@@ -0,0 +1,136 @@
+"""Startup latency of a Pyre node, until peers see it
+
+A watcher node is started first on its own beacon port. Every run then
+constructs a new node on that port, starts it and waits until the watcher
+gets its ENTER event. Modes:
+
+    start       start() returns once the node has set up
+    async       start_async() returns at once, the node sets up in the
+                background
+
+Each run reports, from the start of construction:
+
+    construct   until the Pyre constructor returns
+    start       until start() or start_async() returns
+    ready       until the node has set up, when start() returns or the
+                future of start_async() is done
+    visible     until the watcher gets the ENTER event
+
+With --inline the nodes run their beacon in the node thread, see
+Pyre.set_inline_beacon().
+"""
+
+import time
+
+import zmq
+
+import pyre
+
+from . import common
+
+STAGES = ("construct", "start", "ready", "visible")
+
+
+class Case(object):
+
+    def __init__(self, mode, runs, inline=False):
+        self.mode = mode
+        self.runs = runs
+        self.inline = inline
+        self.samples = dict((stage, []) for stage in STAGES)
+
+    # Wait until the watcher sees a node of the given name
+    def wait_visible(self, watcher, name, timeout):
+        poller = zmq.Poller()
+        poller.register(watcher.socket(), zmq.POLLIN)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not poller.poll(100):
+                continue
+            msg = watcher.recv()
+            if msg[0] == b"ENTER" and msg[2] == name.encode('utf-8'):
+                return True
+        return False
+
+    def run_once(self, i, ctx, watcher, port, interface, timeout):
+        name = "startup{0}".format(i)
+        start = time.perf_counter()
+        node = pyre.Pyre(name, ctx=ctx)
+        constructed = time.perf_counter()
+        node.set_port(str(port).encode('utf-8'))
+        if interface:
+            node.set_interface(interface)
+        if self.inline:
+            node.set_inline_beacon()
+        ready = []
+        if self.mode == "async":
+            future = node.start_async()
+            started = time.perf_counter()
+            future.add_done_callback(lambda f: ready.append(time.perf_counter()))
+        else:
+            node.start()
+            started = time.perf_counter()
+            ready.append(started)
+        try:
+            if not self.wait_visible(watcher, name, timeout):
+                raise RuntimeError("{0} wasn't seen in {1}s".format(name, timeout))
+            visible = time.perf_counter()
+            if self.mode == "async":
+                future.result(timeout)
+        finally:
+            node.stop()
+        self.samples["construct"].append(constructed - start)
+        self.samples["start"].append(started - start)
+        self.samples["ready"].append(ready[0] - start)
+        self.samples["visible"].append(visible - start)
+
+    def run(self, port, interface, timeout):
+        ctx = zmq.Context.instance()
+        watcher = pyre.Pyre("watcher", ctx=ctx)
+        watcher.set_port(str(port).encode('utf-8'))
+        if interface:
+            watcher.set_interface(interface)
+        watcher.start()
+        try:
+            for i in range(self.runs):
+                self.run_once(i, ctx, watcher, port, interface, timeout)
+        finally:
+            watcher.stop()
+
+        result = {"mode": self.mode, "inline": self.inline, "runs": self.runs}
+        for stage in STAGES:
+            for key, value in common.percentiles(self.samples[stage]).items():
+                result[stage + "_" + key] = value
+        return result
+
+
+COLUMNS = ["mode", "inline", "runs", "construct_p50", "start_p50", "ready_p50",
+           "visible_p50", "visible_p99"]
+
+
+def add_arguments(parser):
+    parser.add_argument("--modes", type=common.str_list, default=["start", "async"],
+                        help="comma separated: start,async")
+    parser.add_argument("--runs", type=int, default=50,
+                        help="nodes started per case")
+    parser.add_argument("--inline", action="store_true",
+                        help="run beacons in the node threads")
+    parser.add_argument("--port", type=int, default=5682,
+                        help="beacon port, keep it off production clusters")
+    parser.add_argument("--interface", default=None,
+                        help="network interface for beacons")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds before a run is given up")
+
+
+def main(args):
+    results = []
+    for mode in args.modes:
+        if mode not in ("start", "async"):
+            raise SystemExit("unknown mode {0}".format(mode))
+        case = Case(mode, args.runs, args.inline)
+        results.append(case.run(args.port, args.interface, args.timeout))
+        common.print_table(results[-1:], COLUMNS)
+    print()
+    common.print_table(results, COLUMNS)
+    return results
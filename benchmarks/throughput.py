@@ -0,0 +1,181 @@
+"""Throughput and latency of SHOUT and WHISPER between Pyre nodes
+
+Every case starts a fresh set of nodes in one process, on their own beacon
+port, and waits until they all see each other. Producers then send as
+fast as flow control allows:
+
+    shout       each producer SHOUTs to the group, every other node
+                receives every message
+    whisper     each producer WHISPERs to the other nodes in turn
+
+With --publisher, SHOUTs are published once on a PUB socket instead of
+sent to every member's mailbox.
+
+Producers keep at most --window messages per producer in flight, so the
+peer mailboxes don't overflow. Latency is measured from the send time
+carried in each payload, and CPU per message is the process CPU time
+(node threads included) divided by the messages delivered.
+"""
+
+import itertools
+import struct
+import threading
+import time
+
+import zmq
+
+from . import common
+
+GROUP = "BENCH"
+STAMP = struct.Struct(">d")
+
+
+class Case(object):
+
+    def __init__(self, mode, nodes, size, producers, messages, window, publisher=False):
+        self.mode = mode
+        self.nodes = nodes
+        self.size = max(size, STAMP.size)
+        self.producers = producers
+        self.messages = messages
+        self.window = window
+        self.publisher = publisher
+        if mode == "shout":
+            self.expected = producers * messages * (nodes - 1)
+        else:
+            self.expected = producers * messages
+        self.sent = 0               # deliveries we expect from sends so far
+        self.delivered = 0
+        self.bytes = 0
+        self.latencies = []
+        self.last_at = None
+        self.cond = threading.Condition()
+        self.done = threading.Event()
+
+    # Send messages from one node
+    def produce(self, node, targets):
+        padding = b"x" * (self.size - STAMP.size)
+        fanout = len(targets) if self.mode == "shout" else 1
+        targets = itertools.cycle(targets)
+        limit = self.window * self.producers * fanout
+        for i in range(self.messages):
+            with self.cond:
+                while self.sent - self.delivered >= limit and not self.done.is_set():
+                    self.cond.wait(0.1)
+                self.sent += fanout
+            if self.done.is_set():
+                return
+            payload = STAMP.pack(time.perf_counter()) + padding
+            if self.mode == "shout":
+                node.shout(GROUP, payload)
+            else:
+                node.whisper(next(targets), payload)
+
+    # Receive messages on one node until the case is done
+    def consume(self, node):
+        poller = zmq.Poller()
+        poller.register(node.socket(), zmq.POLLIN)
+        while not self.done.is_set():
+            if not poller.poll(100):
+                continue
+            msg = node.recv()
+            if msg[0] not in (b"SHOUT", b"WHISPER"):
+                continue
+            payload = msg[-1]
+            latency = time.perf_counter() - STAMP.unpack_from(payload)[0]
+            with self.cond:
+                self.delivered += 1
+                self.bytes += len(payload)
+                self.latencies.append(latency)
+                self.last_at = time.perf_counter()
+                if self.delivered >= self.expected:
+                    self.done.set()
+                self.cond.notify_all()
+
+    def run(self, port, interface, timeout):
+        setup = (lambda node: node.set_shout_publisher()) if self.publisher else None
+        nodes = common.start_nodes(self.nodes, port, GROUP, interface, setup=setup)
+        if self.publisher:
+            # give the subscriptions time to reach the publishers
+            time.sleep(0.5)
+        try:
+            uuids = [node.uuid() for node in nodes]
+            threads = [threading.Thread(target=self.consume, args=(node,)) for node in nodes]
+            for i in range(self.producers):
+                targets = [u for u in uuids if u != uuids[i]]
+                threads.append(threading.Thread(target=self.produce, args=(nodes[i], targets)))
+
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            complete = self.done.wait(timeout)
+            self.done.set()
+            for t in threads:
+                t.join()
+            cpu = time.process_time() - cpu_start
+        finally:
+            common.stop_nodes(nodes)
+
+        elapsed = (self.last_at or time.perf_counter()) - start
+        result = {
+            "mode": self.mode,
+            "nodes": self.nodes,
+            "size": self.size,
+            "producers": self.producers,
+            "publisher": self.publisher,
+            "messages": self.messages,
+            "delivered": self.delivered,
+            "expected": self.expected,
+            "complete": complete,
+            "elapsed": elapsed,
+            "msgs_per_sec": self.delivered / elapsed if elapsed > 0 else None,
+            "mb_per_sec": self.bytes / elapsed / 1e6 if elapsed > 0 else None,
+            "cpu_us_per_msg": cpu / self.delivered * 1e6 if self.delivered else None,
+        }
+        for key, value in common.percentiles(self.latencies).items():
+            result["latency_" + key] = value
+        return result
+
+
+COLUMNS = ["mode", "nodes", "size", "producers", "delivered", "msgs_per_sec",
+           "mb_per_sec", "latency_p50", "latency_p99", "latency_p999",
+           "cpu_us_per_msg"]
+
+
+def add_arguments(parser):
+    parser.add_argument("--modes", type=common.str_list, default=["shout", "whisper"],
+                        help="comma separated: shout,whisper")
+    parser.add_argument("--nodes", type=common.int_list, default=[2, 4],
+                        help="comma separated group sizes")
+    parser.add_argument("--sizes", type=common.int_list, default=[16, 1024, 65536],
+                        help="comma separated payload sizes in bytes")
+    parser.add_argument("--producers", type=common.int_list, default=[1],
+                        help="comma separated producer counts")
+    parser.add_argument("--messages", type=int, default=10000,
+                        help="messages per producer")
+    parser.add_argument("--window", type=int, default=500,
+                        help="messages in flight per producer")
+    parser.add_argument("--publisher", action="store_true",
+                        help="publish SHOUTs on a PUB socket")
+    parser.add_argument("--port", type=int, default=5680,
+                        help="beacon port, keep it off production clusters")
+    parser.add_argument("--interface", default=None,
+                        help="network interface for beacons")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds before a case is given up")
+
+
+def main(args):
+    results = []
+    for mode, nodes, size, producers in itertools.product(args.modes, args.nodes, args.sizes, args.producers):
+        if mode not in ("shout", "whisper"):
+            raise SystemExit("unknown mode {0}".format(mode))
+        if nodes < 2 or producers > nodes:
+            continue
+        case = Case(mode, nodes, size, producers, args.messages, args.window, args.publisher)
+        results.append(case.run(args.port, args.interface, args.timeout))
+        common.print_table(results[-1:], COLUMNS)
+    print()
+    common.print_table(results, COLUMNS)
+    return results
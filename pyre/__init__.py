@@ -1,6 +1,7 @@
-__all__ = ['pyre', 'zbeacon', 'zhelper']
+__all__ = ['pyre', 'zbeacon', 'zgossip', 'zhelper']
 __version__ = '0.3.5'
 __version_info__ = tuple(int(v) for v in __version__.split('.'))
 
 from .pyre import Pyre
 from .pyre_event import PyreEvent
+from .pyre_reactor import PyreReactor
@@ -5,14 +5,15 @@ import socket
 import uuid
 import logging
 import sys
+import threading
 
 # local modules
 from . import __version_info__
 from . import zbeacon
 from . import zhelper
-from .zactor import ZActor
+from .zactor import ZActor, ZProcessActor
 from .zsocket import ZSocket
-from .pyre_node import PyreNode
+from .pyre_node import PyreNode, process_node
 from .pyre_event import PyreEvent
 
 logger = logging.getLogger(__name__)
@@ -25,7 +26,7 @@ except NameError:
 
 class Pyre(object):
 
-    def __init__(self, name=None, ctx=None, *args, **kwargs):
+    def __init__(self, name=None, ctx=None, reactor=None, process=False, *args, **kwargs):
         """Constructor, creates a new Zyre node. Note that until you start the
         node it is silent and invisible to other nodes on the network.
         The node name is provided to other nodes during discovery. If you
@@ -35,20 +36,37 @@ class Pyre(object):
             name (str): The name of the node
 
         Kwargs:
-            ctx: PyZMQ Context, if not specified a new context will be created
+            ctx: PyZMQ Context, if not specified a new context will be created.
+                Nodes on the same context talk to each other over inproc.
+            reactor: PyreReactor to run the node on, instead of a thread of
+                its own. The node uses the reactor's context unless given one.
+            process (bool): Run the node in a child process, so protocol
+                work doesn't compete with the application for the GIL. The
+                process is started with multiprocessing spawn, so guard the
+                main code of your program with if __name__ == '__main__'.
         """
         super(Pyre, self).__init__(*args, **kwargs)
-        ctx = kwargs.get('ctx')
-        if ctx == None:
-            ctx = zmq.Context()
+        if ctx is None:
+            ctx = reactor.ctx if reactor else zmq.Context()
         self._ctx = ctx
         self._uuid = None
         self._name = name
         self.verbose = False
-        self.inbox, self._outbox = zhelper.zcreate_pipe(self._ctx)
+        self._recv_count = 0
+        self._inbox_endpoint = None
 
         # Start node engine and wait for it to be ready
-        self.actor = ZActor(self._ctx, PyreNode, self._outbox)
+        if process:
+            # The node's outbox connects to our inbox from its process
+            self.inbox, self._inbox_endpoint = zhelper.zbind_pipe(self._ctx)
+            self._outbox = None
+            self.actor = ZProcessActor(self._ctx, process_node, self._inbox_endpoint)
+        elif reactor:
+            self.inbox, self._outbox = zhelper.zcreate_pipe(self._ctx)
+            self.actor = reactor.attach(self._ctx, self._outbox)
+        else:
+            self.inbox, self._outbox = zhelper.zcreate_pipe(self._ctx)
+            self.actor = ZActor(self._ctx, PyreNode, self._outbox)
         # Send name, if any, to node backend
         if (self._name):
             self.actor.send_unicode("SET NAME", zmq.SNDMORE)
@@ -111,7 +129,83 @@ class Pyre(object):
         """Set UDP beacon discovery interval, in milliseconds. Default is instant
         beacon exploration followed by pinging every 1,000 msecs."""
         self.actor.send_unicode("SET INTERVAL", zmq.SNDMORE)
-        self.actor.send_unicode(interval)
+        self.actor.send_unicode(str(interval))
+
+    def set_max_interval(self, interval):
+        """Back UDP beacons off while the peers we know don't change: the
+        interval doubles after every beacon, up to this many milliseconds.
+        When a peer comes or goes it drops back to the one set with
+        set_interval(). The maximum is told to peers in the X-PYRE-INTERVAL
+        header, so they wait longer for our beacons before they ping us or
+        give up on us. Has no effect after start()."""
+        self.actor.send_unicode("SET MAX INTERVAL", zmq.SNDMORE)
+        self.actor.send_unicode(str(interval))
+
+    def set_latency(self):
+        """Measure message latency from peers; peers are asked to timestamp
+        the WHISPER and SHOUT messages they send us, and clock offsets are
+        estimated from PING round trips. Has no effect after start()."""
+        self.actor.send_unicode("SET LATENCY")
+
+    def set_shared_mailbox(self):
+        """Send to all peers through a single ROUTER socket, connected to
+        every peer, rather than through a DEALER socket per peer. This saves
+        a socket and its file descriptors per peer; peers see no difference
+        on the wire. Only peers discovered after this call are affected."""
+        self.actor.send_unicode("SET SHARED MAILBOX")
+
+    def set_super_peer(self):
+        """Take part in super-peer mode as a super-peer, which is told to
+        other nodes with the X-PYRE-SUPER header. Super-peers connect to each
+        other and to their share of the leaves, and relay SHOUTs and WHISPERs
+        for them. All nodes in the cluster should be either super-peers or
+        leaves, see set_leaf(). Call before start()."""
+        self.actor.send_unicode("SET SUPER PEER")
+
+    def set_leaf(self):
+        """Take part in super-peer mode as a leaf. A leaf connects to a
+        single super-peer, its home, and sends its SHOUTs and WHISPERs
+        through it; the only peer it sees is its home. Each leaf's home is
+        picked by hashing among the super-peers alive, so leaves spread
+        over the super-peers and move on when their home goes away. Events
+        relayed from other nodes carry the UUID and name of the node that
+        sent them. Call before start()."""
+        self.actor.send_unicode("SET LEAF")
+
+    def set_shout_publisher(self):
+        """Publish our SHOUTs on a PUB socket, advertised in the X-PYRE-PUB
+        header. Members subscribe to the groups they're in, so a SHOUT is
+        sent once and libzmq copies it to each of them. Members that can't
+        subscribe get it in their mailbox as usual. Published SHOUTs keep
+        their order, but not with our other messages, e.g. a WHISPER sent
+        before a SHOUT may arrive after it. Call before start()."""
+        self.actor.send_unicode("SET PUBLISHER")
+
+    def set_shout_fanout(self, fanout):
+        """Send our SHOUTs down a spanning tree of the group instead of to
+        every member. Each member passes a SHOUT on to at most fanout others,
+        so no node sends more than fanout copies. The tree is built from
+        the sorted member UUIDs, so SHOUTs from one sender keep their order,
+        and receivers see the sender's UUID and name as usual. Members that
+        don't support trees get the SHOUT from us. 0 turns trees off."""
+        self.actor.send_unicode("SET SHOUT FANOUT", zmq.SNDMORE)
+        self.actor.send_unicode(str(fanout))
+
+    def set_mailbox_idle(self, seconds):
+        """Close the connection to peers that are in none of our groups once
+        we haven't sent them anything for this many seconds. The connection
+        is opened again when we send to the peer, e.g. a WHISPER, a PING or
+        a JOIN, and when the peer joins one of our groups. Receiving from
+        the peer is not affected."""
+        self.actor.send_unicode("SET MAILBOX IDLE", zmq.SNDMORE)
+        self.actor.send_unicode(str(seconds))
+
+    def set_inline_beacon(self):
+        """Run the UDP beacon in the node's thread, polling its socket
+        alongside the node's sockets, instead of in a ZBeacon actor of its
+        own. This saves a thread per node, and the pipe message each beacon
+        takes from the actor to the node. Call before start()."""
+        self.actor.send_unicode("SET INLINE BEACON")
 
     def set_interface(self, value):
         """Set network interface for UDP beacons. If you do not set this, CZMQ will
@@ -120,7 +214,6 @@ class Pyre(object):
         self.actor.send_unicode("SET INTERFACE", zmq.SNDMORE)
         self.actor.send_unicode(value)
 
-    # TODO: check args from zyre
     def set_endpoint(self, format, *args):
         """By default, Zyre binds to an ephemeral TCP port and broadcasts the local
         host name using UDP beaconing. When you call this method, Zyre will use
@@ -131,11 +224,36 @@ class Pyre(object):
         that is meaningful to remote as well as local nodes). Returns 0 if
         the bind was successful, else -1."""
         self.actor.send_unicode("SET ENDPOINT", zmq.SNDMORE)
-        self.actor.send_unicode(format)
-
-    # TODO: We haven't implemented gossiping yet
-    #def gossip_bind(self, format, *args):
-    #def gossip_connect(self, format, *args):
+        self.actor.send_unicode(format % args if args else format)
+        return 0 if self.actor.resolve().wait() == 0 else -1
+
+    def bind(self, format, *args):
+        """Bind the node's inbox to an extra endpoint, which peers may
+        connect to as well as to the public one. You can use inproc://,
+        ipc://, or tcp:// transports. Returns 0 if the bind was successful,
+        else -1."""
+        self.actor.send_unicode("BIND", zmq.SNDMORE)
+        self.actor.send_unicode(format % args if args else format)
+        return 0 if self.actor.resolve().wait() == 0 else -1
+
+    def gossip_bind(self, format, *args):
+        """Set up gossip discovery of other nodes. At least one node in the
+        cluster must bind to a well-known gossip endpoint, so other nodes
+        can connect to it. Note that gossip endpoints are completely
+        distinct from Zyre node endpoints, and should not overlap (they can
+        use the same transport). Gossip replaces UDP beacons, so the node
+        needs an endpoint, see set_endpoint()."""
+        self.actor.send_unicode("GOSSIP BIND", zmq.SNDMORE)
+        self.actor.send_unicode(format % args if args else format)
+
+    def gossip_connect(self, format, *args):
+        """Set up gossip discovery of other nodes. A node may connect to
+        multiple other nodes, for redundancy paths. Nodes pass on to each
+        other only the endpoints that are new to them, so the gossip network
+        may have loops. Gossip replaces UDP beacons, so the node needs an
+        endpoint, see set_endpoint()."""
+        self.actor.send_unicode("GOSSIP CONNECT", zmq.SNDMORE)
+        self.actor.send_unicode(format % args if args else format)
 
     def start(self):
         """Start node, after setting header values. When you start a node it
@@ -145,6 +263,30 @@ class Pyre(object):
         # the backend will signal back
         self.actor.resolve().wait()
 
+    def start_async(self):
+        """Start node like start(), but return at once. The node sets up in
+        the background, and sends its first beacon as soon as it can.
+        Returns a concurrent.futures.Future, whose result is 0 once the node
+        has started. You can use the node straight away, commands wait in
+        order until it has started."""
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        # A node in a process of its own can't reach us over inproc
+        ready, endpoint = zhelper.zbind_pipe(self._ctx, local=not self._inbox_endpoint)
+        self.actor.send_unicode("START", zmq.SNDMORE)
+        self.actor.send_unicode(endpoint)
+        thread = threading.Thread(target=self._wait_started, args=(ready, endpoint, future))
+        thread.daemon = True
+        thread.start()
+        return future
+
+    # Complete the future of start_async() once the node signals
+    def _wait_started(self, ready, endpoint, future):
+        status = ready.wait()
+        ready.close()
+        zhelper.zremove_pipe(endpoint)
+        future.set_result(status)
+
     def stop(self):
         """Stop node; this signals to other peers that this node will go away.
         This is polite; however you can also just destroy the node without
@@ -153,13 +295,17 @@ class Pyre(object):
         # the backend will signal back
         self.actor.resolve().wait()
         self.actor.destroy()
+        if self._inbox_endpoint:
+            zhelper.zremove_pipe(self._inbox_endpoint)
 
     # Receive next message from node
     def recv(self):
         """Receive next message from network; the message may be a control
         message (ENTER, EXIT, JOIN, LEAVE) or data (WHISPER, SHOUT).
         """
-        return self.inbox.recv_multipart()
+        msg = self.inbox.recv_multipart()
+        self._recv_count += 1
+        return msg
 
     def join(self, group):
         """Join a named group; after joining a group you can send messages to
@@ -282,6 +428,42 @@ class Pyre(object):
         groups = self.actor.recv_pyobj()
         return groups
 
+    def stats(self):
+        """Return a snapshot of the node's traffic counters, as a dict with:
+
+            peers: per peer UUID, messages and bytes sent and received,
+                including resends and resend requests, drops on EAGAIN,
+                sequence gaps, resends, pings sent and received and the
+                number of sent messages kept for resending (window)
+            groups: per group name, SHOUT messages and content bytes sent
+                and received
+            outbox_depth: events waiting to be received by recv(). Events
+                read straight from the socket() aren't seen by recv(), so
+                outbox_depth is only meaningful when recv() is used.
+        """
+        self.actor.send_unicode("STATS")
+        stats = self.actor.recv_pyobj()
+        stats["outbox_depth"] = stats.pop("outbox_sent") - self._recv_count
+        return stats
+
+    def latency(self):
+        """Return a snapshot of latency measured with set_latency(), as a dict
+        with:
+
+            peers: per peer UUID, smoothed round trip time, clock offset
+                and a summary of the latency of messages from the peer
+            groups: per group name, a summary of the latency of SHOUTs
+
+        Summaries hold the count, min, mean, p50, p99, p999 and max latency
+        in seconds.
+        """
+        self.actor.send_unicode("LATENCY")
+        return self.actor.recv_pyobj()
+
+    def dump(self):
+        """Log the node's state and traffic counters"""
+        self.actor.send_unicode("DUMP")
+
     # Return node socket, for direct polling of socket
     def socket(self):
         """Return socket for talking to the Zyre node, for polling"""
@@ -1,4 +1,5 @@
 import logging
+from .pyre_histogram import PyreHistogram
 
 logger = logging.getLogger(__name__)
 
@@ -9,6 +10,11 @@ class PyreGroup(object):
         self.name = name
         # TODO perhaps warn if peers is not a set type
         self.peers = peers
+        self.msgs_sent = 0      # SHOUTs sent to this group
+        self.bytes_sent = 0     # Content bytes of those SHOUTs
+        self.msgs_recv = 0      # SHOUTs received in this group
+        self.bytes_recv = 0
+        self.latency = None     # Histogram of SHOUT latency
 
     #def __del__(self):
 
@@ -38,3 +44,34 @@ class PyreGroup(object):
     def send(self, msg):
         for p in self.peers.values():
             p.send(msg)
+
+    # Count a message sent to group
+    def count_sent(self, msg):
+        self.msgs_sent += 1
+        self.bytes_sent += msg.get_content_size()
+
+    # Count a message received in group
+    def count_recv(self, msg):
+        self.msgs_recv += 1
+        self.bytes_recv += msg.get_content_size()
+
+    # Record the latency of a SHOUT received in group
+    def record_latency(self, latency):
+        if self.latency is None:
+            self.latency = PyreHistogram()
+        self.latency.record(latency)
+
+    # Get group latency histogram summary
+    def get_latency(self):
+        if self.latency is None:
+            return {"count": 0}
+        return self.latency.get_stats()
+
+    # Get group traffic counters
+    def get_stats(self):
+        return {
+            "msgs_sent": self.msgs_sent,
+            "bytes_sent": self.bytes_sent,
+            "msgs_recv": self.msgs_recv,
+            "bytes_recv": self.bytes_recv,
+        }
@@ -0,0 +1,72 @@
+import math
+
+
+class PyreHistogram(object):
+    """Fixed memory histogram of latencies, in seconds
+
+    Samples are counted in logarithmic buckets, SUB_BUCKETS for every power
+    of two microseconds, so percentiles are accurate to within about 19%
+    whatever the number of samples.
+    """
+
+    SUB_BUCKETS = 4          # buckets per power of two
+    MAX_POWER = 32           # up to 2^32 usecs (about 71 minutes)
+
+    def __init__(self):
+        self.buckets = [0] * (self.MAX_POWER * self.SUB_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __repr__(self):
+        return "PyreHistogram(count={0})".format(self.count)
+
+    # Return bucket index for a value in seconds
+    def _bucket(self, value):
+        usecs = value * 1e6
+        if usecs < 1:
+            return 0
+        index = int(math.log(usecs, 2) * self.SUB_BUCKETS) + 1
+        return min(index, len(self.buckets) - 1)
+
+    # Return upper bound of a bucket in seconds
+    def _bound(self, index):
+        return 2 ** (index / float(self.SUB_BUCKETS)) / 1e6
+
+    # Record a sample in seconds, negative samples are counted as zero
+    def record(self, value):
+        value = max(value, 0.0)
+        self.buckets[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Return the value below which the given fraction of samples fall
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self._bound(index), self.max)
+        return self.max
+
+    # Get a summary of the samples
+    def get_stats(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": self.min,
+            "mean": self.total / self.count,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "p999": self.percentile(0.999),
+            "max": self.max,
+        }
@@ -5,8 +5,13 @@ import struct
 import socket
 import time
 import sys
+import os
+import threading
+import weakref
+from collections import deque
+from . import zhelper
 from .zactor import ZActor
-from .zbeacon import ZBeacon
+from .zbeacon import ZBeacon, InlineBeacon, INTERVAL_DFLT
 from .zre_msg import ZreMsg
 from .pyre_peer import PyrePeer
 from .pyre_group import PyreGroup
@@ -15,9 +20,14 @@ from .pyre_group import PyreGroup
 BEACON_VERSION = 1
 ZRE_DISCOVERY_PORT = 5670
 REAP_INTERVAL = 1.0  # Once per second
+PIPE_LINGER = 1000  # Msecs to flush what we send on a pipe we close
 
 logger = logging.getLogger(__name__)
 
+# Nodes bound to inproc, per context: zmq.Context: (token, set of UUIDs)
+_inproc_nodes = weakref.WeakKeyDictionary()
+_inproc_lock = threading.Lock()
+
 class PyreNode(object):
 
     def __init__(self, ctx, pipe, outbox, *args, **kwargs):
@@ -30,8 +40,11 @@ class PyreNode(object):
         self.interface_name = None                  # Network interface
         self.beacon_port = ZRE_DISCOVERY_PORT       # Beacon port number
         self.interval = 0                           # Beacon interval 0=default
+        self.max_interval = 0                       # Back beacons off up to this, 0=never
         self.beacon = None                          # Beacon actor
         self.beacon_socket = None                   # Beacon socket for polling
+        self.inline_beacon = False                  # Run the beacon in our thread
+        self.reap_at = 0                            # Next time we ping and reap peers
         self.poller = zmq.Poller()                  # Socket poller
         self.identity = uuid.uuid4()                # Our UUID as object
         self.bound = False
@@ -49,7 +62,35 @@ class PyreNode(object):
         self.peer_groups = {}                       # Groups that our peers are in
         self.own_groups = {}                        # Groups that we are in
         self.headers = {}                           # Our header values
-        # TODO: gossip stuff
+        self.capabilities = {PyrePeer.NACK_HEADER: "1",
+                             PyrePeer.TIMESTAMP_HEADER: "1",
+                             PyrePeer.TREE_HEADER: "1",
+                             PyrePeer.SUB_HEADER: "1"}
+                                                    # Protocol extensions we support,
+                                                    # advertised as HELLO headers
+        self.outbox_sent = 0                        # Events sent to application
+        self.latency = False                        # Measure latency from peers
+        self.clock = time.time                      # Clock for peer timers
+        self.router = None                          # Mailbox shared by all peers, if any
+        self.mailbox_idle = None                    # Park mailboxes idle this long, None=never
+        self.role = None                            # "super" or "leaf" in super-peer mode
+        self.supers = set()                         # Super-peers we know of
+        self.standby = {}                           # Nodes we know but don't connect to,
+                                                    # UUID: (endpoint, expired_at)
+        self.shout_fanout = 0                       # Send SHOUTs down a tree, 0=to all
+        self.tree_sequence = 0                      # Our tree SHOUT counter
+        self.tree_seen = {}                         # Recent tree SHOUTs per sender
+        self.publish = False                        # Publish our SHOUTs on a PUB socket
+        self.publisher = None                       # PUB socket for our SHOUTs
+        self.pub_sequences = {}                     # Last SHOUT published per group
+        self.subscriber = None                      # SUB socket for peers' SHOUTs
+        self.ipc = zmq.has("ipc")                   # Reach peers on this host over ipc://
+        self.ipc_endpoint = None                    # Our ipc:// inbox endpoint, if bound
+        self.inproc = True                          # Reach peers on our context over inproc://
+        self.inproc_token = None                    # Token of our context, if bound to inproc
+        self.inproc_peers = ()                      # UUIDs of nodes bound to inproc on our context
+        self.gossip = None                          # Gossip discovery service, if any
+        self.gossip_socket = None                   # Gossip socket for polling
         #self.start()
         self.run()
 
@@ -57,13 +98,11 @@ class PyreNode(object):
         # destroy beacon
 
     def start(self):
-        # TODO: If application didn't bind explicitly, we grab an ephemeral port
-        # on all available network interfaces. This is orthogonal to
-        # beaconing, since we can connect to other peers and they will
-        # gossip our endpoint to others.
+        # Without beacons, peers learn our endpoint through gossip, so the
+        # application binds it explicitly with SET ENDPOINT.
         if self.beacon_port:
             # Start beacon discovery
-            self.beacon = ZActor(self._ctx, ZBeacon)
+            self.beacon = self.create_beacon()
 
             if self._verbose:
                 self.beacon.send_unicode("VERBOSE")
@@ -72,15 +111,21 @@ class PyreNode(object):
                 self.beacon.send_unicode("SET INTERFACE", zmq.SNDMORE)
                 self.beacon.send_unicode(self.interface_name)
 
-            # Our hostname is provided by zbeacon
+            # The beacon sets its UDP socket up while we bind, and tells us
+            # our hostname when done
             self.beacon.send_unicode("CONFIGURE", zmq.SNDMORE)
             self.beacon.send(struct.pack("I", self.beacon_port))
-            hostname = self.beacon.recv_unicode()
 
-            #if self.interval:
-            #   self.beacon.set_interval(self.interval)
+            if self.interval:
+                self.beacon.send_unicode("SET INTERVAL", zmq.SNDMORE)
+                self.beacon.send_unicode(str(self.interval))
+            if self.max_interval:
+                self.beacon.send_unicode("SET MAX INTERVAL", zmq.SNDMORE)
+                self.beacon.send_unicode(str(self.max_interval))
+                if self.max_interval > (self.interval or INTERVAL_DFLT * 1000):
+                    # Peers wait longer for our beacons before pinging us
+                    self.capabilities[PyrePeer.INTERVAL_HEADER] = str(self.max_interval)
 
-            # Our hostname is provided by zbeacon
             self.port = self.inbox.bind_to_random_port("tcp://*")
             if self.port < 0:
                 # Die on bad interface or port exhaustion
@@ -88,9 +133,25 @@ class PyreNode(object):
                 sys.exit(-1)
             else:
                 self.bound = True
-            self.endpoint = "tcp://%s:%d" %(hostname, self.port)
 
-            # Set broadcast/listen beacon
+            # Peers on this host find our ipc endpoint from our UUID, or
+            # from our HELLO
+            if self.ipc and self.bind(self.local_ipc_endpoint(self.identity)) == 0:
+                self.ipc_endpoint = self.local_ipc_endpoint(self.identity)
+                self.capabilities[PyrePeer.IPC_HEADER] = self.ipc_endpoint
+
+            # Nodes on our context find our inproc endpoint the same way,
+            # they know us from the token
+            if self.inproc and self.bind(self.local_inproc_endpoint(self.identity)) == 0:
+                with _inproc_lock:
+                    self.inproc_token, self.inproc_peers = _inproc_nodes.setdefault(
+                        self._ctx, (uuid.uuid4().hex, set()))
+                    self.inproc_peers.add(self.identity)
+                self.capabilities[PyrePeer.CONTEXT_HEADER] = self.inproc_token
+
+            # Set broadcast/listen beacon. Our first beacon goes out as soon
+            # as the beacon is set up; we only say HELLO to peers once we're
+            # done here.
             transmit = struct.pack('cccb16sH', b'Z', b'R', b'E',
                                    BEACON_VERSION, self.identity.bytes,
                                    socket.htons(self.port))
@@ -100,16 +161,58 @@ class PyreNode(object):
             filter = struct.pack("ccc", b'Z', b'R', b'E')
             self.beacon.send_unicode("SUBSCRIBE",zmq.SNDMORE)
             self.beacon.send(filter)
+            # Beacons of peers we know come in a batch once a second
+            self.beacon.send_unicode("SET REFRESH", zmq.SNDMORE)
+            self.beacon.send_unicode(str(int(REAP_INTERVAL * 1000)))
+
+            hostname = self.beacon.recv_unicode()
+            self.endpoint = "tcp://%s:%d" %(hostname, self.port)
+
+            if self.publish:
+                self.publisher = self._ctx.socket(zmq.PUB)
+                self.publisher.setsockopt(zmq.LINGER, 0)
+                self.publisher.setsockopt(zmq.SNDHWM, PyrePeer.PEER_EXPIRED * 100)
+                port = self.publisher.bind_to_random_port("tcp://*")
+                self.capabilities[PyrePeer.PUB_HEADER] = "tcp://%s:%d" % (hostname, port)
 
             self.beacon_socket = self.beacon.resolve()
             self.poller.register(self.beacon_socket, zmq.POLLIN)
-        #else:
-        # TODO: gossip stuff
+        elif self.gossip:
+            # Peers learn our endpoint from the gossip network
+            if self.endpoint:
+                self.gossip.send_unicode("PUBLISH", zmq.SNDMORE)
+                self.gossip.send_unicode(self.identity.hex, zmq.SNDMORE)
+                self.gossip.send_unicode(self.endpoint)
+            else:
+                logger.warning("Gossip discovery needs an endpoint, see set_endpoint()")
 
         # Start polling on inbox
         self.poller.register(self.inbox, zmq.POLLIN)
         #logger.debug("Node identity: {0}".format(self.identity))
 
+    # Create the beacon actor used for discovery
+    def create_beacon(self):
+        if self.inline_beacon:
+            return InlineBeacon(self._ctx)
+        return ZActor(self._ctx, ZBeacon)
+
+    # Membership changed, so beacon at the short interval again until it
+    # settles
+    def beacon_burst(self):
+        if self.beacon and self.max_interval:
+            self.beacon.send_unicode("BURST")
+
+    # Start the gossip service, which replaces beacons for discovery
+    def gossip_start(self):
+        if not self.gossip:
+            self.beacon_port = 0
+            from .zgossip import ZGossip
+            self.gossip = ZActor(self._ctx, ZGossip)
+            if self._verbose:
+                self.gossip.send_unicode("VERBOSE")
+            self.gossip_socket = self.gossip.resolve()
+            self.poller.register(self.gossip_socket, zmq.POLLIN)
+
     def stop(self):
         logger.debug("Pyre node: stopping beacon")
         if self.beacon:
@@ -119,30 +222,128 @@ class PyreNode(object):
                                        socket.htons(0))
                 self.beacon.send_unicode("PUBLISH", zmq.SNDMORE)
                 self.beacon.send(stop_transmit)
-                # Give time for beacon to go out
-                time.sleep(0.001)
+                # The beacon sends it before it takes the $TERM of destroy()
             self.poller.unregister(self.beacon_socket)
             self.beacon.destroy()
             self.beacon = None
             self.beacon_socket = None
 
+        if self.gossip:
+            # Retract our endpoint; the actor lingers to get it out
+            self.gossip.send_unicode("PUBLISH", zmq.SNDMORE)
+            self.gossip.send_unicode(self.identity.hex, zmq.SNDMORE)
+            self.gossip.send_unicode("")
+            self.poller.unregister(self.gossip_socket)
+            self.gossip.destroy()
+            self.gossip = None
+            self.gossip_socket = None
+
         self.beacon_port = 0
 
         if self.bound:
             # Stop polling on inbox
             self.poller.unregister(self.inbox)
+        if self.ipc_endpoint:
+            # Don't leave our socket file behind
+            self.inbox.unbind(self.ipc_endpoint)
+            try:
+                os.unlink(self.ipc_endpoint[6:])
+            except OSError:
+                pass
+            self.ipc_endpoint = None
+        if self.inproc_token:
+            with _inproc_lock:
+                self.inproc_peers.discard(self.identity)
+            self.inbox.unbind(self.local_inproc_endpoint(self.identity))
+            self.inproc_token = None
         self.outbox.send_unicode("STOP", zmq.SNDMORE)
         self.outbox.send(self.identity.bytes, zmq.SNDMORE)
         self.outbox.send_unicode(self.name)
+        self.outbox_sent += 1
 
+    # Bind our inbox to an endpoint, in addition to any others. Returns 0
+    # if the bind was successful, else -1
     def bind(self, endpoint):
-        logger.warning("Not implemented")
+        try:
+            self.inbox.bind(endpoint)
+        except zmq.ZMQError as e:
+            logger.warning("Can't bind to {0}: {1}".format(endpoint, e))
+            return -1
+        self.bound = True
+        return 0
+
+    # Return the ipc endpoint a node on this host binds its inbox to
+    @staticmethod
+    def local_ipc_endpoint(identity):
+        import tempfile
+        return "ipc://" + os.path.join(tempfile.gettempdir(), "pyre-{0}.ipc".format(identity.hex))
+
+    # Return the inproc endpoint a node binds its inbox to
+    @staticmethod
+    def local_inproc_endpoint(identity):
+        return "inproc://pyre-{0}".format(identity.hex)
+
+    # Return the endpoint to reach a peer on: its inproc endpoint if the
+    # peer is on our context, its ipc endpoint if it's on this host, else
+    # the endpoint given. Without the peer's HELLO headers we look for the
+    # endpoints it would bind.
+    def peer_endpoint(self, peer_id, endpoint, headers=None):
+        if self.inproc_token:
+            if headers is None:
+                local = peer_id in self.inproc_peers
+            else:
+                local = headers.get(PyrePeer.CONTEXT_HEADER) == self.inproc_token
+            if local:
+                return self.local_inproc_endpoint(peer_id)
+        if self.ipc:
+            ipc_endpoint = (headers or {}).get(PyrePeer.IPC_HEADER) or self.local_ipc_endpoint(peer_id)
+            if ipc_endpoint.startswith("ipc://") and os.path.exists(ipc_endpoint[6:]):
+                return ipc_endpoint
+        return endpoint
+        ipc_endpoint = ipc_endpoint or self.local_ipc_endpoint(peer_id)
+        if ipc_endpoint.startswith("ipc://") and os.path.exists(ipc_endpoint[6:]):
+            return ipc_endpoint
+        return endpoint
 
     # Send message to all peers
     def send_peer(self, peer, msg):
         peer.send(msg)
 
-    # TODO: log_item, dump
+    # Return a snapshot of our traffic counters
+    def get_stats(self):
+        groups = {}
+        for grps in (self.peer_groups, self.own_groups):
+            for name, grp in grps.items():
+                stats = groups.setdefault(name, dict.fromkeys(grp.get_stats(), 0))
+                for key, value in grp.get_stats().items():
+                    stats[key] += value
+        return {
+            "peers": dict((peer_id, peer.get_stats()) for peer_id, peer in self.peers.items()),
+            "groups": groups,
+            "outbox_sent": self.outbox_sent,
+        }
+
+    # Return a snapshot of latency from peers, and per group for SHOUTs
+    def get_latency(self):
+        return {
+            "peers": dict((peer_id, peer.get_latency()) for peer_id, peer in self.peers.items()),
+            "groups": dict((name, grp.get_latency()) for name, grp in self.own_groups.items()),
+        }
+
+    # Log our state, including traffic counters
+    def dump(self):
+        logger.info("pyre_node: dump state")
+        logger.info(" - name={0} uuid={1}".format(self.name, self.identity))
+        logger.info(" - endpoint={0}".format(self.endpoint))
+        logger.info(" - discovery=beacon port={0} interval={1}".format(self.beacon_port, self.interval))
+        logger.info(" - headers={0}".format(self.headers))
+        logger.info(" - own groups={0}".format(list(self.own_groups.keys())))
+        stats = self.get_stats()
+        for peer_id, peer_stats in stats["peers"].items():
+            logger.info(" - peer {0} {1}".format(peer_id, peer_stats))
+        for name, group_stats in stats["groups"].items():
+            logger.info(" - group {0} {1}".format(name, group_stats))
+        logger.info(" - events sent to application={0}".format(stats["outbox_sent"]))
 
     # Here we handle the different control messages from the front-end
     def recv_api(self):
@@ -164,15 +365,53 @@ class PyreNode(object):
             self.beacon_port = int(request.pop(0))
         elif command == "SET INTERVAL":
             self.interval = int(request.pop(0))
+        elif command == "SET MAX INTERVAL":
+            self.max_interval = int(request.pop(0))
+        elif command == "SET INLINE BEACON":
+            self.inline_beacon = True
         elif command == "SET INTERFACE":
             self.interface_name = request.pop(0).decode()
-        #elif command == "SET ENDPOINT":
-            # TODO: gossip start and endpoint setting
-        # TODO: GOSSIP BIND, GOSSIP CONNECT
-        #elif command == "BIND":
-        #    # TODO: Needs a wait-signal
-        #    endpoint = request.pop(0).decode('UTF-8')
-        #    self.bind(endpoint)
+        elif command == "SET LATENCY":
+            # Ask peers to timestamp what they send us
+            self.latency = True
+            self.capabilities[PyrePeer.LATENCY_HEADER] = "1"
+        elif command == "SET SHARED MAILBOX":
+            # Send to all new peers through one ROUTER, instead of a
+            # DEALER for each
+            if self.router is None:
+                self.router = PyrePeer.create_router(self._ctx, self.identity)
+        elif command == "SET SUPER PEER":
+            self.role = "super"
+            self.capabilities[PyrePeer.SUPER_HEADER] = "1"
+        elif command == "SET LEAF":
+            self.role = "leaf"
+        elif command == "SET PUBLISHER":
+            self.publish = True
+        elif command == "SET SHOUT FANOUT":
+            # The fanout is sent as a number 1
+            self.shout_fanout = min(int(request.pop(0)), 255)
+        elif command == "SET MAILBOX IDLE":
+            self.mailbox_idle = float(request.pop(0))
+        elif command == "SET ENDPOINT":
+            # Our inbox is bound here instead of to a random tcp port, and
+            # we don't send beacons
+            endpoint = request.pop(0).decode('UTF-8')
+            rc = self.bind(endpoint)
+            if rc == 0:
+                self.endpoint = endpoint
+                self.beacon_port = 0
+            self._pipe.signal(rc & 0xff)
+        elif command == "GOSSIP BIND":
+            self.gossip_start()
+            self.gossip.send_unicode("BIND", zmq.SNDMORE)
+            self.gossip.send(request.pop(0))
+        elif command == "GOSSIP CONNECT":
+            self.gossip_start()
+            self.gossip.send_unicode("CONNECT", zmq.SNDMORE)
+            self.gossip.send(request.pop(0))
+        elif command == "BIND":
+            endpoint = request.pop(0).decode('UTF-8')
+            self._pipe.signal(self.bind(endpoint) & 0xff)
         #elif command == "CONNECT":
         #    # TODO: Needs a wait-signal
         #    endpoint = request.pop(0).decode('UTF-8')
@@ -180,7 +419,13 @@ class PyreNode(object):
         elif command == "START":
             # zsock_signal (self->pipe, zyre_node_start (self));
             self.start()
-            self._pipe.signal()
+            if request:
+                # Started asynchronously, the front-end waits on this pipe
+                ready = zhelper.zconnect_pipe(self._ctx, request.pop(0).decode('UTF-8'))
+                ready.signal()
+                ready.close(linger=PIPE_LINGER)
+            else:
+                self._pipe.signal()
         elif command == "STOP":
             # zsock_signal (self->pipe, zyre_node_stop (self));
             self.stop()
@@ -190,11 +435,16 @@ class PyreNode(object):
             peer_id = uuid.UUID(bytes=request.pop(0))
             # Send frame on out to peer's mailbox, drop message
             # if peer doesn't exist (may have been destroyed)
+            msg = ZreMsg(ZreMsg.WHISPER)
+            msg.set_address(peer_id)
+            msg.content = request
             if self.peers.get(peer_id):
-                msg = ZreMsg(ZreMsg.WHISPER)
-                msg.set_address(peer_id)
-                msg.content = request
                 self.peers[peer_id].send(msg)
+            elif self.role:
+                # We're not connected in super-peer mode, go through
+                # the super-peers
+                msg.set_target(peer_id)
+                self.relay_whisper(msg)
         elif command == "SHOUT":
             # Get group to send message to
             grpname = request.pop(0).decode('UTF-8')
@@ -202,7 +452,25 @@ class PyreNode(object):
             msg.set_group(grpname)
             msg.content = request  # request may contain multipart message
 
-            if self.peer_groups.get(grpname):
+            # Count it against our own group if we're in it, so it's
+            # counted even when no peers are in the group yet
+            grp = self.own_groups.get(grpname) or self.peer_groups.get(grpname)
+            if grp:
+                grp.count_sent(msg)
+
+            if self.role:
+                self.relay_shout(msg)
+            elif self.publisher and self.peer_groups.get(grpname):
+                self.publish_shout(msg)
+            elif self.shout_fanout and self.peer_groups.get(grpname):
+                self.tree_sequence = (self.tree_sequence + 1) % 2**32
+                msg.set_tree(self.shout_fanout, self.tree_sequence)
+                self.tree_send(msg, self.identity)
+                # Members that don't pass tree SHOUTs on get it from us
+                for peer in self.peer_groups[grpname].peers.values():
+                    if not peer.supports_tree():
+                        peer.send(msg)
+            elif self.peer_groups.get(grpname):
                 self.peer_groups[grpname].send(msg)
 
             else:
@@ -222,6 +490,8 @@ class PyreNode(object):
 
                 for peer in self.peers.values():
                     peer.send(msg)
+                if self.subscriber:
+                    self.subscriber.setsockopt(zmq.SUBSCRIBE, self.shout_topic(grpname))
 
                 logger.debug("Node is joining group {0}".format(grpname))
 
@@ -237,6 +507,10 @@ class PyreNode(object):
 
                 for peer in self.peers.values():
                     peer.send(msg)
+                    # We'll miss what's published in the meantime
+                    peer.pub_sequences.pop(grpname, None)
+                if self.subscriber:
+                    self.subscriber.setsockopt(zmq.UNSUBSCRIBE, self.shout_topic(grpname))
 
                 self.own_groups.pop(grpname)
 
@@ -282,9 +556,12 @@ class PyreNode(object):
             self._pipe.send_pyobj(list(self.peer_groups.keys()))
         elif command == "OWN GROUPS":
             self._pipe.send_pyobj(list(self.own_groups.keys()))
+        elif command == "STATS":
+            self._pipe.send_pyobj(self.get_stats())
+        elif command == "LATENCY":
+            self._pipe.send_pyobj(self.get_latency())
         elif command == "DUMP":
-            # TODO: zyre_node_dump (self);
-            pass
+            self.dump()
         elif command == "$TERM":
             # this is often not printed if program terminates
             logger.debug("Pyre node: shutting down")
@@ -309,10 +586,12 @@ class PyreNode(object):
 
             p = PyrePeer(self._ctx, identity)
             self.peers[identity] = p
+            self.beacon_burst()
             p.set_origin(self.name);
+            p.set_clock(self.clock)
             # TODO: this could be handy, to set verbosity on a specific peer
             #zyre_peer_set_verbose (peer, self->verbose);
-            p.connect(self.identity, endpoint)
+            p.connect(self.identity, endpoint, self.router)
 
             # Handshake discovery by sending HELLO as first message
             m = ZreMsg(ZreMsg.HELLO)
@@ -320,11 +599,209 @@ class PyreNode(object):
             m.set_groups(self.own_groups.keys())
             m.set_status(self.status)
             m.set_name(self.name)
-            m.set_headers(self.headers)
+            headers = dict(self.capabilities)
+            headers.update(self.headers)
+            m.set_headers(headers)
             p.send(m)
 
         return p
 
+    # --------------------------------------------------------------------------
+    # Super-peer mode. Super-peers connect to each other and to the leaves
+    # they are home to. They relay SHOUTs, and WHISPERs between nodes that
+    # aren't connected. Leaves only connect to their home. Every node picks
+    # a leaf's home the same way, by rendezvous hashing over the super-peers
+    # it knows, so a leaf fails over when its home goes away without any
+    # extra messages. Nodes we don't connect to are kept on standby for as
+    # long as we hear their beacons.
+
+    # Return the UUID of the super-peer a leaf belongs to, or None
+    def home_of(self, leaf_id):
+        supers = list(self.supers)
+        if self.role == "super":
+            supers.append(self.identity)
+        if not supers:
+            return None
+        import hashlib
+        return max(supers, key=lambda s: hashlib.md5(leaf_id.bytes + s.bytes).digest())
+
+    # Return whether we keep a connection to a node
+    def wants_peer(self, peer_id):
+        if self.role == "super":
+            return peer_id in self.supers or self.home_of(peer_id) == self.identity
+        elif self.role == "leaf":
+            return peer_id == self.home_of(self.identity)
+        return True
+
+    # Disconnect from a node, but keep it on standby. A peer the
+    # application knows about gets an EXIT.
+    def standby_peer(self, peer, announced=True):
+        if announced:
+            self.remove_peer(peer)
+        else:
+            self.peers.pop(peer.get_identity(), None)
+        self.standby[peer.get_identity()] = (peer.get_endpoint(), self.clock() + PyrePeer.PEER_EXPIRED)
+        peer.disconnect()
+
+    # Connect to the nodes we want and drop the others, after the
+    # super-peers we know changed
+    def rebalance(self):
+        for peer_id, (endpoint, expired_at) in list(self.standby.items()):
+            if self.wants_peer(peer_id):
+                self.standby.pop(peer_id)
+                self.require_peer(peer_id, endpoint).refresh()
+        for peer in list(self.peers.values()):
+            if peer.get_ready() and not self.wants_peer(peer.get_identity()):
+                self.standby_peer(peer)
+
+    # Forget a node that has gone away
+    def forget_peer(self, peer_id):
+        self.standby.pop(peer_id, None)
+        if peer_id in self.supers:
+            self.supers.discard(peer_id)
+            self.rebalance()
+
+    # Return a copy of a SHOUT or WHISPER to relay, telling where it's from
+    def relayed(self, zmsg, peer):
+        msg = ZreMsg(zmsg.id)
+        msg.set_group(zmsg.get_group())
+        msg.content = zmsg.content
+        msg.set_origin(*(zmsg.get_origin() or (peer.get_identity(), peer.get_name())))
+        msg.set_target(zmsg.get_target())
+        return msg
+
+    # Pass a SHOUT on; sender is the peer we got it from, None for our own.
+    # Leaves send their own to their home. Super-peers send to their leaves
+    # in the group, and to the other super-peers unless one sent it.
+    def relay_shout(self, msg, sender=None):
+        if self.role == "leaf":
+            home = self.peers.get(self.home_of(self.identity))
+            if home and not sender:
+                home.send(msg)
+            return
+        origin = msg.get_origin()[0] if msg.get_origin() else None
+        targets = []
+        grp = self.peer_groups.get(msg.get_group())
+        if grp:
+            targets = [p for p in grp.peers.values() if p.get_identity() not in self.supers]
+        if not sender or sender.get_identity() not in self.supers:
+            targets += [p for p in self.peers.values() if p.get_identity() in self.supers]
+        for peer in targets:
+            if peer is not sender and peer.get_identity() != origin:
+                peer.send(msg)
+
+    # Pass on a WHISPER for a node we may not be connected to. Leaves send
+    # their own through their home. Super-peers send to the target if it's
+    # theirs, else to the other super-peers unless one sent it.
+    def relay_whisper(self, msg, sender=None):
+        target = self.peers.get(msg.get_target())
+        if target:
+            target.send(msg)
+        elif self.role == "leaf":
+            home = self.peers.get(self.home_of(self.identity))
+            if home and not sender:
+                home.send(msg)
+        elif not sender or sender.get_identity() not in self.supers:
+            for peer in list(self.peers.values()):
+                if peer.get_identity() in self.supers and peer is not sender:
+                    peer.send(msg)
+
+    # --------------------------------------------------------------------------
+    # Tree SHOUTs. The members of a group that pass tree SHOUTs on, the
+    # sender and us are sorted by UUID and rotated to start at the sender.
+    # In that order member i sends to members i * fanout + 1 up to
+    # i * fanout + fanout, so every member sends at most fanout copies.
+    # Each member computes the same tree from its own view of the group.
+    # While views differ, after a JOIN or LEAVE, a member may get a SHOUT
+    # twice, which tree_duplicate catches, or miss it.
+
+    # Return the tree of a group rooted at origin, as a list of UUIDs
+    def tree_order(self, group, origin):
+        members = set([self.identity, origin])
+        grp = self.peer_groups.get(group)
+        if grp:
+            members.update(p.get_identity() for p in grp.peers.values() if p.supports_tree())
+        order = sorted(members)
+        i = order.index(origin)
+        return order[i:] + order[:i]
+
+    # Send a tree SHOUT to our children in the tree rooted at origin
+    def tree_send(self, msg, origin):
+        fanout = msg.get_tree()[0]
+        order = self.tree_order(msg.get_group(), origin)
+        first = order.index(self.identity) * fanout + 1
+        for child in order[first:first + fanout]:
+            peer = self.peers.get(child)
+            if peer:
+                peer.send(msg)
+
+    # Return whether we've had a tree SHOUT from origin already
+    def tree_duplicate(self, origin, sequence):
+        seen = self.tree_seen.get(origin)
+        if seen is None:
+            seen = self.tree_seen[origin] = deque(maxlen=PyrePeer.RETRANSMIT_WINDOW)
+        if sequence in seen:
+            return True
+        seen.append(sequence)
+        return False
+
+    # --------------------------------------------------------------------------
+    # Published SHOUTs. A node that publishes sends each SHOUT once on its
+    # PUB socket, with the group as topic, and libzmq copies it to the
+    # subscribers. Members that don't subscribe get it in their mailbox.
+    # Subscribers connect one SUB socket to every publisher, subscribed to
+    # the groups we're in. Published SHOUTs are numbered per group, so a
+    # subscriber can tell when some went missing. They aren't ordered with
+    # respect to the publisher's other messages, which take the mailbox.
+
+    # Return the topic of a group, which mustn't prefix match other groups
+    @staticmethod
+    def shout_topic(group):
+        return group.encode('UTF-8') + b'\x00'
+
+    # Publish a SHOUT to a group
+    def publish_shout(self, msg):
+        group = msg.get_group()
+        sequence = (self.pub_sequences.get(group, 0) + 1) % 65535
+        self.pub_sequences[group] = sequence
+        msg.set_sequence(sequence)
+        self.publisher.send_multipart([self.shout_topic(group), self.identity.bytes] + msg.encode())
+        for peer in self.peer_groups[group].peers.values():
+            if not peer.supports_subscribe():
+                peer.send(msg)
+
+    # Connect our subscriber to a peer's publisher
+    def subscribe_to(self, peer):
+        if self.subscriber is None:
+            self.subscriber = self._ctx.socket(zmq.SUB)
+            self.subscriber.setsockopt(zmq.LINGER, 0)
+            self.subscriber.setsockopt(zmq.RCVHWM, PyrePeer.PEER_EXPIRED * 100)
+            for group in self.own_groups:
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, self.shout_topic(group))
+            self.poller.register(self.subscriber, zmq.POLLIN)
+        logger.debug("Subscribing to peer {0} on endpoint {1}".format(peer.identity, peer.get_publisher()))
+        self.subscriber.connect(peer.get_publisher())
+
+    # Handle a SHOUT published by a peer
+    def recv_subscriber(self):
+        frames = self.subscriber.recv_multipart()
+        try:
+            peer = self.peers.get(uuid.UUID(bytes=frames[1]))
+        except (IndexError, ValueError):
+            return
+        if not peer or not peer.get_ready():
+            return
+        zmsg = ZreMsg()
+        zmsg.set_address(peer.get_identity())
+        zmsg.decode(frames[2:])
+        if zmsg.id != ZreMsg.SHOUT:
+            return
+        peer.count_recv(zmsg)
+        if peer.published_lost(zmsg):
+            logger.warning("{0} SHOUTs to {1} lost from {2}".format(self.identity, zmsg.get_group(), peer.identity))
+        self.handle_peer_msg(peer, zmsg)
+        peer.refresh()
+
     #  Remove peer from group, if it's a member
     def delete_peer(self, peer, group):
         group.leave(peer)
@@ -335,12 +812,21 @@ class PyreNode(object):
         self.outbox.send_unicode("EXIT", zmq.SNDMORE)
         self.outbox.send(peer.get_identity().bytes, zmq.SNDMORE)
         self.outbox.send_unicode(peer.get_name())
+        self.outbox_sent += 1
         logger.debug("({0}) EXIT name={1}".format(peer, peer.get_endpoint()))
         # Remove peer from any groups we've got it in
         for grp in self.peer_groups.values():
             self.delete_peer(peer, grp)
         # To destroy peer, we remove from peers hash table (dict)
         self.peers.pop(peer.get_identity())
+        self.beacon_burst()
+        self.tree_seen.pop(peer.get_identity(), None)
+        if self.subscriber and peer.get_publisher():
+            try:
+                self.subscriber.disconnect(peer.get_publisher())
+            except zmq.ZMQError:
+                # We never got to connect
+                pass
 
     # Find or create group via its name
     def require_peer_group(self, groupname):
@@ -356,11 +842,15 @@ class PyreNode(object):
     def join_peer_group(self, peer, groupname):
         grp = self.require_peer_group(groupname)
         grp.join(peer)
+        if groupname in self.own_groups:
+            # We'll be SHOUTing to the peer
+            peer.unpark()
         # Now tell the caller about the peer joined group
         self.outbox.send_unicode("JOIN", flags=zmq.SNDMORE)
         self.outbox.send(peer.get_identity().bytes, flags=zmq.SNDMORE)
         self.outbox.send_unicode(peer.get_name(), flags=zmq.SNDMORE)
         self.outbox.send_unicode(groupname)
+        self.outbox_sent += 1
         logger.debug("({0}) JOIN name={1} group={2}".format(self.name, peer.get_name(), groupname))
         return grp
 
@@ -370,6 +860,7 @@ class PyreNode(object):
         self.outbox.send(peer.get_identity().bytes, flags=zmq.SNDMORE)
         self.outbox.send_unicode(peer.get_name(), flags=zmq.SNDMORE)
         self.outbox.send_unicode(groupname)
+        self.outbox_sent += 1
         # Now remove the peer from the group
         grp = self.require_peer_group(groupname)
         grp.leave(peer)
@@ -395,24 +886,65 @@ class PyreNode(object):
                     # We ignore HELLO, if peer has same endpoint as current node
                     return
 
-            peer = self.require_peer(id, zmsg.get_endpoint())
+            endpoint = self.peer_endpoint(id, zmsg.get_endpoint(), zmsg.get_headers())
+            peer = self.require_peer(id, endpoint)
             peer.set_ready(True)
 
         # Ignore command if peer isn't ready
         if not peer or not peer.get_ready():
             logger.warning("Peer {0} isn't ready".format(peer))
             return
+        peer.count_recv(zmsg)
+
+        if zmsg.id == ZreMsg.NACK:
+            if not zmsg.get_count():
+                # Peer can't fill the gap we asked for
+                logger.warning("{0} messages lost from {1}".format(self.identity, peer.identity))
+                self.remove_peer(peer)
+                return
+            # Peer noticed a sequence gap, fill it from our window
+            if not peer.resend(zmsg.get_sequence(), zmsg.get_count()):
+                logger.debug("({0}) can't resend to {1} from sequence {2}".format(self.name, peer.get_name(), zmsg.get_sequence()))
+            peer.refresh()
+            return
 
         if peer.messages_lost(zmsg):
-            logger.warning("{0} messages lost from {1}".format(self.identity, peer.identity))
-            self.remove_peer(peer)
+            # Small gaps are healed by the peer resending from its window,
+            # we only give up on the peer if the gap is too big
+            if not peer.hold(zmsg):
+                logger.warning("{0} messages lost from {1}".format(self.identity, peer.identity))
+                self.remove_peer(peer)
+                return
+            peer.refresh()
             return
 
-        # Now process each command
+        self.handle_peer_msg(peer, zmsg)
+        # Deliver messages that were held back behind a healed gap
+        for zmsg in peer.release_held():
+            self.handle_peer_msg(peer, zmsg)
+        # Activity from peer resets peer timers
+        peer.refresh()
+
+    # Process a command from a peer, in sequence
+    def handle_peer_msg(self, peer, zmsg):
         if zmsg.id == ZreMsg.HELLO:
+            new_super = False
+            if self.role:
+                if PyrePeer.SUPER_HEADER in zmsg.get_headers():
+                    new_super = peer.get_identity() not in self.supers
+                    self.supers.add(peer.get_identity())
+                if not self.wants_peer(peer.get_identity()):
+                    self.standby_peer(peer, announced=False)
+                    if new_super:
+                        self.rebalance()
+                    return
+                self.standby.pop(peer.get_identity(), None)
+
             # Store properties from HELLO command into peer
             peer.set_name(zmsg.get_name())
             peer.set_headers(zmsg.get_headers())
+            if peer.get_publisher():
+                self.subscribe_to(peer)
 
             # Now tell the caller about the peer
             self.outbox.send_unicode("ENTER", flags=zmq.SNDMORE)
@@ -420,6 +952,7 @@ class PyreNode(object):
             self.outbox.send_unicode(peer.get_name(), flags=zmq.SNDMORE)
             self.outbox.send_json(peer.get_headers(),flags=zmq.SNDMORE)
             self.outbox.send_unicode(peer.get_endpoint())
+            self.outbox_sent += 1
             logger.debug("({0}) ENTER name={1} endpoint={2}".format(self.name, peer.get_name(), peer.get_endpoint()))
 
             # Join peer to listed groups
@@ -427,21 +960,59 @@ class PyreNode(object):
                 self.join_peer_group(peer, grp)
             # Now take peer's status from HELLO, after joining groups
             peer.set_status(zmsg.get_status())
+
+            # Get a clock offset before the first messages arrive
+            if self.latency and peer.supports_timestamps():
+                peer.send_ping()
+            if new_super:
+                self.rebalance()
         elif zmsg.id == ZreMsg.WHISPER:
+            target = zmsg.get_target()
+            if target is not None and target != self.identity:
+                if self.role == "super":
+                    self.relay_whisper(self.relayed(zmsg, peer), peer)
+                return
+            # Relayed messages tell us where they came from
+            identity, name = zmsg.get_origin() or (peer.get_identity(), peer.get_name())
             # Pass up to caller API as WHISPER event
             self.outbox.send_unicode("WHISPER", zmq.SNDMORE)
-            self.outbox.send(peer.get_identity().bytes, zmq.SNDMORE)
-            self.outbox.send_unicode(peer.get_name(), zmq.SNDMORE)
+            self.outbox.send(identity.bytes, zmq.SNDMORE)
+            self.outbox.send_unicode(name, zmq.SNDMORE)
             self.outbox.send_multipart(zmsg.content)
+            self.outbox_sent += 1
+            if self.latency:
+                peer.record_latency(zmsg)
         elif zmsg.id == ZreMsg.SHOUT:
+            if self.role == "super":
+                self.relay_shout(self.relayed(zmsg, peer), peer)
+            if self.role and zmsg.get_group() not in self.own_groups:
+                # We only pass it on
+                return
+            identity, name = zmsg.get_origin() or (peer.get_identity(), peer.get_name())
+            if zmsg.get_tree() is not None and not self.role:
+                if self.tree_duplicate(identity, zmsg.get_tree()[1]):
+                    return
+                msg = self.relayed(zmsg, peer)
+                msg.set_tree(*zmsg.get_tree())
+                self.tree_send(msg, identity)
             # Pass up to caller API as WHISPER event
             self.outbox.send_unicode("SHOUT", zmq.SNDMORE)
-            self.outbox.send(peer.get_identity().bytes, zmq.SNDMORE)
-            self.outbox.send_unicode(peer.get_name(), zmq.SNDMORE)
+            self.outbox.send(identity.bytes, zmq.SNDMORE)
+            self.outbox.send_unicode(name, zmq.SNDMORE)
             self.outbox.send_unicode(zmsg.get_group(), zmq.SNDMORE)
             self.outbox.send_multipart(zmsg.content)
+            self.outbox_sent += 1
+            grp = self.own_groups.get(zmsg.get_group())
+            if grp:
+                grp.count_recv(zmsg)
+            if self.latency:
+                latency = peer.record_latency(zmsg)
+                if grp and latency is not None:
+                    grp.record_latency(latency)
         elif zmsg.id == ZreMsg.PING:
-            peer.send(ZreMsg(id=ZreMsg.PING_OK))
+            peer.recv_ping(zmsg)
+        elif zmsg.id == ZreMsg.PING_OK:
+            peer.recv_ping_ok(zmsg)
         elif zmsg.id == ZreMsg.JOIN:
             self.join_peer_group(peer, zmsg.get_group())
             assert(zmsg.get_status() == peer.get_status())
@@ -449,17 +1020,34 @@ class PyreNode(object):
             #self.leave_peer_group(zmsg.get_group())
             self.leave_peer_group(peer, zmsg.get_group())
             assert(zmsg.get_status() == peer.get_status())
-        # Activity from peer resets peer timers
-        peer.refresh()
 
     def recv_beacon(self):
-        # Get IP address and beacon of peer
-        try:
-            ipaddress, frame = self.beacon_socket.recv_multipart()
-        except ValueError:
+        # Get the IP address and beacon of peers, or after an empty frame
+        # a batch of beacons we've had before
+        frames = self.beacon.recv_multipart()
+        if frames and not frames[0]:
+            self.refresh_beacons(frames[1:])
             return
+        for ipaddress, frame in zip(frames[::2], frames[1::2]):
+            self.handle_beacon(ipaddress, frame)
+
+    # Beacons we've had before only tell us the peer is still there
+    def refresh_beacons(self, frames):
+        for ipaddress, frame in zip(frames[::2], frames[1::2]):
+            try:
+                peer = self.peers.get(uuid.UUID(bytes=frame[4:20]))
+            except ValueError:
+                continue
+            if peer:
+                peer.refresh()
+            else:
+                self.handle_beacon(ipaddress, frame)
 
-        beacon = struct.unpack('cccb16sH', frame)
+    def handle_beacon(self, ipaddress, frame):
+        try:
+            beacon = struct.unpack('cccb16sH', frame)
+        except struct.error:
+            return
         # Ignore anything that isn't a valid beacon
         if beacon[3] != BEACON_VERSION:
             logger.warning("Invalid ZRE Beacon version: {0}".format(beacon[3]))
@@ -470,7 +1058,11 @@ class PyreNode(object):
         port = socket.ntohs(beacon[5])
         # if we receive a beacon with port 0 this means the peer exited
         if port:
-            endpoint = "tcp://%s:%d" %(ipaddress.decode('UTF-8'), port)
+            endpoint = self.peer_endpoint(peer_id, "tcp://%s:%d" %(ipaddress.decode('UTF-8'), port))
+            if peer_id in self.standby:
+                # We know the node, but don't connect to it
+                self.standby[peer_id] = (endpoint, self.clock() + PyrePeer.PEER_EXPIRED)
+                return
             peer = self.require_peer(peer_id, endpoint)
             peer.refresh()
         else:
@@ -482,28 +1074,117 @@ class PyreNode(object):
                 logger.debug("Received 0 port beacon, removing peer {0}".format(peer))
                 self.remove_peer(peer)
 
-            else:
+            elif peer_id not in self.standby:
                 logger.warning(self.peers)
                 logger.warning("We don't know peer id {0}".format(peer_id))
+            self.forget_peer(peer_id)
 
-    # TODO: Handle gossip dat
+    # Handle a tuple from the gossip network, a node's UUID and endpoint.
+    # An empty endpoint means the node went away.
+    def recv_gossip(self):
+        request = self.gossip_socket.recv_multipart()
+        command = request.pop(0).decode('UTF-8')
+        if command != "DELIVER":
+            return
+        try:
+            peer_id = uuid.UUID(request.pop(0).decode('UTF-8'))
+        except ValueError:
+            return
+        endpoint = request.pop(0).decode('UTF-8')
+        if peer_id == self.identity:
+            return
+        if endpoint:
+            if peer_id in self.standby:
+                self.standby[peer_id] = (endpoint, self.clock() + PyrePeer.PEER_EXPIRED)
+                return
+            self.require_peer(peer_id, endpoint).refresh()
+        else:
+            peer = self.peers.get(peer_id)
+            if peer:
+                logger.debug("Gossip says peer {0} went away".format(peer))
+                self.remove_peer(peer)
+            self.forget_peer(peer_id)
 
     # We do this once a second:
     # - if peer has gone quiet, send TCP ping
     # - if peer has disappeared, expire it
     def ping_peer(self, peer_id):
         peer = self.peers.get(peer_id)
-        if time.time() > peer.expired_at:
+        if not peer:
+            # Dropped while we were reaping
+            return
+        if self.clock() > peer.expired_at:
             logger.debug("({0}) peer expired name={1} endpoint={2}".format(self.name, peer.get_name(), peer.get_endpoint()))
             self.remove_peer(peer)
-        elif time.time() > peer.evasive_at:
+            self.forget_peer(peer_id)
+            return
+        if peer.held and not peer.request_resend():
+            # The peer couldn't fill a sequence gap in time
+            logger.warning("{0} messages lost from {1}".format(self.identity, peer.identity))
+            self.remove_peer(peer)
+            return
+        if self.clock() > peer.evasive_at:
             # If peer is being evasive, force a TCP ping.
             # TODO: do this only once for a peer in this state;
             # it would be nicer to use a proper state machine
             # for peer management.
             logger.debug("({0}) peer seems dead/slow name={1} endpoint={2}".format(self.name, peer.get_name(), peer.get_endpoint()))
-            msg = ZreMsg(ZreMsg.PING)
-            peer.send(msg)
+            peer.send_ping()
+        elif self.latency and peer.supports_timestamps():
+            # Keep the round trip time and clock offset fresh
+            peer.send_ping()
+        if self.mailbox_idle is not None and self.clock() - peer.sent_at >= self.mailbox_idle \
+                and not self.shares_group(peer):
+            # Beacons keep the peer alive while we don't talk to it
+            peer.park()
+
+    # Return whether a peer is in any of our groups
+    def shares_group(self, peer):
+        for name in self.own_groups:
+            grp = self.peer_groups.get(name)
+            if grp and peer.get_identity() in grp.peers:
+                return True
+        return False
+
+    # Ping all peers and reap any expired ones
+    def reap_peers(self):
+        for peer_id in self.peers.copy().keys():
+            self.ping_peer(peer_id)
+        for peer_id, (endpoint, expired_at) in list(self.standby.items()):
+            if self.clock() > expired_at:
+                self.forget_peer(peer_id)
+
+    # Return when we next have something to do, whether or not our sockets
+    # have input
+    def wake_time(self):
+        wake_at = self.reap_at
+        if self.inline_beacon and self.beacon:
+            if self.beacon.pending():
+                return time.time()
+            wake_at = min(wake_at, self.beacon.wake_time())
+        return wake_at
+
+    # Handle the input on our sockets and whatever else is due; items are
+    # the sockets with input from our poller, and may include others'
+    def handle_events(self, items):
+        if self._pipe in items and items[self._pipe] == zmq.POLLIN:
+            self.recv_api()
+        if self.inbox in items and items[self.inbox] == zmq.POLLIN:
+            self.recv_peer()
+        if self.beacon_socket in items and items[self.beacon_socket] == zmq.POLLIN:
+            self.recv_beacon()
+        if self.subscriber in items and items[self.subscriber] == zmq.POLLIN:
+            self.recv_subscriber()
+        if self.gossip_socket in items and items[self.gossip_socket] == zmq.POLLIN:
+            self.recv_gossip()
+        if self.inline_beacon and self.beacon:
+            # We send the beacon's beacons and batches for it
+            self.beacon.send_due()
+            while self.beacon.pending():
+                self.recv_beacon()
+        if time.time() >= self.reap_at:
+            self.reap_at = time.time() + REAP_INTERVAL
+            self.reap_peers()
 
     # --------------------------------------------------------------------------
     # This is the actor that runs a single node; it uses one thread, creates
@@ -512,21 +1193,19 @@ class PyreNode(object):
 
         # Signal actor successfully initialized
         self._pipe.signal()
-        reap_at = time.time() + REAP_INTERVAL
+        self.reap_at = time.time() + REAP_INTERVAL
         while not self._terminated:
-            timeout = reap_at - time.time()
+            timeout = self.wake_time() - time.time()
             if timeout < 0:
                 timeout = 0
-            items = dict(self.poller.poll(timeout * 1000))
+            self.handle_events(dict(self.poller.poll(timeout * 1000)))
 
-            if self._pipe in items and items[self._pipe] == zmq.POLLIN:
-                self.recv_api()
-            if self.inbox in items and items[self.inbox] == zmq.POLLIN:
-                self.recv_peer()
-            if self.beacon_socket in items and items[self.beacon_socket] == zmq.POLLIN:
-                self.recv_beacon()
-            if time.time() >= reap_at:
-                reap_at = time.time() + REAP_INTERVAL
-                # Ping all peers and reap any expired ones
-                for peer_id in self.peers.copy().keys():
-                    self.ping_peer(peer_id)
+
+# Run a node in a process of its own, its events go to the outbox endpoint
+def process_node(ctx, pipe, outbox_endpoint, *args, **kwargs):
+    outbox = zhelper.zconnect_pipe(ctx, outbox_endpoint)
+    try:
+        PyreNode(ctx, pipe, outbox, *args, **kwargs)
+    finally:
+        # Give our last events time to get out before the process ends
+        outbox.close(linger=PIPE_LINGER)
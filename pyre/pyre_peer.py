@@ -1,6 +1,11 @@
 import time
+import struct
 import zmq
 import logging
+import itertools
+from collections import deque
+from .zre_msg import ZreMsg
+from .pyre_histogram import PyreHistogram
 
 logger = logging.getLogger(__name__)
 
@@ -9,34 +14,124 @@ class PyrePeer(object):
 
     PEER_EXPIRED = 30              # expire after 10s
     PEER_EVASIVE = 10              # mark evasive after 5s
+    RETRANSMIT_WINDOW = 256        # messages kept around for resending
+    # A gap is given up on after this many resend requests without any
+    # progress. The node asks again once per reap interval, so a gap holds
+    # messages back for at most NACK_RETRIES seconds. When a resend heals
+    # a gap and uncovers the next one, that one is asked for straight away.
+    NACK_RETRIES = 3
+    NACK_HEADER = "X-PYRE-NACK"    # HELLO header advertising resend support
+    TIMESTAMP_HEADER = "X-PYRE-TIMESTAMP"
+                                   # HELLO header advertising PING echoes
+    LATENCY_HEADER = "X-PYRE-LATENCY"
+                                   # HELLO header asking for send timestamps
+    SUPER_HEADER = "X-PYRE-SUPER"  # HELLO header of super-peers
+    TREE_HEADER = "X-PYRE-TREE"    # HELLO header advertising tree SHOUTs
+    PUB_HEADER = "X-PYRE-PUB"      # HELLO header with the endpoint we
+                                   # publish SHOUTs on
+    SUB_HEADER = "X-PYRE-SUB"      # HELLO header advertising we subscribe
+                                   # to published SHOUTs
+    IPC_HEADER = "X-PYRE-IPC"      # HELLO header with our ipc:// endpoint,
+                                   # for peers on the same host
+    CONTEXT_HEADER = "X-PYRE-CONTEXT"
+                                   # HELLO header with a token of our zmq
+                                   # context, peers on it connect over inproc
+    INTERVAL_HEADER = "X-PYRE-INTERVAL"
+                                   # HELLO header with the longest interval
+                                   # between our beacons, in msecs
+    _routes = itertools.count(1)   # Routing ids on a shared router
 
     def __init__(self, ctx, identity):
         # TODO: what to do with container?
         self._ctx = ctx          # ZMQ context
         self.mailbox = None      # Socket through to peer
+        self.router = None       # Or shared router socket through to peer
+        self.route = None        # Peer's routing id on the shared router
+        self.reply_to = None     # Our identity on the mailbox
+        self.parked = False      # Mailbox closed while idle, see park
+        self.sent_at = 0         # When we last sent to peer
         self.identity = identity # Identity UUID
         self.endpoint = None     # Endpoint connected to
         self.name = "notset"     # Peer's public name
         self.origin = "unknown"  # Origin node's public name
         self.evasive_at = 0      # Peer is being evasive
         self.expired_at = 0      # Peer has expired by now
+        self.evasive_after = self.PEER_EVASIVE
+                                 # Silence before the peer is evasive
+        self.expired_after = self.PEER_EXPIRED
+                                 # Silence before the peer has expired
         self.connected = False   # Peer will send messages
         self.ready = False       # Peer has said Hello to us
         self.status = 0          # Our status counter
         self.sent_sequence = 0   # Outgoing message sequence
         self.want_sequence = 0   # Incoming message sequence
         self.headers = {}        # Peer headers
+        self.sent_window = deque(maxlen=self.RETRANSMIT_WINDOW)
+                                 # Recently sent (sequence, frames)
+        self.held = {}           # Messages received ahead of a gap
+        self.pub_sequences = {}  # Last sequence published per group
+        self.nack_retries = 0    # Resend requests sent for current gap
+        self.nack_want = 0       # Last sequence in order when we asked
+        self.nack_end = 0        # Last sequence we asked for
+        self.msgs_sent = 0       # Traffic counters, see get_stats
+        self.bytes_sent = 0
+        self.msgs_recv = 0
+        self.bytes_recv = 0
+        self.drops = 0
+        self.seq_errors = 0
+        self.pings_sent = 0
+        self.pings_recv = 0
+        self.resends = 0
+        self.rtt = None          # Smoothed round trip time to peer
+        self.clock_offset = None # Peer clock minus ours, from PINGs
+        self.latency = None      # Histogram of latency from peer
+        self.clock = time.time   # Clock for peer timers
 
     def __del__(self):
         self.disconnect()
 
-    # Connect peer mailbox
-    def connect(self, reply_to, endpoint):
+    # Create a ROUTER that many peers can share as their mailbox, see
+    # connect. The socket options are those of a peer's own DEALER.
+    @staticmethod
+    def create_router(ctx, reply_to):
+        router = ctx.socket(zmq.ROUTER)
+        router.setsockopt(zmq.LINGER, 0)
+        router.setsockopt(zmq.IDENTITY, b'\x01' + reply_to.bytes)
+        router.setsockopt(zmq.SNDHWM, PyrePeer.PEER_EXPIRED * 100)
+        router.setsockopt(zmq.SNDTIMEO, 0)
+        # Fail on unknown routing ids rather than dropping silently
+        router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        return router
+
+    # Connect peer mailbox. Given a shared router, we connect that to the
+    # peer instead of creating a DEALER. The peer's inbox sees the same
+    # identity and frames either way.
+    def connect(self, reply_to, endpoint, router=None):
         if self.connected:
             return
 
+        self.reply_to = reply_to
+        self.router = router
+        self.endpoint = endpoint
+        # Connect through to peer node
+        logger.debug("Connecting to peer {0} on endpoint {1}".format(self.identity, endpoint))
+        self.open_mailbox()
+        self.connected = True
+        self.ready = False
+
+    # Open our socket, or route on the shared router, through to the peer
+    def open_mailbox(self):
+        self.parked = False
+        if self.router is not None:
+            # Every connection gets a fresh routing id, a reconnect to the
+            # same peer may overlap with the old connection going away
+            self.route = struct.pack(">BI", 1, next(PyrePeer._routes) % 2**32)
+            self.router.setsockopt(zmq.CONNECT_ROUTING_ID, self.route)
+            self.router.connect(self.endpoint)
+            return
+
         # Create new outgoing socket (drop any messages in transit)
-        self.mailbox = zmq.Socket(self._ctx, zmq.DEALER)
+        self.mailbox = self._ctx.socket(zmq.DEALER)
         # Set our caller 'From' identity so that receiving node knows
         # who each message came from.
         # Set our own identity on the socket so that receiving node
@@ -47,19 +142,26 @@ class PyrePeer(object):
         # enforces.
         # we set linger to 0 by default (In zyre this is done by czmq's zsys)
         self.mailbox.setsockopt(zmq.LINGER, 0)
-        self.mailbox.setsockopt(zmq.IDENTITY, b'\x01' + reply_to.bytes)
+        self.mailbox.setsockopt(zmq.IDENTITY, b'\x01' + self.reply_to.bytes)
         # Set a high-water mark that allows for reasonable activity
         self.mailbox.setsockopt(zmq.SNDHWM, PyrePeer.PEER_EXPIRED * 100)
         # Send messages immediately or return EAGAIN
         self.mailbox.setsockopt(zmq.SNDTIMEO, 0)
-
-        # Connect through to peer node
-        logger.debug("Connecting to peer {0} on endpoint {1}".format(self.identity, endpoint))
-
-        self.mailbox.connect(endpoint)
-        self.endpoint = endpoint
-        self.connected = True
-        self.ready = False
+        self.mailbox.connect(self.endpoint)
+
+    # Close our socket through to the peer, dropping any pending messages
+    def close_mailbox(self):
+        if self.router is not None:
+            if self.route is not None:
+                try:
+                    self.router.disconnect(self.endpoint)
+                except zmq.ZMQError:
+                    # The router was closed already
+                    pass
+                self.route = None
+        elif self.mailbox is not None:
+            self.mailbox.close()
+            self.mailbox = None
 
     # Disconnect peer mailbox
     # No more messages will be sent to peer until connected again
@@ -67,39 +169,241 @@ class PyrePeer(object):
         # If connected, destroy socket and drop all pending messages
         if (self.connected):
             logger.debug("{0} Disconnecting peer {1}".format(self.origin, self.name))
-            self.mailbox.close()
-            self.mailbox = None
+            self.close_mailbox()
+            self.router = None
             self.endpoint = ""
             self.connected = False
             self.ready = False
+            self.parked = False
     # end disconnect
 
+    # Close the mailbox of a peer we have nothing to say to, while keeping
+    # its state. The next message we send opens the mailbox again, and
+    # carries on the sequence, so the peer doesn't notice.
+    def park(self):
+        if self.connected and not self.parked:
+            logger.debug("{0} Parking peer {1}".format(self.origin, self.name))
+            self.close_mailbox()
+            self.parked = True
+
+    # Open the mailbox of a parked peer
+    def unpark(self):
+        if self.parked:
+            logger.debug("{0} Unparking peer {1}".format(self.origin, self.name))
+            self.open_mailbox()
+
+    # Send encoded frames through to the peer, raises zmq.Again if they
+    # can't be queued
+    def send_frames(self, frames):
+        self.unpark()
+        self.sent_at = self.clock()
+        if self.router is None:
+            self.mailbox.send_multipart(frames)
+            return
+        try:
+            self.router.send_multipart([self.route] + frames)
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EHOSTUNREACH:
+                raise
+            raise zmq.Again()
+
     # Send message to peer
     def send(self, msg):
         if self.connected:
             self.sent_sequence += 1
             self.sent_sequence = self.sent_sequence % 65535
             msg.set_sequence(self.sent_sequence)
+            if msg.id in (ZreMsg.WHISPER, ZreMsg.SHOUT):
+                # The same message may go to several peers, only
+                # some of which asked for timestamps
+                msg.set_timestamp(time.monotonic() if self.wants_timestamps() else None)
+            frames = msg.encode()
+            self.sent_window.append((self.sent_sequence, frames))
 
             try:
-                msg.send(self.mailbox)
+                self.send_frames(frames)
             except zmq.Again as e:
-                self.disconnect()
+                # The message stays in the retransmission window, so the
+                # peer can ask for it once it notices the gap. Peers that
+                # can't ask would drop us on the gap anyway.
+                if not self.supports_nack():
+                    self.disconnect()
+                self.drops += 1
                 logger.debug("{0} Error while sending {1} to peer={2} sequence={3}".format(self.origin,
                                                                             msg.get_command(),
                                                                             self.name,
                                                                             msg.get_sequence()))
                 return -1
 
+            self.count_sent(frames)
             logger.debug("{0} send {1} to peer={2} sequence={3}".format(self.origin,
                 msg.get_command(),
                 self.name,
                 msg.get_sequence()))
+            return 0
 
         else:
             logger.debug("Peer {0} is not connected".format(self.identity))
+            return -1
     # end send
 
+    # Send a PING to check the peer is still alive. Peers that echo
+    # timestamps get one, so we can estimate the round trip time.
+    def send_ping(self):
+        msg = ZreMsg(ZreMsg.PING)
+        if self.supports_timestamps():
+            msg.set_timestamp(time.monotonic())
+        if self.send(msg) == 0:
+            self.pings_sent += 1
+    # end send_ping
+
+    # Answer a PING from the peer, echoing its timestamp if any
+    def recv_ping(self, msg):
+        self.pings_recv += 1
+        reply = ZreMsg(ZreMsg.PING_OK)
+        if msg.get_timestamp() is not None:
+            reply.set_echo(msg.get_timestamp(), time.monotonic())
+        self.send(reply)
+    # end recv_ping
+
+    # Update round trip time and clock offset from an echoed PING.
+    # We assume the PING_OK took half the round trip, and smooth
+    # both estimates like TCP does.
+    def recv_ping_ok(self, msg):
+        if msg.get_echo() is None:
+            return
+        sent, peer_time = msg.get_echo()
+        rtt = time.monotonic() - sent
+        offset = peer_time - (sent + rtt / 2)
+        if self.rtt is None:
+            self.rtt = rtt
+            self.clock_offset = offset
+        else:
+            self.rtt += (rtt - self.rtt) / 8
+            self.clock_offset += (offset - self.clock_offset) / 8
+    # end recv_ping_ok
+
+    # Record the latency of a timestamped message, returns the latency in
+    # seconds or None if we can't tell yet
+    def record_latency(self, msg):
+        if msg.get_timestamp() is None or self.clock_offset is None:
+            return None
+        latency = time.monotonic() - (msg.get_timestamp() - self.clock_offset)
+        if self.latency is None:
+            self.latency = PyreHistogram()
+        self.latency.record(latency)
+        return latency
+    # end record_latency
+
+    # Get round trip time, clock offset and latency histogram summary
+    def get_latency(self):
+        return {
+            "name": self.name,
+            "rtt": self.rtt,
+            "clock_offset": self.clock_offset,
+            "latency": self.latency.get_stats() if self.latency else {"count": 0},
+        }
+    # end get_latency
+
+    # Resend count messages from the retransmission window, starting at
+    # the given sequence. If they were already dropped from the window we
+    # tell the peer, so it can give up on us straight away, and return
+    # False.
+    def resend(self, sequence, count):
+        if not self.connected:
+            return False
+        offset = -1
+        if self.sent_window:
+            offset = (sequence - self.sent_window[0][0]) % 65535
+        if offset < 0 or offset + count > len(self.sent_window):
+            self.send_nack(sequence, 0)
+            return False
+
+        logger.debug("{0} resend to peer={1} sequence={2} count={3}".format(self.origin,
+            self.name,
+            sequence,
+            count))
+        for seq, frames in itertools.islice(self.sent_window, offset, offset + count):
+            try:
+                self.send_frames(frames)
+            except zmq.Again:
+                # The peer will ask again
+                self.drops += 1
+                break
+            self.count_sent(frames)
+            self.resends += 1
+        return True
+    # end resend
+
+    # Send a resend request, these are not part of the sequence. A count
+    # of zero tells the peer we can't resend what it asked for.
+    def send_nack(self, sequence, count):
+        if not self.connected:
+            return
+        msg = ZreMsg(ZreMsg.NACK)
+        msg.set_sequence(sequence)
+        msg.set_count(count)
+        frames = msg.encode()
+        try:
+            self.send_frames(frames)
+        except zmq.Again:
+            self.drops += 1
+            return
+        self.count_sent(frames)
+    # end send_nack
+
+    # Ask the peer to resend the messages missing before the ones we hold.
+    # Returns False once we have asked too many times without progress.
+    def request_resend(self):
+        if self.nack_retries and self.nack_want != self.want_sequence:
+            # The last resend healed a gap, this is a new one
+            self.nack_retries = 0
+        if self.nack_retries >= self.NACK_RETRIES:
+            return False
+        self.nack_retries += 1
+        self.nack_want = self.want_sequence
+        count = min((sequence - self.want_sequence - 1) % 65535 for sequence in self.held)
+        self.nack_end = (self.want_sequence + count) % 65535
+        self.send_nack((self.want_sequence + 1) % 65535, count)
+        return True
+    # end request_resend
+
+    # Return whether the peer advertised it can ask for resends
+    def supports_nack(self):
+        return self.headers.get(self.NACK_HEADER) == "1"
+
+    # Return whether the peer advertised it echoes PING timestamps
+    def supports_timestamps(self):
+        return self.headers.get(self.TIMESTAMP_HEADER) == "1"
+
+    # Return whether the peer advertised it passes tree SHOUTs on
+    def supports_tree(self):
+        return self.headers.get(self.TREE_HEADER) == "1"
+
+    # Return the endpoint the peer publishes SHOUTs on, or None
+    def get_publisher(self):
+        return self.headers.get(self.PUB_HEADER)
+
+    # Return whether the peer advertised it subscribes to published SHOUTs
+    def supports_subscribe(self):
+        return self.headers.get(self.SUB_HEADER) == "1"
+
+    # Check the sequence of a SHOUT the peer published, which it counts per
+    # group. Returns True if messages went missing in between. The first
+    # SHOUT after we subscribe sets where we start.
+    def published_lost(self, msg):
+        group = msg.get_group()
+        last = self.pub_sequences.get(group)
+        self.pub_sequences[group] = msg.get_sequence()
+        if last is None or msg.get_sequence() == (last + 1) % 65535:
+            return False
+        self.seq_errors += 1
+        return True
+
+    # Return whether the peer asked for send timestamps
+    def wants_timestamps(self):
+        return self.headers.get(self.LATENCY_HEADER) == "1"
+
     # Return peer connected status
     def is_connected(self):
         return self.connected
@@ -120,8 +424,8 @@ class PyrePeer(object):
 
     # Register activity at peer
     def refresh(self):
-        self.evasive_at = time.time() + self.PEER_EVASIVE
-        self.expired_at = time.time() + self.PEER_EXPIRED
+        self.evasive_at = self.clock() + self.evasive_after
+        self.expired_at = self.clock() + self.expired_after
     # end refresh
 
     # Return future evasive time
@@ -146,6 +450,10 @@ class PyrePeer(object):
     def set_origin(self, origin):
         self.origin = origin
 
+    # Set the clock used for peer timers
+    def set_clock(self, clock):
+        self.clock = clock
+
     # Return peer status
     def get_status(self):
         return self.status
@@ -178,8 +486,46 @@ class PyrePeer(object):
     # Set peer headers
     def set_headers(self, headers):
         self.headers = headers
+        # A peer that backs its beacons off is evasive once it missed two
+        # of them, and expired after three
+        try:
+            interval = float(headers.get(self.INTERVAL_HEADER, 0)) / 1000
+        except ValueError:
+            interval = 0
+        self.evasive_after = max(self.PEER_EVASIVE, 2 * interval)
+        self.expired_after = max(self.PEER_EXPIRED, 3 * interval)
     # end set_headers
 
+    # Count frames sent to peer, including resends and NACKs
+    def count_sent(self, frames):
+        self.msgs_sent += 1
+        self.bytes_sent += sum(len(frame) for frame in frames)
+
+    # Count a message received from peer, including resends and NACKs
+    def count_recv(self, msg):
+        self.msgs_recv += 1
+        self.bytes_recv += len(msg.struct_data) + msg.get_content_size()
+
+    # Get peer traffic counters. Messages and bytes are counted as they
+    # go over the wire, resends and NACKs included. Drops are messages
+    # that couldn't be sent, seq_errors are sequence gaps from the peer
+    # and window is the number of sent messages kept for resending.
+    def get_stats(self):
+        return {
+            "name": self.name,
+            "msgs_sent": self.msgs_sent,
+            "bytes_sent": self.bytes_sent,
+            "msgs_recv": self.msgs_recv,
+            "bytes_recv": self.bytes_recv,
+            "drops": self.drops,
+            "seq_errors": self.seq_errors,
+            "resends": self.resends,
+            "pings_sent": self.pings_sent,
+            "pings_recv": self.pings_recv,
+            "window": len(self.sent_window),
+        }
+    # end get_stats
+
     # Check if messages were lost from peer, returns true if they were
     def messages_lost(self, msg):
         # The sequence number set by the peer, and our own calculated
@@ -189,18 +535,64 @@ class PyrePeer(object):
             msg.get_command(),
             self.name,
             msg.get_sequence()) )
-        if msg.get_command == "HELLO":
-            self.want_sequence = 1
-        else:
-            self.want_sequence += 1
-            self.want_sequence = self.want_sequence % 65535
-
-        if self.want_sequence != msg.get_sequence():
+        if msg.get_command() == "HELLO":
+            self.want_sequence = 0
+            self.held.clear()
+
+        want_sequence = (self.want_sequence + 1) % 65535
+        if want_sequence != msg.get_sequence():
+            # Duplicates and messages ahead of a gap we already know
+            # about aren't new gaps
+            if not self.held and not self.is_duplicate(msg.get_sequence()):
+                self.seq_errors += 1
             logger.debug("(%s) seq error from peer=%s expect=%d, got=%d",
                 self.origin,
                 self.name,
-                self.want_sequence,
+                want_sequence,
                 msg.get_sequence())
             return True;
+        self.want_sequence = want_sequence
         return False
     # end check_message
+
+    # Hold on to a message that arrived ahead of a sequence gap, and ask
+    # the peer to fill the gap. Duplicates of messages we already have are
+    # dropped. Returns False if the gap is too big to be healed, or if the
+    # peer can't resend at all.
+    def hold(self, msg):
+        if not self.supports_nack():
+            return False
+        sequence = msg.get_sequence()
+        if self.is_duplicate(sequence):
+            return True
+        distance = (sequence - self.want_sequence - 1) % 65535
+        if distance >= self.RETRANSMIT_WINDOW or len(self.held) >= self.RETRANSMIT_WINDOW:
+            return False
+
+        new_gap = not self.held
+        self.held[sequence] = msg
+        if new_gap:
+            self.nack_retries = 0
+            self.request_resend()
+        return True
+    # end hold
+
+    # Return whether we already have the message with this sequence
+    def is_duplicate(self, sequence):
+        distance = (sequence - self.want_sequence - 1) % 65535
+        return distance > 65535 // 2 or sequence in self.held
+
+    # Yield held messages that are in sequence again, after a gap was
+    # healed
+    def release_held(self):
+        while self.held:
+            msg = self.held.pop((self.want_sequence + 1) % 65535, None)
+            if msg is None:
+                # Another gap further on, ask for it once all we asked
+                # for has arrived
+                if self.is_duplicate(self.nack_end):
+                    self.request_resend()
+                return
+            self.want_sequence = msg.get_sequence()
+            yield msg
+    # end release_held
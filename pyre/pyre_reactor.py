@@ -0,0 +1,194 @@
+"""
+    Runs many Pyre nodes on one thread. Each Pyre normally runs its node in
+    a thread of its own, plus one for its beacon; nodes attached to a
+    PyreReactor instead share the reactor's thread, which polls all their
+    sockets at once. Their beacons are run by the reactor too, and nodes on
+    the same beacon port share one UDP socket: each beacon read from it is
+    passed to every node on the port but the one it is from.
+
+        reactor = PyreReactor()
+        node1 = Pyre("node1", reactor=reactor)
+        node2 = Pyre("node2", reactor=reactor)
+        ...
+        node1.stop()
+        node2.stop()
+        reactor.destroy()
+
+    The nodes' API is the same as for any Pyre.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import zmq
+
+from . import zhelper
+from .zactor import ZActor
+from .zbeacon import InlineBeacon
+from .pyre_node import PyreNode, REAP_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class PyreReactor(object):
+
+    def __init__(self, ctx=None, *args, **kwargs):
+        """Constructor, starts the reactor thread.
+
+        Kwargs:
+            ctx: PyZMQ Context, if not specified a new context will be created.
+                Nodes attached to the reactor use it unless given their own.
+        """
+        super(PyreReactor, self).__init__(*args, **kwargs)
+        if ctx is None:
+            ctx = zmq.Context()
+        self.ctx = ctx
+        self.attaching = deque()    # Pipe and outbox of nodes to start
+        self.lock = threading.Lock()
+        self.actor = ZActor(self.ctx, ReactorLoop, self.attaching)
+
+    def attach(self, ctx, outbox):
+        """Start a node on the reactor thread, with outbox as its outbox.
+        Returns the node actor, which takes the same commands as the actor
+        of a node in its own thread. Pyre does this when given a reactor."""
+        return ReactorActor(self, ctx, outbox)
+
+    def destroy(self):
+        """Stop the reactor thread, and with it any nodes still attached"""
+        self.actor.destroy()
+
+
+class ReactorActor(ZActor):
+    """The actor of a node run by a reactor. It has a pipe to the node like
+    any ZActor, but the node runs on the reactor's thread."""
+
+    def __init__(self, reactor, ctx, outbox):
+        self.tag = self.ZACTOR_TAG
+        self.ctx = ctx
+        self.pipe, self.shim_pipe = zhelper.zcreate_pipe(ctx)
+        self.is_running = True
+        # The reactor takes the node's end of the pipe from the queue
+        with reactor.lock:
+            reactor.attaching.append((ctx, self.shim_pipe, outbox))
+            reactor.actor.send_unicode("ATTACH")
+        self.pipe.wait()
+
+
+class ReactorLoop(object):
+
+    def __init__(self, ctx, pipe, attaching, *args, **kwargs):
+        self.ctx = ctx
+        self.pipe = pipe              #  Actor command pipe
+        self.attaching = attaching    #  Pipe and outbox of nodes to start
+        self.nodes = []               #  Nodes we run
+        self.beacons = {}             #  Port: beacons sharing its UDP socket
+        self.terminated = False       #  Did caller ask us to quit?
+        self.run()
+
+    def handle_pipe(self):
+        command = self.pipe.recv_unicode()
+        if command == "ATTACH":
+            ctx, pipe, outbox = self.attaching.popleft()
+            self.nodes.append(ReactorNode(ctx, pipe, outbox, self))
+        elif command == "$TERM":
+            self.terminated = True
+        else:
+            logger.error("reactor: - invalid command: {0}".format(command))
+
+    # The node is done, tell its actor as a node thread would on exit
+    def detach(self, node):
+        self.nodes.remove(node)
+        node._pipe.set(zmq.SNDTIMEO, 0)
+        node._pipe.signal()
+        node._pipe.close()
+
+    def run(self):
+        # Signal actor successfully initialized
+        self.pipe.signal()
+
+        while not self.terminated:
+            # One poll for all the nodes' sockets
+            wake_at = time.time() + REAP_INTERVAL
+            sockets = [(self.pipe, zmq.POLLIN)]
+            for node in self.nodes:
+                wake_at = min(wake_at, node.wake_time())
+                sockets.extend(node.poller.sockets)
+            timeout = wake_at - time.time()
+            if timeout < 0:
+                timeout = 0
+            items = dict(zmq.zmq_poll(sockets, int(timeout * 1000)))
+
+            if self.pipe in items:
+                self.handle_pipe()
+            for node in list(self.nodes):
+                node.handle_events(items)
+                if node._terminated:
+                    self.detach(node)
+
+        for node in list(self.nodes):
+            self.detach(node)
+
+
+class ReactorNode(PyreNode):
+    """A PyreNode run by a reactor instead of its own thread"""
+
+    def __init__(self, ctx, pipe, outbox, reactor, *args, **kwargs):
+        self.reactor = reactor
+        super(ReactorNode, self).__init__(ctx, pipe, outbox, *args, **kwargs)
+        self.inline_beacon = True
+
+    # The reactor polls our sockets, so there is no loop to run
+    def run(self):
+        self._pipe.signal()
+        self.reap_at = time.time() + REAP_INTERVAL
+
+    def create_beacon(self):
+        return ReactorBeacon(self._ctx, self.reactor)
+
+
+class ReactorBeacon(InlineBeacon):
+    """An InlineBeacon that shares its UDP socket with the other beacons of
+    a reactor on the same port. The first to read the socket passes each
+    beacon to all of them, and each takes the beacons but its own."""
+
+    def __init__(self, ctx, reactor, *args, **kwargs):
+        self.reactor = reactor
+        super(ReactorBeacon, self).__init__(ctx, *args, **kwargs)
+
+    def configure(self, port_nbr):
+        self.port_nbr = port_nbr
+        shared = self.reactor.beacons.setdefault(port_nbr, [])
+        if shared:
+            # The first beacon on the port set the socket up
+            first = shared[0]
+            self.udpsock.close()
+            self.udpsock = first.udpsock
+            self.address = first.address
+            self.network_address = first.network_address
+            self.broadcast_address = first.broadcast_address
+            self.interface_name = first.interface_name
+        else:
+            self.prepare_udp()
+            # We may find the socket drained by another beacon, so we
+            # mustn't block on it
+            self.udpsock.setblocking(False)
+        shared.append(self)
+        self.pipe.send_unicode(str(self.address))
+
+    def handle_udp(self):
+        beacons = self.recv_beacons()
+        for beacon in self.reactor.beacons.get(self.port_nbr, [self]):
+            beacon.forward_beacons(beacons)
+
+    def destroy(self):
+        shared = self.reactor.beacons.get(self.port_nbr, [])
+        if self in shared:
+            shared.remove(self)
+        if shared:
+            # The others still use the socket
+            self.udpsock = None
+        else:
+            self.reactor.beacons.pop(self.port_nbr, None)
+        super(ReactorBeacon, self).destroy()
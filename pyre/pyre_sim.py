@@ -0,0 +1,519 @@
+"""In-process simulation of a Pyre network
+
+A SimNetwork runs many PyreNode instances in one thread, on a virtual
+clock, each behind a SimPyre front-end with the Pyre API. The sockets a
+node uses are replaced by in-memory SimSockets, and the ZBeacon actor by
+a SimBeacon on an in-memory beacon bus, so no threads, UDP or TCP are
+involved. Everything else, peer management, the ZRE codec and group
+handling, is the real node code.
+
+    net = SimNetwork(seed=1)
+    nodes = [net.add_node() for i in range(100)]
+    for node in nodes:
+        node.start()
+    net.run_until(net.converged, timeout=10)
+
+Faults can be injected at any time:
+
+    net.latency = 0.005         # seconds per message
+    net.jitter = 0.002          # extra random delay, per message
+    net.loss = 0.01             # fraction of mailbox messages dropped
+    net.beacon_loss = 0.1       # fraction of beacons dropped
+    net.partition(nodes[:50], nodes[50:])
+    net.heal()
+
+Messages on a mailbox are delivered in order, like on a TCP connection.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import random
+import struct
+from collections import deque
+
+import zmq
+
+from .pyre_node import PyreNode, REAP_INTERVAL
+from .zbeacon import INTERVAL_DFLT
+
+logger = logging.getLogger(__name__)
+
+
+class SimSocket(object):
+    """In-memory stand in for a zmq socket. Sent messages are routed by
+    the network, received messages wait in a queue"""
+
+    def __init__(self, ctx, type):
+        self.ctx = ctx
+        self.type = type
+        self.identity = b''
+        self.endpoint = None     # Endpoint connected or bound to
+        self.peer = None         # Other end of a pipe
+        self.queue = deque()     # Received messages
+        self.deliver_at = 0      # Delivery time of the last message sent
+        self.discard = False     # Drop what we receive
+        self.closed = False
+        self._frames = []
+
+    def setsockopt(self, option, value):
+        if option == zmq.IDENTITY:
+            self.identity = value
+
+    set = setsockopt
+
+    def bind(self, endpoint):
+        self.ctx.network.bind(self, endpoint)
+
+    def bind_to_random_port(self, addr, *args, **kwargs):
+        port = self.ctx.network.random_port(self.ctx.address)
+        self.bind("tcp://{0}:{1}".format(self.ctx.address, port))
+        return port
+
+    def connect(self, endpoint):
+        self.endpoint = endpoint
+
+    def close(self, linger=None):
+        self.closed = True
+        self.ctx.network.unbind(self)
+
+    def send(self, data, flags=0, copy=True, track=False):
+        self._frames.append(data)
+        if not flags & zmq.SNDMORE:
+            frames, self._frames = self._frames, []
+            self.ctx.network.route(self, frames)
+
+    def send_unicode(self, u, flags=0, encoding='utf-8'):
+        self.send(u.encode(encoding), flags)
+
+    send_string = send_unicode
+
+    def send_multipart(self, msg_parts, flags=0, copy=True, track=False):
+        for part in msg_parts[:-1]:
+            self.send(part, zmq.SNDMORE)
+        self.send(msg_parts[-1], flags)
+
+    def send_json(self, obj, flags=0):
+        self.send(json.dumps(obj).encode('utf-8'), flags)
+
+    # Objects are passed as they are, nothing crosses a process
+    def send_pyobj(self, obj, flags=0):
+        self.send(obj, flags)
+
+    def recv_multipart(self, flags=0, copy=True, track=False):
+        if not self.queue:
+            raise zmq.Again()
+        return list(self.queue.popleft())
+
+    def recv(self, flags=0, copy=True, track=False):
+        return self.recv_multipart(flags)[0]
+
+    def recv_unicode(self, flags=0, encoding='utf-8'):
+        return self.recv(flags).decode(encoding)
+
+    recv_string = recv_unicode
+
+    def recv_pyobj(self, flags=0):
+        return self.recv(flags)
+
+    def signal(self, status=0):
+        self.send(struct.pack("Q", 0x7766554433221100 + status))
+
+
+class SimContext(object):
+    """Stand in for a zmq context, creating SimSockets for one host"""
+
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address   # IP address of the simulated host
+        self.node = None         # Node receiving on this host's inbox
+
+    def socket(self, type):
+        return SimSocket(self, type)
+
+    def term(self):
+        pass
+
+
+class SimBeacon(SimSocket):
+    """Stand in for a ZBeacon actor, taking the same commands over its
+    pipe. Beacons go out on the network's beacon bus, received beacons are
+    queued on the pipe like ZBeacon does."""
+
+    def __init__(self, ctx):
+        super(SimBeacon, self).__init__(ctx, zmq.PAIR)
+        self.is_running = True
+        self.port_nbr = None
+        self.transmit = None
+        self.filter = None
+        self.interval = INTERVAL_DFLT
+        self.min_interval = INTERVAL_DFLT
+        self.max_interval = INTERVAL_DFLT
+        self.ping_at = None      # Time of the next scheduled beacon
+
+    # Commands from the node arrive here, instead of going to a peer
+    def handle_command(self, request):
+        command = request.pop(0).decode('UTF-8')
+        if command == "CONFIGURE":
+            self.port_nbr = struct.unpack('I', request.pop(0))[0]
+            self.ctx.network.subscribe(self)
+            self.queue.append([self.ctx.address.encode('UTF-8')])
+        elif command == "PUBLISH":
+            self.transmit = request.pop(0)
+            self.interval = self.min_interval
+            # Start broadcasting immediately
+            self.ctx.network.publish(self)
+        elif command == "SILENCE":
+            self.transmit = None
+        elif command == "SUBSCRIBE":
+            self.filter = request.pop(0)
+        elif command == "UNSUBSCRIBE":
+            self.filter = None
+        elif command == "SET INTERVAL":
+            self.min_interval = float(request.pop(0)) / 1000 or INTERVAL_DFLT
+            self.max_interval = max(self.max_interval, self.min_interval)
+            self.interval = self.min_interval
+        elif command == "SET MAX INTERVAL":
+            self.max_interval = max(float(request.pop(0)) / 1000, self.min_interval)
+        elif command == "BURST":
+            self.interval = self.min_interval
+            self.ctx.network.burst(self)
+        elif command in ("VERBOSE", "SET INTERFACE", "SET REFRESH"):
+            pass
+        else:
+            logger.error("SimBeacon: invalid command: {0}".format(command))
+
+    def resolve(self):
+        return self
+
+    def destroy(self):
+        self.is_running = False
+        self.transmit = None
+        self.ctx.network.unsubscribe(self)
+
+    # Return whether we pass a beacon on to the node
+    def accepts(self, frame):
+        if not self.is_running or self.filter is None:
+            return False
+        return frame.startswith(self.filter) and frame != self.transmit
+
+
+class SimNode(PyreNode):
+    """A PyreNode driven by a SimNetwork instead of its own thread"""
+
+    def __init__(self, ctx, pipe, outbox, *args, **kwargs):
+        ctx.node = self
+        self.running = False     # Started and not stopped
+        super(SimNode, self).__init__(ctx, pipe, outbox, *args, **kwargs)
+        self.clock = ctx.network.clock
+        self.ipc = False         # Simulated nodes only have tcp
+        self.inproc = False
+
+    # The network drives us, so there is no loop to run
+    def run(self):
+        pass
+
+    def create_beacon(self):
+        return SimBeacon(self._ctx)
+
+
+class SimPyre(object):
+    """Front-end to a SimNode, with the same API as Pyre. Commands are
+    handled by the node straight away, events are returned by recv()."""
+
+    def __init__(self, network, address, name=None, keep_events=True):
+        ctx = SimContext(network, address)
+        self.network = network
+        self.api = SimSocket(ctx, zmq.PAIR)
+        self.inbox = SimSocket(ctx, zmq.PAIR)
+        self.inbox.discard = not keep_events
+        pipe = SimSocket(ctx, zmq.PAIR)
+        outbox = SimSocket(ctx, zmq.PAIR)
+        self.api.peer, pipe.peer = pipe, self.api
+        self.inbox.peer, outbox.peer = outbox, self.inbox
+        self.node = SimNode(ctx, pipe, outbox)
+        if name:
+            self.command("SET NAME", name)
+
+    # Send a command to the node, and return the reply if we expect one
+    def command(self, *frames, **kwargs):
+        self.api.send_multipart([f.encode('utf-8') if isinstance(f, str) else f for f in frames])
+        self.node.recv_api()
+        if kwargs.get("reply"):
+            return self.api.recv()
+
+    def start(self):
+        self.command("START")
+        self.api.recv()
+        self.node.running = True
+        self.network.started(self.node)
+
+    def stop(self):
+        self.command("STOP")
+        self.api.recv()
+        self.node.running = False
+
+    @property
+    def running(self):
+        return self.node.running
+
+    def uuid(self):
+        return self.node.identity
+
+    def name(self):
+        return self.node.name
+
+    def set_header(self, key, value):
+        self.command("SET HEADER", key, value)
+
+    def set_super_peer(self):
+        self.command("SET SUPER PEER")
+
+    def set_leaf(self):
+        self.command("SET LEAF")
+
+    def set_shout_fanout(self, fanout):
+        self.command("SET SHOUT FANOUT", str(fanout))
+
+    def set_mailbox_idle(self, seconds):
+        self.command("SET MAILBOX IDLE", str(seconds))
+
+    def set_interval(self, interval):
+        self.command("SET INTERVAL", str(interval))
+
+    def set_max_interval(self, interval):
+        self.command("SET MAX INTERVAL", str(interval))
+
+    def join(self, group):
+        self.command("JOIN", group)
+
+    def leave(self, group):
+        self.command("LEAVE", group)
+
+    def shout(self, group, msg):
+        self.command("SHOUT", group, msg)
+
+    def whisper(self, peer, msg):
+        self.command("WHISPER", peer.bytes, msg)
+
+    def peers(self):
+        return self.command("PEERS", reply=True)
+
+    def peers_by_group(self, group):
+        return self.command("PEERS BY GROUP", group, reply=True)
+
+    def own_groups(self):
+        return self.command("OWN GROUPS", reply=True)
+
+    def peer_groups(self):
+        return self.command("PEER GROUPS", reply=True)
+
+    def stats(self):
+        return self.command("STATS", reply=True)
+
+    # Return the next event, or None if there is none
+    def recv(self):
+        if not self.inbox.queue:
+            return None
+        return self.inbox.recv_multipart()
+
+
+class SimNetwork(object):
+    """Runs SimNodes on a virtual clock, delivering their messages and
+    beacons as scheduled events"""
+
+    def __init__(self, seed=None, latency=0.001, jitter=0.0, loss=0.0, beacon_loss=0.0):
+        self.now = 0.0
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.beacon_loss = beacon_loss
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.endpoints = {}      # Bound inbox sockets by endpoint
+        self.ports = {}          # Last port given out per address
+        self.beacons = {}        # Beacons per UDP port
+        self.components = {}     # Partition of each address
+        self.stats = dict.fromkeys(["messages", "bytes", "dropped", "beacons", "events"], 0)
+        self._events = []
+        self._seq = itertools.count()
+
+    # The virtual clock, in seconds
+    def clock(self):
+        return self.now
+
+    # Add a node, returns its SimPyre front-end. Each node gets a host of
+    # its own unless an address is given. Pass keep_events=False to drop
+    # events nobody is going to recv().
+    def add_node(self, name=None, keep_events=True, address=None):
+        if address is None:
+            index = len(self.nodes) + 1
+            address = "10.{0}.{1}.{2}".format(index >> 16 & 255, index >> 8 & 255, index & 255)
+        node = SimPyre(self, address, name, keep_events)
+        self.nodes.append(node)
+        return node
+
+    # Call fn(*args) at a virtual time
+    def schedule(self, at, fn, *args):
+        heapq.heappush(self._events, (at, next(self._seq), fn, args))
+
+    # Run events for a virtual duration
+    def run(self, duration):
+        end = self.now + duration
+        while self._events and self._events[0][0] <= end:
+            at, seq, fn, args = heapq.heappop(self._events)
+            self.now = at
+            self.stats["events"] += 1
+            fn(*args)
+        self.now = end
+
+    # Run until predicate() is true, checking every step of virtual time.
+    # Returns the virtual time it took, or None on timeout.
+    def run_until(self, predicate, timeout=60.0, step=0.1):
+        start = self.now
+        while self.now - start < timeout:
+            if predicate():
+                return self.now - start
+            self.run(step)
+        return None
+
+    # Return whether all running nodes know each other, and, if a group
+    # is given, see each other in that group
+    def converged(self, group=None):
+        running = [pyre.node for pyre in self.nodes if pyre.running]
+        ids = set(node.identity for node in running)
+        for node in running:
+            if set(node.peers) | set([node.identity]) != ids:
+                return False
+            if group is not None:
+                grp = node.peer_groups.get(group)
+                members = set(grp.peers) if grp else set()
+                if members | set([node.identity]) != ids:
+                    return False
+        return True
+
+    # Split the network, nodes can only reach nodes in the same part.
+    # Nodes not listed form one more part.
+    def partition(self, *parts):
+        self.components = {}
+        for i, part in enumerate(parts):
+            for pyre in part:
+                self.components[pyre.node._ctx.address] = i
+
+    def heal(self):
+        self.components = {}
+
+    def reachable(self, src, dst):
+        return self.components.get(src, -1) == self.components.get(dst, -1)
+
+    def random_port(self, address):
+        port = self.ports.get(address, 49151) + 1
+        self.ports[address] = port
+        return port
+
+    def bind(self, sock, endpoint):
+        if endpoint in self.endpoints:
+            raise zmq.ZMQError(zmq.EADDRINUSE)
+        sock.endpoint = endpoint
+        self.endpoints[endpoint] = sock
+
+    def unbind(self, sock):
+        if sock.endpoint and self.endpoints.get(sock.endpoint) is sock:
+            del self.endpoints[sock.endpoint]
+
+    # A node started, reap its peers once per interval from now on
+    def started(self, node):
+        self.schedule(self.now + self.random.uniform(0, REAP_INTERVAL), self.reap, node)
+
+    def reap(self, node):
+        if node.running:
+            node.reap_peers()
+            self.schedule(self.now + REAP_INTERVAL, self.reap, node)
+
+    # Route a message sent on a socket
+    def route(self, sock, frames):
+        if sock.closed:
+            return
+        if isinstance(sock, SimBeacon):
+            sock.handle_command(frames)
+        elif sock.type == zmq.PAIR:
+            if not sock.peer.discard:
+                sock.peer.queue.append(frames)
+        elif sock.type == zmq.DEALER:
+            self.send_mailbox(sock, frames)
+        else:
+            raise NotImplementedError("SimSocket can't send on socket type {0}".format(sock.type))
+
+    # Deliver a message from a peer mailbox to the inbox it's connected to
+    def send_mailbox(self, sock, frames):
+        inbox = self.endpoints.get(sock.endpoint)
+        if inbox is None or not self.reachable(sock.ctx.address, inbox.ctx.address) \
+                or self.random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+        at = self.now + self.latency + self.random.uniform(0, self.jitter)
+        # Keep messages on one connection in order
+        at = max(at, sock.deliver_at)
+        sock.deliver_at = at
+        self.stats["messages"] += 1
+        self.stats["bytes"] += sum(len(frame) for frame in frames)
+        self.schedule(at, self.deliver_mailbox, inbox, [sock.identity] + frames)
+
+    def deliver_mailbox(self, inbox, frames):
+        node = inbox.ctx.node
+        if inbox.closed or not node.running:
+            self.stats["dropped"] += 1
+            return
+        inbox.queue.append(frames)
+        node.recv_peer()
+
+    def subscribe(self, beacon):
+        self.beacons.setdefault(beacon.port_nbr, []).append(beacon)
+
+    def unsubscribe(self, beacon):
+        for beacons in self.beacons.values():
+            if beacon in beacons:
+                beacons.remove(beacon)
+
+    # Send a beacon now, and keep sending it every interval
+    def publish(self, beacon):
+        self.broadcast(beacon, beacon.transmit)
+        if beacon.ping_at is None:
+            beacon.ping_at = self.now + beacon.interval
+            self.schedule(beacon.ping_at, self.beacon_tick, beacon, beacon.ping_at)
+
+    def beacon_tick(self, beacon, at):
+        if at != beacon.ping_at:
+            # Brought forward by a burst
+            return
+        if not beacon.is_running or beacon.transmit is None:
+            beacon.ping_at = None
+            return
+        self.broadcast(beacon, beacon.transmit)
+        beacon.ping_at = self.now + beacon.interval
+        beacon.interval = min(beacon.interval * 2, beacon.max_interval)
+        self.schedule(beacon.ping_at, self.beacon_tick, beacon, beacon.ping_at)
+
+    # Membership changed, bring the next beacon forward like ZBeacon does
+    def burst(self, beacon):
+        if beacon.ping_at is None:
+            return
+        at = self.now + self.random.uniform(0, beacon.interval)
+        if at < beacon.ping_at:
+            beacon.ping_at = at
+            self.schedule(at, self.beacon_tick, beacon, at)
+
+    def broadcast(self, beacon, frame):
+        self.stats["beacons"] += 1
+        src = beacon.ctx.address
+        targets = [b for b in self.beacons.get(beacon.port_nbr, ())
+                   if b is not beacon and self.reachable(src, b.ctx.address)
+                   and self.random.random() >= self.beacon_loss]
+        self.schedule(self.now + self.latency, self.deliver_beacon, src, frame, targets)
+
+    def deliver_beacon(self, src, frame, targets):
+        for beacon in targets:
+            if beacon.accepts(frame) and beacon.ctx.node.running:
+                beacon.queue.append([src.encode('UTF-8'), frame])
+                beacon.ctx.node.recv_beacon()
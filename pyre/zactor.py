@@ -117,6 +117,52 @@ class ZActor(object):
     def resolve(self):
         return self.pipe
 
+
+class ZProcessActor(ZActor):
+    """A ZActor that runs the actor in a child process instead of a thread,
+    so it doesn't share the GIL with its caller. The process is started
+    with multiprocessing spawn, so the actor and its arguments must pickle,
+    and a program starting one must guard its main code with
+    if __name__ == '__main__'. The actor gets a context of its own, and
+    its pipe goes over ipc."""
+
+    PROCESS_LINGER = 5.0    # Secs to wait for the process to exit on destroy
+
+    def __init__(self, ctx, actor, *args, **kwargs):
+        self.tag = self.ZACTOR_TAG
+        self.ctx = ctx
+        self.pipe, self.endpoint = zhelper.zbind_pipe(ctx)
+        self.is_running = True
+        import multiprocessing
+        spawn = multiprocessing.get_context("spawn")
+        self.process = spawn.Process(target=zprocess_run,
+                                     args=(actor, self.endpoint, args, kwargs))
+        # Don't outlive the caller if it never destroys us
+        self.process.daemon = True
+        self.process.start()
+        self.pipe.wait()
+        # The actor is connected, so the socket file can go
+        zhelper.zremove_pipe(self.endpoint)
+
+    def destroy(self):
+        super(ZProcessActor, self).destroy()
+        self.process.join(self.PROCESS_LINGER)
+        if self.process.is_alive():
+            logger.warning("ZProcessActor: process didn't exit, terminating it")
+            self.process.terminate()
+        self.is_running = False
+
+
+# Run an actor in a child process, with a pipe back to endpoint
+def zprocess_run(actor, endpoint, args, kwargs):
+    ctx = zmq.Context()
+    pipe = zhelper.zconnect_pipe(ctx, endpoint)
+    actor(ctx, pipe, *args, **kwargs)
+    pipe.set(zmq.SNDTIMEO, 0)
+    pipe.signal()
+    pipe.close()
+
+
 def echo_actor(ctx, pipe, *args):
     # Do some initialization
     pipe.signal()
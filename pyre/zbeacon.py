@@ -15,18 +15,25 @@
     using UDP messages on the local area network. This implementation uses
     IPv4 UDP broadcasts. You can define the format of your outgoing beacons,
     and set a filter that validates incoming beacons. Beacons are sent and
-    received asynchronously in the background.
+    received asynchronously in the background. Where the kernel reports
+    interface changes, as on Linux, a beacon whose address changes sets its
+    UDP socket up again on the new address.
+
+    An InlineBeacon does the same without a thread of its own, for an owner
+    that polls the UDP socket in its own poller.
 
     This class replaces zbeacon_v2, and is meant for applications that use
     the CZMQ v3 API (meaning, zsock).
 """
 
 import logging
-import ipaddress
 import socket
 import zmq
 import struct
 import time
+import random
+import errno
+from collections import deque
 from sys import platform
 from .zactor import ZActor
 from . import zhelper
@@ -35,6 +42,10 @@ from .zhelper import u
 logger = logging.getLogger(__name__)
 
 INTERVAL_DFLT = 1.0
+CACHE_TTL = 60.0      # Forget beacons we haven't had for this long
+DRAIN_MAX = 256       # Most beacons read in one go
+RECV_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+                      # Don't block once the beacons waiting are read
 BEACON_MAX = 255      # Max size of beacon data
 MULTICAST_GRP = '225.25.25.25'
 ENETDOWN = 50   #socket error, network is down
@@ -50,9 +61,21 @@ class ZBeacon(object):
                                       #  UDP socket for send/recv
         self.port_nbr = 0             #  UDP port number we work on
         self.interval = INTERVAL_DFLT #  Beacon broadcast interval
+        self.min_interval = INTERVAL_DFLT
+                                      #  Interval while membership changes
+        self.max_interval = INTERVAL_DFLT
+                                      #  Interval we back off to when stable
         self.ping_at = 0              #  Next broadcast time
         self.transmit = None          #  Beacon transmit data
         self.filter = b""             #  Beacon filter data
+        self.refresh = 0              #  Batch repeated beacons this often, 0=never
+        self.refresh_at = 0           #  Next batch time
+        self.seen = {}                #  (peername, beacon): last received
+        self.repeated = {}            #  Repeated beacons for the next batch,
+                                      #  (peername, beacon): True
+        self.buffer = bytearray(BEACON_MAX)
+                                      #  Receive buffer
+        self.ifwatch = None           #  Tells us of interface changes
 
         self.terminated = False       #  Did caller ask us to quit?
         self.verbose = False          #  Verbose logging enabled?
@@ -67,6 +90,8 @@ class ZBeacon(object):
     def __del__(self):
         if self.udpsock:
             self.udpsock.close()
+        if self.ifwatch:
+            self.ifwatch.close()
 
     def prepare_udp(self):
         try:
@@ -162,6 +187,7 @@ class ZBeacon(object):
 
             interface_string = "{0}/{1}".format(address_str, netmask_str)
 
+            import ipaddress
             interface = ipaddress.ip_interface(u(interface_string))
 
             if interface.is_loopback:
@@ -189,7 +215,7 @@ class ZBeacon(object):
 
     def _prepare_socket(self):
 
-        netinf = zhelper.get_ifaddrs()
+        netinf = zhelper.get_ifaddrs_cached()
 
         logger.debug("Available interfaces: {0}".format(netinf))
 
@@ -217,6 +243,7 @@ class ZBeacon(object):
             logger.debug("Finished scanning interfaces.")
 
         if not self.address:
+            import ipaddress
             self.network_address = ipaddress.IPv4Address(u('127.0.0.1'))
             self.broadcast_address = ipaddress.IPv4Address(u(MULTICAST_GRP))
             self.interface_name = 'loopback'
@@ -234,7 +261,9 @@ class ZBeacon(object):
 
     def handle_pipe(self):
         #  Get just the commands off the pipe
-        request = self.pipe.recv_multipart()
+        return self.handle_command(self.pipe.recv_multipart())
+
+    def handle_command(self, request):
         command = request.pop(0).decode('UTF-8')
         if not command:
             return -1                  #  Interrupted
@@ -249,14 +278,31 @@ class ZBeacon(object):
         elif command == "CONFIGURE":
             port = struct.unpack('I', request.pop(0))[0]
             self.configure(port)
+        elif command == "SET INTERVAL":
+            # In msecs, 0 means the default
+            self.min_interval = float(request.pop(0)) / 1000 or INTERVAL_DFLT
+            self.max_interval = max(self.max_interval, self.min_interval)
+            self.interval = self.min_interval
+        elif command == "SET MAX INTERVAL":
+            # In msecs, we never back off beyond the interval
+            self.max_interval = max(float(request.pop(0)) / 1000, self.min_interval)
+        elif command == "BURST":
+            # Membership changed, so beacon at the short interval again.
+            # Many nodes see the same change, so spread their beacons out.
+            self.interval = self.min_interval
+            if self.transmit:
+                self.ping_at = min(self.ping_at, time.time() + random.uniform(0, self.interval))
         elif command == "PUBLISH":
             self.transmit = request.pop(0)
-            if self.interval == 0:
-                self.interval = INTERVAL_DFLT
+            self.interval = self.min_interval
             # Start broadcasting immediately
             self.ping_at = time.time()
         elif command == "SILENCE":
             self.transmit = None
+        elif command == "SET REFRESH":
+            # In msecs, 0 forwards every beacon
+            self.refresh = float(request.pop(0)) / 1000
+            self.refresh_at = time.time() + self.refresh
         elif command == "SUBSCRIBE":
             self.filter = request.pop(0)
         elif command == "UNSUBSCRIBE":
@@ -267,32 +313,72 @@ class ZBeacon(object):
             logger.error("zbeacon: - invalid command: {0}".format(command))
 
     def handle_udp(self):
-        try:
-            frame, addr = self.udpsock.recvfrom(BEACON_MAX)
-
-        except Exception as e:
-            logger.exception("Exception while receiving: {0}".format(e))
-            return
-
-        peername = addr[0]
+        self.forward_beacons(self.recv_beacons())
 
+    #  Read every beacon that is waiting, return the peer name and beacon
+    #  of each
+    def recv_beacons(self):
+        beacons = []
+        for i in range(DRAIN_MAX):
+            try:
+                size, addr = self.udpsock.recvfrom_into(self.buffer, BEACON_MAX, RECV_FLAGS)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    logger.exception("Exception while receiving: {0}".format(e))
+                break
+            beacons.append((addr[0], bytes(self.buffer[:size])))
+            if not RECV_FLAGS:
+                #  We can't tell if more are waiting without blocking
+                break
+        return beacons
+
+    #  Send the beacons to pass on to the API in one message: the peer name
+    #  and beacon of each
+    def forward_beacons(self, beacons):
+        forward = []
+        now = time.time()
+        for peername, frame in beacons:
+            if self.accepts(peername, frame, now):
+                forward.append(peername.encode('UTF-8'))
+                forward.append(frame)
+        if forward:
+            self.pipe.send_multipart(forward)
+
+    #  Return whether to pass a beacon on to the API now
+    def accepts(self, peername, frame, now):
         #  If filter is set, check that beacon matches it
-        is_valid = False
-        if self.filter is not None:
-            if len(self.filter) <= len(frame):
-                match_data = frame[:len(self.filter)]
-                if (match_data == self.filter):
-                    is_valid = True
-
-        #  If valid, discard our own broadcasts, which UDP echoes to us
-        if is_valid and self.transmit:
-            if frame == self.transmit:
-                is_valid = False
-
-        #  If still a valid beacon, send on to the API
-        if is_valid:
-            self.pipe.send_unicode(peername, zmq.SNDMORE)
-            self.pipe.send(frame)
+        if self.filter is None or not frame.startswith(self.filter):
+            return False
+
+        #  Discard our own broadcasts, which UDP echoes to us
+        if self.transmit and frame == self.transmit:
+            return False
+
+        #  When batching, a beacon we've had before only goes in the next
+        #  batch
+        if self.refresh:
+            key = (peername, frame)
+            repeat = key in self.seen
+            self.seen[key] = now
+            if repeat:
+                self.repeated[key] = True
+                return False
+        return True
+
+    #  Send the repeated beacons to the API in one message: an empty frame,
+    #  then the peer name and beacon of each. Forget beacons that stopped.
+    def send_batch(self):
+        if self.repeated:
+            batch = [b""]
+            for peername, frame in self.repeated:
+                batch.append(peername.encode('UTF-8'))
+                batch.append(frame)
+            self.pipe.send_multipart(batch)
+            self.repeated = {}
+        stale = time.time() - CACHE_TTL
+        for key, seen_at in list(self.seen.items()):
+            if seen_at < stale:
+                del self.seen[key]
 
     def send_beacon(self):
         try:
@@ -317,6 +403,44 @@ class ZBeacon(object):
             logger.debug("Network seems gone, exiting zbeacon")
             self.terminated = True
 
+    #  The kernel reported an interface change. If our address changed, set
+    #  the UDP socket up again on the new one.
+    def handle_ifchange(self):
+        if not zhelper.ifaddrs_changed(self.ifwatch) or not self.port_nbr:
+            return
+        address = self.address
+        self.address = None
+        self._prepare_socket()
+        if self.address == address:
+            return
+        logger.info("zbeacon: address changed from {0} to {1}, rebinding".format(address, self.address))
+        self.poller.unregister(self.udpsock)
+        self.udpsock.close()
+        self.udpsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.prepare_udp()
+        self.poller.register(self.udpsock, zmq.POLLIN)
+
+    #  Return when our beacon or the batch of repeated beacons is next due
+    def wake_time(self):
+        wake_at = time.time() + 1
+        if self.transmit:
+            wake_at = min(wake_at, self.ping_at)
+        if self.refresh:
+            wake_at = min(wake_at, self.refresh_at)
+        return wake_at
+
+    #  Send our beacon and the batch of repeated beacons if they're due
+    def send_due(self):
+        if self.transmit and time.time() >= self.ping_at:
+            self.send_beacon()
+            self.ping_at = time.time() + self.interval
+            # Back off while nothing changes
+            self.interval = min(self.interval * 2, self.max_interval)
+
+        if self.refresh and time.time() >= self.refresh_at:
+            self.send_batch()
+            self.refresh_at = time.time() + self.refresh
+
     def run(self):
         # Signal actor successfully initialized
         self.pipe.signal()
@@ -324,23 +448,98 @@ class ZBeacon(object):
         self.poller = zmq.Poller()
         self.poller.register(self.pipe, zmq.POLLIN)
         self.poller.register(self.udpsock, zmq.POLLIN)
+        udp = self.udpsock.fileno()
+        # Rebind when our address changes, where we can tell
+        self.ifwatch = zhelper.ifaddrs_watch()
+        watch = self.ifwatch.fileno() if self.ifwatch else None
+        if self.ifwatch:
+            self.poller.register(self.ifwatch, zmq.POLLIN)
 
         while not self.terminated:
-            timeout = 1
-            if self.transmit:
-                timeout = self.ping_at - time.time()
-                if timeout < 0:
-                    timeout = 0
+            timeout = self.wake_time() - time.time()
+            if timeout < 0:
+                timeout = 0
             # Poll on API pipe and on UDP socket
-            items = dict(self.poller.poll(timeout * 1000))
-            if self.pipe in items and items[self.pipe] == zmq.POLLIN:
-                self.handle_pipe()
-            if self.udpsock.fileno() in items and items[self.udpsock.fileno()] == zmq.POLLIN:
-                self.handle_udp()
-
-            if self.transmit and time.time() >= self.ping_at:
-                self.send_beacon()
-                self.ping_at = time.time() + self.interval
+            for item, event in self.poller.poll(timeout * 1000):
+                if item is self.pipe:
+                    self.handle_pipe()
+                elif item == udp:
+                    self.handle_udp()
+                elif item == watch:
+                    self.handle_ifchange()
+                    udp = self.udpsock.fileno()
+            self.send_due()
+
+
+class InlineQueue(object):
+    """Stands in for the actor pipe of an InlineBeacon: what the beacon
+    sends is queued for its owner to take."""
+
+    def __init__(self):
+        self.queue = deque()
+
+    def send_unicode(self, string, flags=0):
+        self.queue.append([string.encode('UTF-8')])
+
+    def send_multipart(self, frames):
+        self.queue.append(frames)
+
+
+class InlineBeacon(ZBeacon):
+    """A ZBeacon run by its owner instead of a thread of its own. It takes
+    the same commands as the actor and hands out the same messages, but
+    commands are handled as they are sent, and the owner polls the UDP
+    socket from resolve(), calls recv_multipart() when it's readable and
+    send_due() by wake_time()."""
+
+    def __init__(self, ctx, *args, **kwargs):
+        self.request = []             #  Frames of the command being sent
+        super(InlineBeacon, self).__init__(ctx, InlineQueue(), *args, **kwargs)
+
+    def run(self):
+        # Our owner does the polling
+        pass
+
+    @property
+    def is_running(self):
+        return not self.terminated
+
+    def send(self, data, flags=0):
+        self.request.append(data)
+        if not flags & zmq.SNDMORE:
+            request, self.request = self.request, []
+            self.handle_command(request)
+            # A new beacon goes out right away, as from the actor
+            self.send_due()
+
+    def send_unicode(self, string, flags=0):
+        self.send(string.encode('UTF-8'), flags)
+
+    def recv_unicode(self):
+        return self.pipe.queue.popleft()[0].decode('UTF-8')
+
+    #  Return what we have for the owner: a batch if one is due, else the
+    #  beacons waiting on the UDP socket, or [] if none pass
+    def recv_multipart(self):
+        if not self.pipe.queue:
+            self.handle_udp()
+        if self.pipe.queue:
+            return self.pipe.queue.popleft()
+        return []
+
+    #  Return whether a message waits for the owner
+    def pending(self):
+        return bool(self.pipe.queue)
+
+    #  The UDP socket, for the owner to poll
+    def resolve(self):
+        return self.udpsock.fileno()
+
+    def destroy(self):
+        self.terminated = True
+        if self.udpsock:
+            self.udpsock.close()
+            self.udpsock = None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,227 @@
+# ======================================================================
+#  zgossip - decentralized configuration management
+#
+#  Copyright (c) the Contributors as noted in the AUTHORS file.
+#  This file is part of CZMQ, the high-level C binding for 0MQ:
+#  http://czmq.zeromq.org.
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+    Implements a gossip protocol for decentralized configuration management.
+    Each node binds a server socket that other nodes connect to as clients,
+    and may connect to any number of other nodes' servers. Nodes share a
+    table of key=value tuples: a client that says HELLO gets the server's
+    whole table once, and from then on every node passes on only the
+    tuples that are new to it or that changed, to its clients and to the
+    servers it's connected to. A tuple that doesn't change is dropped, so
+    the network may have loops.
+
+    An empty value retracts a tuple for good. It is kept as a tombstone,
+    so the retraction isn't taken for news when it comes round again, and
+    values that were on their way before it don't bring the tuple back.
+    Tombstones aren't sent to clients that say HELLO.
+
+    API commands:
+        VERBOSE             log all traffic
+        BIND endpoint       bind the server socket to an endpoint
+        CONNECT endpoint    connect to another node's server
+        PUBLISH key value   publish a tuple, an empty value retracts it
+        $TERM               end the actor
+
+    Tuples that are new or changed are sent to the API as:
+        DELIVER key value
+"""
+
+import logging
+import time
+import zmq
+from .zactor import ZActor
+from .zgossip_msg import ZGossipMsg
+
+logger = logging.getLogger(__name__)
+
+PING_INTERVAL = 1.0     # Clients ping their servers once a second
+LINGER = 100            # Msecs to get our last tuples out on $TERM
+
+
+class ZGossip(object):
+
+    def __init__(self, ctx, pipe, *args, **kwargs):
+        self.ctx = ctx                #  ZMQ context
+        self.pipe = pipe              #  Actor command pipe
+        self.server = None            #  ROUTER socket for clients, once bound
+        self.remotes = []             #  DEALER sockets to servers we connect to
+        self.clients = set()          #  Routing ids of clients that said HELLO
+        self.tuples = {}              #  Our table, key: value
+        self.ping_at = time.time() + PING_INTERVAL
+        self.poller = zmq.Poller()
+        self.terminated = False       #  Did caller ask us to quit?
+        self.verbose = False          #  Verbose logging enabled?
+        self.run()
+
+    def bind(self, endpoint):
+        if not self.server:
+            self.server = self.ctx.socket(zmq.ROUTER)
+            # Tells us about clients that went away, so we forget them
+            self.server.setsockopt(zmq.ROUTER_MANDATORY, 1)
+            self.server.setsockopt(zmq.SNDTIMEO, 0)
+            self.poller.register(self.server, zmq.POLLIN)
+        try:
+            self.server.bind(endpoint)
+        except zmq.ZMQError as e:
+            logger.error("zgossip: can't bind to {0}: {1}".format(endpoint, e))
+
+    def connect(self, endpoint):
+        remote = self.ctx.socket(zmq.DEALER)
+        remote.setsockopt(zmq.SNDTIMEO, 0)
+        remote.connect(endpoint)
+        self.remotes.append(remote)
+        self.poller.register(remote, zmq.POLLIN)
+        self.send_remote(remote, ZGossipMsg(ZGossipMsg.HELLO))
+
+    # Send a message to a server, dropping it if the server can't take it
+    def send_remote(self, remote, msg):
+        try:
+            msg.send(remote)
+        except zmq.Again:
+            logger.debug("zgossip: server not reachable, dropped message")
+
+    # Send a message to a client, forgetting the client if it went away
+    def send_client(self, address, msg):
+        msg.set_address(address)
+        try:
+            msg.send(self.server)
+        except zmq.ZMQError:
+            logger.debug("zgossip: client went away")
+            self.clients.discard(address)
+
+    # Send a tuple to all clients and servers but the one it came from
+    def forward(self, key, value, sender=None):
+        msg = ZGossipMsg(ZGossipMsg.PUBLISH)
+        msg.set_key(key)
+        msg.set_value(value)
+        for remote in self.remotes:
+            if remote is not sender:
+                self.send_remote(remote, msg)
+        for address in list(self.clients):
+            if address != sender:
+                self.send_client(address, msg)
+
+    # Take a tuple from the network; it's passed on only if it is news
+    def accept(self, key, value, sender):
+        if self.tuples.get(key) in (value, ""):
+            return
+        self.tuples[key] = value
+        if self.verbose:
+            logger.debug("zgossip: deliver {0}={1}".format(key, value))
+        self.pipe.send_unicode("DELIVER", zmq.SNDMORE)
+        self.pipe.send_unicode(key, zmq.SNDMORE)
+        self.pipe.send_unicode(value)
+        self.forward(key, value, sender)
+
+    def handle_pipe(self):
+        #  Get just the commands off the pipe
+        request = self.pipe.recv_multipart()
+        command = request.pop(0).decode('UTF-8')
+        if not command:
+            return -1                  #  Interrupted
+
+        if self.verbose:
+            logger.debug("zgossip: API command={0}".format(command))
+
+        if command == "VERBOSE":
+            self.verbose = True
+        elif command == "BIND":
+            self.bind(request.pop(0).decode('UTF-8'))
+        elif command == "CONNECT":
+            self.connect(request.pop(0).decode('UTF-8'))
+        elif command == "PUBLISH":
+            key = request.pop(0).decode('UTF-8')
+            value = request.pop(0).decode('UTF-8')
+            if self.tuples.get(key) != value:
+                self.tuples[key] = value
+                self.forward(key, value)
+        elif command == "$TERM":
+            self.terminated = True
+        else:
+            logger.error("zgossip: - invalid command: {0}".format(command))
+
+    def handle_server(self):
+        msg = ZGossipMsg().recv(self.server)
+        if msg is None:
+            return
+        address = msg.get_address()
+        if msg.id == ZGossipMsg.HELLO:
+            # The client gets our whole table once, and news from then on
+            self.clients.add(address)
+            for key, value in list(self.tuples.items()):
+                if value:
+                    reply = ZGossipMsg(ZGossipMsg.PUBLISH)
+                    reply.set_key(key)
+                    reply.set_value(value)
+                    self.send_client(address, reply)
+        elif address not in self.clients:
+            # We may have restarted; the client says HELLO again
+            self.send_client(address, ZGossipMsg(ZGossipMsg.INVALID))
+        elif msg.id == ZGossipMsg.PUBLISH:
+            self.accept(msg.get_key(), msg.get_value(), address)
+        elif msg.id == ZGossipMsg.PING:
+            self.send_client(address, ZGossipMsg(ZGossipMsg.PONG))
+
+    def handle_remote(self, remote):
+        msg = ZGossipMsg().recv(remote)
+        if msg is None:
+            return
+        if msg.id == ZGossipMsg.PUBLISH:
+            self.accept(msg.get_key(), msg.get_value(), remote)
+        elif msg.id == ZGossipMsg.INVALID:
+            # The server forgot us, so tell it our table again
+            self.send_remote(remote, ZGossipMsg(ZGossipMsg.HELLO))
+            for key, value in list(self.tuples.items()):
+                if value:
+                    publish = ZGossipMsg(ZGossipMsg.PUBLISH)
+                    publish.set_key(key)
+                    publish.set_value(value)
+                    self.send_remote(remote, publish)
+
+    def run(self):
+        # Signal actor successfully initialized
+        self.pipe.signal()
+        self.poller.register(self.pipe, zmq.POLLIN)
+
+        while not self.terminated:
+            timeout = max(self.ping_at - time.time(), 0)
+            items = dict(self.poller.poll(timeout * 1000))
+            if self.pipe in items:
+                self.handle_pipe()
+            if self.server in items:
+                self.handle_server()
+            for remote in self.remotes:
+                if remote in items:
+                    self.handle_remote(remote)
+            if time.time() >= self.ping_at:
+                for remote in self.remotes:
+                    self.send_remote(remote, ZGossipMsg(ZGossipMsg.PING))
+                self.ping_at = time.time() + PING_INTERVAL
+
+        for remote in self.remotes:
+            remote.close(LINGER)
+        if self.server:
+            self.server.close(LINGER)
+
+
+if __name__ == '__main__':
+    ctx = zmq.Context()
+    base = ZActor(ctx, ZGossip)
+    base.send_unicode("BIND", zmq.SNDMORE)
+    base.send_unicode("inproc://zgossip-base")
+    node = ZActor(ctx, ZGossip)
+    node.send_unicode("CONNECT", zmq.SNDMORE)
+    node.send_unicode("inproc://zgossip-base")
+    base.send_multipart([b"PUBLISH", b"key", b"value"])
+    print(node.recv_multipart())
+    node.destroy()
+    base.destroy()
@@ -0,0 +1,164 @@
+""" These are the zgossip_msg messages
+    HELLO - Client says hello to server
+        version       number 1  Version = 1
+    PUBLISH - Client or server announces a new tuple
+        version       number 1  Version = 1
+        key           string    Tuple key, globally unique
+        value         longstr   Tuple value, as printable string
+        ttl           number 4  Time to live, msecs
+    PING - Client signals liveness
+        version       number 1  Version = 1
+    PONG - Server responds to ping; note that pongs are not correlated with pings,
+    and may be mixed with other commands, and the client should treat any
+    incoming traffic as valid activity.
+        version       number 1  Version = 1
+    INVALID - Server rejects command as invalid
+        version       number 1  Version = 1
+"""
+
+import struct
+import zmq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ZGossipMsg(object):
+
+    VERSION = 1
+    HELLO = 1
+    PUBLISH = 2
+    PING = 3
+    PONG = 4
+    INVALID = 5
+
+    def __init__(self, id=None, *args, **kwargs):
+        self.address = b""      # Routing id, on a ROUTER socket
+        self.id = id
+        self.key = ""
+        self.value = ""
+        self.ttl = 0
+        self.struct_data = b""
+        self._needle = 0
+
+    # Receive a zgossip_msg from the socket, returns None if it isn't valid
+    def recv(self, input_socket):
+        frames = input_socket.recv_multipart()
+        if input_socket.type == zmq.ROUTER:
+            self.address = frames.pop(0)
+        return self.decode(frames)
+
+    # Decode the zgossip_msg from its frames, without the ROUTER address
+    def decode(self, frames):
+        self.struct_data = frames[0] if frames else b""
+        self._needle = 0
+        try:
+            signature = self._get_number2()
+            if signature != (0xAAA0 | 0):
+                logger.debug("Invalid signature {0}".format(signature))
+                return None
+            self.id = self._get_number1()
+            version = self._get_number1()
+            if version != ZGossipMsg.VERSION:
+                logger.debug("Invalid version {0}".format(version))
+                return None
+            if self.id == ZGossipMsg.PUBLISH:
+                self.key = self._get_string()
+                self.value = self._get_long_string()
+                self.ttl = self._get_number4()
+            elif self.id not in (ZGossipMsg.HELLO, ZGossipMsg.PING, ZGossipMsg.PONG, ZGossipMsg.INVALID):
+                logger.debug("Message type {0} unknown".format(self.id))
+                return None
+        except struct.error:
+            logger.debug("Malformed message {0}".format(self.id))
+            return None
+        return self
+
+    def encode(self):
+        self.struct_data = b""
+        self._put_number2(0xAAA0 | 0)
+        self._put_number1(self.id)
+        self._put_number1(ZGossipMsg.VERSION)
+        if self.id == ZGossipMsg.PUBLISH:
+            self._put_string(self.key)
+            self._put_long_string(self.value)
+            self._put_number4(self.ttl)
+        return [self.struct_data]
+
+    # Send the zgossip_msg to the output
+    def send(self, output_socket):
+        frames = self.encode()
+        # If we're sending to a ROUTER, we send the address first
+        if output_socket.type == zmq.ROUTER:
+            frames.insert(0, self.address)
+        output_socket.send_multipart(frames)
+
+    def get_address(self):
+        return self.address
+
+    def set_address(self, address):
+        self.address = address
+
+    def get_key(self):
+        return self.key
+
+    def set_key(self, key):
+        self.key = key
+
+    def get_value(self):
+        return self.value
+
+    def set_value(self, value):
+        self.value = value
+
+    def get_ttl(self):
+        return self.ttl
+
+    def set_ttl(self, ttl):
+        self.ttl = ttl
+
+    def _get_number1(self):
+        num = struct.unpack_from('>B', self.struct_data, offset=self._needle)
+        self._needle += 1
+        return num[0]
+
+    def _get_number2(self):
+        num = struct.unpack_from('>H', self.struct_data, offset=self._needle)
+        self._needle += 2
+        return num[0]
+
+    def _get_number4(self):
+        num = struct.unpack_from('>I', self.struct_data, offset=self._needle)
+        self._needle += 4
+        return num[0]
+
+    def _get_string(self):
+        s_len = self._get_number1()
+        s = struct.unpack_from(str(s_len) + 's', self.struct_data, offset=self._needle)
+        self._needle += s_len
+        return s[0].decode('UTF-8')
+
+    def _get_long_string(self):
+        s_len = self._get_number4()
+        s = struct.unpack_from(str(s_len) + 's', self.struct_data, offset=self._needle)
+        self._needle += s_len
+        return s[0].decode('UTF-8')
+
+    def _put_number1(self, nr):
+        self.struct_data += struct.pack('>B', nr)
+
+    def _put_number2(self, nr):
+        self.struct_data += struct.pack('>H', nr)
+
+    def _put_number4(self, nr):
+        self.struct_data += struct.pack('>I', nr)
+
+    def _put_string(self, s):
+        s = s.encode('UTF-8')
+        self._put_number1(len(s))
+        self.struct_data += s
+
+    def _put_long_string(self, s):
+        s = s.encode('UTF-8')
+        self._put_number4(len(s))
+        self.struct_data += s
@@ -1,9 +1,12 @@
 import binascii
+import errno
 import itertools
 import os
 import random
+import socket
 import sys
 import threading
+import uuid
 import zmq
 from . import zsocket
 
@@ -40,6 +43,51 @@ def zcreate_pipe(ctx, hwm=1000):
     return (frontend, backend)
 
 
+# --------------------------------------------------------------------------
+# Create the frontend of a pipe to another process: a PAIR socket bound over
+# ipc, or over tcp on the loopback interface where there's no ipc. With
+# local, the backend is on the same context, so the pipe goes over inproc.
+# Returns the frontend and the endpoint for the backend to connect to.
+def zbind_pipe(ctx, hwm=1000, local=False):
+    frontend = zsocket.ZSocket(ctx, zmq.PAIR)
+    frontend.set_hwm(hwm)
+    frontend.setsockopt(zmq.LINGER, 0)
+    if local:
+        endpoint = "inproc://zactor-{0}".format(uuid.uuid4().hex)
+        frontend.bind(endpoint)
+    elif zmq.has("ipc"):
+        import tempfile
+        endpoint = "ipc://" + os.path.join(tempfile.gettempdir(),
+                                           "zactor-{0}.ipc".format(uuid.uuid4().hex))
+        frontend.bind(endpoint)
+    else:
+        port = frontend.bind_to_random_port("tcp://127.0.0.1")
+        endpoint = "tcp://127.0.0.1:%d" % port
+    return (frontend, endpoint)
+
+
+# --------------------------------------------------------------------------
+# Create the backend of a pipe from another process, connected to the
+# frontend's endpoint. Returns the backend socket.
+def zconnect_pipe(ctx, endpoint, hwm=1000):
+    backend = zsocket.ZSocket(ctx, zmq.PAIR)
+    backend.set_hwm(hwm)
+    backend.setsockopt(zmq.LINGER, 0)
+    backend.connect(endpoint)
+    return backend
+
+
+# --------------------------------------------------------------------------
+# Remove the socket file of a pipe to another process, if it has one. The
+# pipe keeps working if connected.
+def zremove_pipe(endpoint):
+    if endpoint.startswith("ipc://"):
+        try:
+            os.unlink(endpoint[6:])
+        except OSError:
+            pass
+
+
 def zthread_fork(ctx, func, *args, **kwargs):
     """
     Create an attached thread. An attached thread gets a ctx and a PAIR
@@ -69,12 +117,6 @@ def zthread_fork(ctx, func, *args, **kwargs):
     return a
 
 
-from ctypes import c_char, c_char_p
-from ctypes import c_uint, c_uint8, c_uint16, c_uint32
-from ctypes import c_short, c_ushort
-from ctypes import c_void_p, pointer
-from ctypes import CDLL, Structure, Union
-
 from sys import platform
 if platform.startswith("win") and sys.version.startswith("2"):
     import win_inet_pton
@@ -112,6 +154,13 @@ def get_ifaddrs():
     if platform.startswith("win"):
         return get_win_ifaddrs()
 
+    # Only needed here, so not imported with the module
+    from ctypes import c_char, c_char_p
+    from ctypes import c_uint, c_uint8, c_uint16, c_uint32
+    from ctypes import c_short, c_ushort
+    from ctypes import c_void_p, pointer
+    from ctypes import CDLL, Structure, Union
+
     # getifaddr structs
     class ifa_ifu_u(Union):
         _fields_ = [
@@ -341,6 +390,7 @@ def get_win_ifaddrs():
     import struct
     import ipaddress
     import ctypes.wintypes
+    from ctypes import Structure
     from ctypes.wintypes import DWORD, WCHAR, BYTE, BOOL
     from socket import AF_INET
     
@@ -561,3 +611,65 @@ def get_win_ifaddrs():
 
     return result
 
+
+# Netlink route groups for changes to links and their addresses
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+
+def ifaddrs_watch():
+    """
+    Return a socket that becomes readable when the kernel reports a change
+    to the network interfaces or their addresses, or None if we can't watch
+    for changes; we can on Linux, with a netlink route socket.
+    """
+    if not hasattr(socket, "AF_NETLINK"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        sock.setblocking(False)
+    except (OSError, socket.error):
+        return None
+    return sock
+
+
+def ifaddrs_changed(sock):
+    """
+    Read the reports waiting on an ifaddrs_watch() socket, and return
+    whether there were any.
+    """
+    changed = False
+    while True:
+        try:
+            sock.recv(65536)
+        except (OSError, socket.error) as e:
+            if e.errno != errno.ENOBUFS:
+                return changed
+            # We missed reports, so something changed
+        changed = True
+
+
+_ifaddrs = None             # Result of the last get_ifaddrs()
+_ifaddrs_watch = None       # Tells us when it's out of date
+_ifaddrs_lock = threading.Lock()
+
+
+def get_ifaddrs_cached():
+    """
+    Return the same as get_ifaddrs(), scanning the interfaces again only
+    when the kernel reported a change since the last scan. Where we can't
+    watch for changes, every call scans. Don't modify the result.
+    """
+    global _ifaddrs, _ifaddrs_watch
+    with _ifaddrs_lock:
+        if _ifaddrs_watch is None:
+            _ifaddrs_watch = ifaddrs_watch()
+            if _ifaddrs_watch is None:
+                return get_ifaddrs()
+            _ifaddrs = None
+        if ifaddrs_changed(_ifaddrs_watch) or _ifaddrs is None:
+            _ifaddrs = get_ifaddrs()
+        return _ifaddrs
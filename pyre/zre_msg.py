@@ -25,6 +25,25 @@
         sequence      number 2
     PING_OK - Reply to a peer's ping
         sequence      number 2
+    NACK - Ask a peer to resend messages after a sequence gap
+        sequence      number 2  First sequence number that went missing
+        count         number 2  Number of messages missing, 0 if they can't be resent
+
+    Any message may end with extensions, which peers that don't know them
+    ignore. Each is a number 1 type and a number 1 length, then the data:
+    TIMESTAMP - Monotonic send time, in microseconds (type 1)
+        timestamp     number 8
+    ECHO - Answer to a timestamped PING, sent with PING_OK (type 2)
+        timestamp     number 8  Timestamp of the PING
+        peer time     number 8  Send time of the PING_OK
+    ORIGIN - Node that sent a relayed SHOUT or WHISPER (type 3)
+        identity      16 bytes  Node UUID
+        name          string    Node name
+    TARGET - Node a relayed WHISPER is for (type 4)
+        identity      16 bytes  Node UUID
+    TREE - SHOUT passed down a spanning tree of the group (type 5)
+        fanout        number 1  Children per member
+        sequence      number 4  Tree SHOUT counter of the sender
 """
 
 import struct
@@ -47,6 +66,13 @@ class ZreMsg(object):
     LEAVE = 5
     PING = 6
     PING_OK = 7
+    NACK = 8
+
+    EXT_TIMESTAMP = 1
+    EXT_ECHO = 2
+    EXT_ORIGIN = 3
+    EXT_TARGET = 4
+    EXT_TREE = 5
 
     def __init__(self, id=None, *args, **kwargs):
         self.address = ""
@@ -56,9 +82,15 @@ class ZreMsg(object):
         self.groups = ()
         self.group = None
         self.status = 0
+        self.count = 0
         self.name = ""
         self.headers = {}
         self.content = b""
+        self.timestamp = None   # Send time in seconds, if stamped
+        self.echo = None        # (PING timestamp, peer time) in seconds
+        self.origin = None      # (UUID, name) of the node a relayed message is from
+        self.target = None      # UUID of the node a relayed WHISPER is for
+        self.tree = None        # (fanout, sequence) of a tree SHOUT
         self.struct_data = kwargs.get("data", b'')
         self._needle = 0
         self._ceil = len(self.struct_data)
@@ -76,7 +108,10 @@ class ZreMsg(object):
             except ValueError:
                 logger.debug("Peer identity frame empty or malformed")
                 return None
+        return self.decode(frames)
 
+    # Decode the zre_msg from its frames, without the ROUTER address
+    def decode(self, frames):
         # Read and parse command in frame
         self.struct_data = frames.pop(0)
         if not self.struct_data:
@@ -131,11 +166,17 @@ class ZreMsg(object):
         elif self.id == ZreMsg.PING_OK:
             self.sequence = self._get_number2()
 
+        elif self.id == ZreMsg.NACK:
+            self.sequence = self._get_number2()
+            self.count = self._get_number2()
+
         else:
             logger.debug("Message type {0} unknown".format(self.id))
 
-    # Send the zre_msg to the output, and destroy it
-    def send(self, output_socket):
+        self.unpack_extensions()
+
+    # Encode the zre_msg into its frames, without the ROUTER address
+    def encode(self):
         # clear data
         self.struct_data = b''
         self._needle = 0
@@ -177,21 +218,29 @@ class ZreMsg(object):
         elif self.id == ZreMsg.PING_OK:
             self._put_number2(self.sequence)
 
+        elif self.id == ZreMsg.NACK:
+            self._put_number2(self.sequence)
+            self._put_number2(self.count)
+
         else:
             logger.debug("Message type {0} unknown".format(self.id))
 
+        self.pack_extensions()
+
+        # The data frame is followed by the content frames, if any
+        if not self.content:
+            return [self.struct_data]
+        if isinstance(self.content, list):
+            return [self.struct_data] + self.content
+        return [self.struct_data, self.content]
+
+    # Send the zre_msg to the output, and destroy it
+    def send(self, output_socket):
+        frames = self.encode()
         # If we're sending to a ROUTER, we send the address first
         if output_socket.type == zmq.ROUTER:
-            output_socket.send(self.address.bytes, zmq.SNDMORE)
-        # Now send the data frame
-        if (self.content):
-            output_socket.send(self.struct_data, zmq.SNDMORE)
-            if isinstance(self.content, list):
-                output_socket.send_multipart(self.content)
-            else:
-                output_socket.send(self.content)
-        else:
-            output_socket.send(self.struct_data)
+            frames.insert(0, self.address.bytes)
+        output_socket.send_multipart(frames)
 
     # Send the HELLO to the output in one step
     def send_hello(self, output, sequence, ipaddress, mailbox, groups, status, headers):
@@ -238,6 +287,12 @@ class ZreMsg(object):
         print("E: NOT IMPLEMENTED")
         pass
 
+    # Return the size of the content frames in bytes
+    def get_content_size(self):
+        if isinstance(self.content, list):
+            return sum(len(frame) for frame in self.content)
+        return len(self.content)
+
     # Get/set the message address
     def get_address(self):
         return self.address
@@ -267,6 +322,8 @@ class ZreMsg(object):
             return "PING"
         if self.id == ZreMsg.PING_OK:
             return "PING_OK"
+        if self.id == ZreMsg.NACK:
+            return "NACK"
 
     def get_name(self):
         return self.name
@@ -281,6 +338,13 @@ class ZreMsg(object):
     def set_sequence(self, sequence):
         self.sequence = sequence
 
+    # Get/set the count field
+    def get_count(self):
+        return self.count
+
+    def set_count(self, count):
+        self.count = count
+
     # Get/set the endpoint field
     def get_endpoint(self):
         return self.endpoint
@@ -329,6 +393,41 @@ class ZreMsg(object):
     # Get/set a value in the headers dictionary
     # TODO: l208 zre_msg.h
 
+    # Get/set the timestamp extension
+    def get_timestamp(self):
+        return self.timestamp
+
+    def set_timestamp(self, timestamp):
+        self.timestamp = timestamp
+
+    # Get/set the echo extension
+    def get_echo(self):
+        return self.echo
+
+    def set_echo(self, timestamp, peer_time):
+        self.echo = (timestamp, peer_time)
+
+    # Get/set the origin extension
+    def get_origin(self):
+        return self.origin
+
+    def set_origin(self, identity, name):
+        self.origin = (identity, name)
+
+    # Get/set the target extension
+    def get_target(self):
+        return self.target
+
+    def set_target(self, identity):
+        self.target = identity
+
+    # Get/set the tree extension
+    def get_tree(self):
+        return self.tree
+
+    def set_tree(self, fanout, sequence):
+        self.tree = (fanout, sequence)
+
     # Get/set the group field
     def get_group(self):
         return self.group
@@ -362,6 +461,11 @@ class ZreMsg(object):
         self._needle += struct.calcsize('>Q')
         return num[0]
 
+    def _get_uuid(self):
+        u = uuid.UUID(bytes=self.struct_data[self._needle:self._needle + 16])
+        self._needle += 16
+        return u
+
     def _get_long_string(self):
         s_len = self._get_number4()
         s = struct.unpack_from(str(s_len) + 's', self.struct_data, offset=self._needle)
@@ -389,6 +493,9 @@ class ZreMsg(object):
         d = struct.pack('>Q', nr)
         self.struct_data += d
 
+    def _put_uuid(self, u):
+        self.struct_data += u.bytes
+
     def _put_long_string(self, s):
         self._put_number4(len(s))
         d = struct.pack('%is' % len(s), s.encode('UTF-8'))
@@ -460,6 +567,60 @@ class ZreMsg(object):
             self._put_string(key)
             self._put_long_string(val)
 
+    def unpack_extensions(self):
+        """Unpack the extensions following the message fields, unknown ones
+        are skipped"""
+        self.timestamp = None
+        self.echo = None
+        self.origin = None
+        self.target = None
+        self.tree = None
+        while self._needle + 2 <= self._ceil:
+            ext_type = self._get_number1()
+            ext_len = self._get_number1()
+            start = self._needle
+            if ext_type == ZreMsg.EXT_TIMESTAMP and ext_len == 8:
+                self.timestamp = self._get_number8() / 1e6
+            elif ext_type == ZreMsg.EXT_ECHO and ext_len == 16:
+                self.echo = (self._get_number8() / 1e6, self._get_number8() / 1e6)
+            elif ext_type == ZreMsg.EXT_ORIGIN and ext_len > 16:
+                self.origin = (self._get_uuid(), self._get_string())
+            elif ext_type == ZreMsg.EXT_TARGET and ext_len == 16:
+                self.target = self._get_uuid()
+            elif ext_type == ZreMsg.EXT_TREE and ext_len == 5:
+                self.tree = (self._get_number1(), self._get_number4())
+            self._needle = start + ext_len
+
+    def pack_extensions(self):
+        """Pack the extensions that are set"""
+        if self.timestamp is not None:
+            self._put_number1(ZreMsg.EXT_TIMESTAMP)
+            self._put_number1(8)
+            self._put_number8(int(self.timestamp * 1e6))
+        if self.echo is not None:
+            self._put_number1(ZreMsg.EXT_ECHO)
+            self._put_number1(16)
+            self._put_number8(int(self.echo[0] * 1e6))
+            self._put_number8(int(self.echo[1] * 1e6))
+        if self.origin is not None:
+            # The name is cut short to fit the extension length
+            name = self.origin[1].encode('UTF-8')[:STRING_MAX - 17]
+            name = name.decode('UTF-8', 'ignore').encode('UTF-8')
+            self._put_number1(ZreMsg.EXT_ORIGIN)
+            self._put_number1(17 + len(name))
+            self._put_uuid(self.origin[0])
+            self._put_number1(len(name))
+            self.struct_data += name
+        if self.target is not None:
+            self._put_number1(ZreMsg.EXT_TARGET)
+            self._put_number1(16)
+            self._put_uuid(self.target)
+        if self.tree is not None:
+            self._put_number1(ZreMsg.EXT_TREE)
+            self._put_number1(5)
+            self._put_number1(self.tree[0])
+            self._put_number4(self.tree[1])
+
 if __name__ == '__main__':
     logger.addHandler(logging.StreamHandler())
     logger.setLevel(logging.DEBUG)
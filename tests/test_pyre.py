@@ -62,6 +62,81 @@ class PyreTest(unittest.TestCase):
         self.assertIsInstance(self.node2.peer_address(id1), unicode)
     # end test_get_peer_address
 
+    def test_peer_address_inproc(self):
+        # Nodes on the same context talk over inproc
+        id1 = self.node1.uuid()
+        id2 = self.node2.uuid()
+
+        self.assertTrue(self.node1.peer_address(id2).startswith("inproc://"))
+        self.assertTrue(self.node2.peer_address(id1).startswith("inproc://"))
+    # end test_peer_address_inproc
+
+    @unittest.skipUnless(zmq.has("ipc"), "needs ipc transport")
+    def test_peer_address_ipc(self):
+        # Nodes on the same host talk over ipc
+        node3 = pyre.Pyre("node3", ctx=zmq.Context())
+        node3.start()
+        try:
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            id1 = self.node1.uuid()
+            id3 = node3.uuid()
+            self.assertTrue(node3.peer_address(id1).startswith("ipc://"))
+            self.assertTrue(self.node1.peer_address(id3).startswith("ipc://"))
+            self.assertTrue(node3.peer_header_value(id1, "X-PYRE-IPC").startswith("ipc://"))
+        finally:
+            node3.stop()
+    # end test_peer_address_ipc
+
+    def test_set_endpoint(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        self.assertEqual(0, node3.set_endpoint("inproc://pyre-test-%d", 1))
+        self.assertEqual("inproc://pyre-test-1", node3.endpoint())
+        self.assertEqual(-1, node3.bind("inproc://pyre-test-1"))
+        self.assertEqual(0, node3.bind("inproc://pyre-test-2"))
+        self.assertEqual(-1, node3.set_endpoint("nosuch://endpoint"))
+        self.assertEqual("inproc://pyre-test-1", node3.endpoint())
+        node3.start()
+        node3.stop()
+    # end test_set_endpoint
+
+    def test_gossip(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        node3.set_endpoint("inproc://pyre-gossip-3")
+        node3.gossip_bind("inproc://gossip-hub")
+        node4 = pyre.Pyre("node4", ctx=ctx)
+        node4.set_endpoint("inproc://pyre-gossip-4")
+        node4.gossip_connect("inproc://gossip-hub")
+        node3.start()
+        node4.start()
+        try:
+            msg = node4.recv()
+            while msg[0] != b'ENTER':
+                msg = node4.recv()
+            self.assertEqual(node3.uuid().bytes, msg[1])
+            self.assertEqual(b"inproc://pyre-gossip-3", msg[4])
+            node4.whispers(node3.uuid(), "Hi")
+            msg = node3.recv()
+            while msg[0] != b'WHISPER':
+                msg = node3.recv()
+            self.assertEqual(b"Hi", msg[3])
+            # Beaconing nodes don't see gossiping ones
+            self.assertNotIn(node3.uuid(), self.node1.peers())
+
+            # node4 retracts its endpoint as it stops
+            id4 = node4.uuid()
+            node4.stop()
+            msg = node3.recv()
+            while msg[0] != b'EXIT':
+                msg = node3.recv()
+            self.assertEqual(id4.bytes, msg[1])
+        finally:
+            node3.stop()
+    # end test_gossip
+
     def test_peer_header_value(self):
         id1 = self.node1.uuid()
         id2 = self.node2.uuid()
@@ -159,6 +234,178 @@ class PyreTest(unittest.TestCase):
         self.assertEqual(b"TEST", msg[3])
         self.assertEqual(b"Hi", msg[4])
 
+    def test_stats(self):
+        msg = self.node1.recv()
+        self.assertEqual(msg[0], b'ENTER')
+        msg = self.node2.recv()
+        self.assertEqual(msg[0], b'ENTER')
+        self.node1.join("TEST")
+        self.node2.join("TEST")
+        msg = self.node1.recv()
+        self.assertEqual(msg[0], b'JOIN')
+        msg = self.node2.recv()
+        self.assertEqual(msg[0], b'JOIN')
+        self.node1.shouts("TEST", "Hi")
+        msg = self.node2.recv()
+        self.assertEqual(msg[0], b'SHOUT')
+        self.node1.whispers(self.node2.uuid(), "Hi")
+        msg = self.node2.recv()
+        self.assertEqual(msg[0], b'WHISPER')
+
+        stats1 = self.node1.stats()
+        stats2 = self.node2.stats()
+        sent = stats1["peers"][self.node2.uuid()]
+        recv = stats2["peers"][self.node1.uuid()]
+        # HELLO, JOIN, SHOUT and WHISPER
+        self.assertGreaterEqual(sent["msgs_sent"], 4)
+        self.assertEqual(sent["msgs_sent"], recv["msgs_recv"])
+        self.assertEqual(sent["bytes_sent"], recv["bytes_recv"])
+        self.assertEqual(0, recv["seq_errors"])
+        self.assertEqual(sent["msgs_sent"], sent["window"])
+        self.assertEqual(1, stats1["groups"]["TEST"]["msgs_sent"])
+        self.assertEqual(1, stats2["groups"]["TEST"]["msgs_recv"])
+        self.assertEqual(0, stats2["outbox_depth"])
+    # end test_stats
+
+    def test_latency(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        node3.set_latency()
+        node3.start()
+        try:
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            node3.join("TEST")
+            # wait for the clock offset from the first PING round trip
+            time.sleep(0.5)
+            self.node1.whispers(node3.uuid(), "Hi")
+            self.node1.shouts("TEST", "Hi")
+            msg = node3.recv()
+            while msg[0] != b'SHOUT':
+                msg = node3.recv()
+
+            latency = node3.latency()
+            peer = latency["peers"][self.node1.uuid()]
+            self.assertIsNotNone(peer["rtt"])
+            self.assertEqual(2, peer["latency"]["count"])
+            self.assertEqual(1, latency["groups"]["TEST"]["count"])
+        finally:
+            node3.stop()
+    # end test_latency
+
+    def test_shared_mailbox(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        node3.set_shared_mailbox()
+        node3.start()
+        try:
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            node3.whispers(self.node1.uuid(), "Hi")
+            msg = self.node1.recv()
+            while msg[0] != b'WHISPER':
+                msg = self.node1.recv()
+            self.assertEqual(node3.uuid().bytes, msg[1])
+            self.assertEqual(b"Hi", msg[3])
+
+            self.node1.whispers(node3.uuid(), "Hi back")
+            msg = node3.recv()
+            while msg[0] != b'WHISPER':
+                msg = node3.recv()
+            self.assertEqual(b"Hi back", msg[3])
+        finally:
+            node3.stop()
+    # end test_shared_mailbox
+
+    def test_start_async(self):
+        node3 = pyre.Pyre("node3", ctx=zmq.Context())
+        started = node3.start_async()
+        try:
+            # Commands wait until the node has started
+            self.assertTrue(node3.endpoint().startswith("tcp://"))
+            self.assertEqual(0, started.result(5))
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+        finally:
+            node3.stop()
+    # end test_start_async
+
+    def test_inline_beacon(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        node3.set_inline_beacon()
+        node3.start()
+        try:
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            self.assertIn(node3.uuid(), self.node1.peers())
+        finally:
+            id3 = node3.uuid()
+            node3.stop()
+        # Our last beacon still goes out, so node1 sees node3 leave
+        msg = self.node1.recv()
+        while msg[0] != b'EXIT' or msg[1] != id3.bytes:
+            msg = self.node1.recv()
+    # end test_inline_beacon
+
+    def test_process(self):
+        node3 = pyre.Pyre("node3", process=True)
+        node3.start()
+        try:
+            msg = node3.recv()
+            while msg[0] != b'ENTER' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            self.assertEqual("node3", node3.name())
+            node3.whispers(self.node1.uuid(), "Hi")
+            msg = self.node1.recv()
+            while msg[0] != b'WHISPER':
+                msg = self.node1.recv()
+            self.assertEqual(node3.uuid().bytes, msg[1])
+            self.assertEqual(b"Hi", msg[3])
+        finally:
+            node3.stop()
+        # Our last events get out of the process
+        msg = node3.recv()
+        while msg[0] != b'STOP':
+            msg = node3.recv()
+        self.assertFalse(node3.actor.process.is_alive())
+    # end test_process
+
+    def test_shout_publisher(self):
+        ctx = zmq.Context()
+        node3 = pyre.Pyre("node3", ctx=ctx)
+        node3.set_shout_publisher()
+        node3.join("TEST")
+        node3.start()
+        self.node1.join("TEST")
+        try:
+            msg = node3.recv()
+            while msg[0] != b'JOIN' or msg[1] != self.node1.uuid().bytes:
+                msg = node3.recv()
+            # give the subscription time to reach node3
+            time.sleep(0.5)
+            for i in range(10):
+                node3.shouts("TEST", str(i))
+            shouts = []
+            while len(shouts) < 10:
+                msg = self.node1.recv()
+                if msg[0] == b'SHOUT':
+                    self.assertEqual(node3.uuid().bytes, msg[1])
+                    shouts.append(msg[4].decode())
+            self.assertEqual([str(i) for i in range(10)], shouts)
+            stats = self.node1.stats()["peers"][node3.uuid()]
+            self.assertEqual(0, stats["seq_errors"])
+            # The SHOUTs didn't go through node1's mailbox
+            stats = node3.stats()["peers"][self.node1.uuid()]
+            self.assertLess(stats["msgs_sent"], 10)
+        finally:
+            node3.stop()
+    # end test_shout_publisher
+
     def test_zfinal(self):
         global inst_count
         inst_count = 1
@@ -0,0 +1,41 @@
+import unittest
+from pyre.pyre_histogram import PyreHistogram
+
+
+class PyreHistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        hist = PyreHistogram()
+        self.assertIsNone(hist.percentile(0.5))
+        self.assertEqual({"count": 0}, hist.get_stats())
+    # end test_empty
+
+    def test_percentiles(self):
+        hist = PyreHistogram()
+        for i in range(1, 1001):
+            hist.record(i / 1e6)
+        stats = hist.get_stats()
+        self.assertEqual(1000, stats["count"])
+        self.assertEqual(1e-6, stats["min"])
+        self.assertEqual(1e-3, stats["max"])
+        # Buckets are a quarter power of two wide
+        self.assertLessEqual(abs(stats["p50"] - 500e-6), 500e-6 * 0.19)
+        self.assertLessEqual(abs(stats["p99"] - 990e-6), 990e-6 * 0.19)
+        self.assertLessEqual(stats["p999"], stats["max"])
+    # end test_percentiles
+
+    def test_fixed_memory(self):
+        hist = PyreHistogram()
+        size = len(hist.buckets)
+        hist.record(-1)
+        hist.record(1e9)
+        self.assertEqual(size, len(hist.buckets))
+        self.assertEqual(2, hist.count)
+        self.assertEqual(0.0, hist.min)
+    # end test_fixed_memory
+
+# end PyreHistogramTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import unittest
+import uuid
+import zmq
+from pyre.pyre_peer import PyrePeer
+from pyre.zre_msg import ZreMsg
+
+
+class PyrePeerTest(unittest.TestCase):
+
+    def setUp(self, *args, **kwargs):
+        self.ctx = zmq.Context()
+        self.inbox = self.ctx.socket(zmq.ROUTER)
+        self.inbox.setsockopt(zmq.LINGER, 0)
+        self.inbox.setsockopt(zmq.RCVTIMEO, 1000)
+        self.inbox.bind("inproc://peer-test")
+        self.peer = PyrePeer(self.ctx, uuid.uuid4())
+        self.peer.connect(uuid.uuid4(), "inproc://peer-test")
+        self.peer.set_headers({PyrePeer.NACK_HEADER: "1"})
+    # end setUp
+
+    def tearDown(self):
+        self.peer.disconnect()
+        self.inbox.close()
+        self.ctx.term()
+    # end tearDown
+
+    def _recv(self):
+        msg = ZreMsg()
+        msg.recv(self.inbox)
+        return msg
+
+    def _msg(self, id, sequence):
+        msg = ZreMsg(id)
+        msg.set_sequence(sequence)
+        return msg
+
+    def test_hello_resets_sequence(self):
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 2)))
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 2)))
+    # end test_hello_resets_sequence
+
+    def test_resend(self):
+        for i in range(3):
+            self.peer.send(ZreMsg(ZreMsg.PING))
+        for i in range(3):
+            self.assertEqual(i + 1, self._recv().get_sequence())
+
+        # Only the missing range is resent
+        self.assertTrue(self.peer.resend(2, 1))
+        self.assertEqual(2, self._recv().get_sequence())
+        self.assertTrue(self.peer.resend(1, 3))
+        for i in range(3):
+            self.assertEqual(i + 1, self._recv().get_sequence())
+    # end test_resend
+
+    def test_resend_outside_window(self):
+        for i in range(PyrePeer.RETRANSMIT_WINDOW + 1):
+            self.peer.send(ZreMsg(ZreMsg.PING))
+        for i in range(PyrePeer.RETRANSMIT_WINDOW + 1):
+            self._recv()
+        self.assertTrue(self.peer.resend(2, 1))
+        self.assertEqual(2, self._recv().get_sequence())
+
+        # The peer is told we can't resend
+        self.assertFalse(self.peer.resend(1, 1))
+        nack = self._recv()
+        self.assertEqual(ZreMsg.NACK, nack.id)
+        self.assertEqual(1, nack.get_sequence())
+        self.assertEqual(0, nack.get_count())
+    # end test_resend_outside_window
+
+    def test_hold_until_gap_healed(self):
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        for sequence in (3, 4):
+            msg = self._msg(ZreMsg.PING, sequence)
+            self.assertTrue(self.peer.messages_lost(msg))
+            self.assertTrue(self.peer.hold(msg))
+
+        # We asked the peer to resend from the first missing message
+        nack = self._recv()
+        self.assertEqual(ZreMsg.NACK, nack.id)
+        self.assertEqual(2, nack.get_sequence())
+        self.assertEqual(1, nack.get_count())
+
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 2)))
+        released = [msg.get_sequence() for msg in self.peer.release_held()]
+        self.assertEqual([3, 4], released)
+        self.assertFalse(self.peer.held)
+
+        # A resent duplicate is dropped silently
+        msg = self._msg(ZreMsg.PING, 3)
+        self.assertTrue(self.peer.messages_lost(msg))
+        self.assertTrue(self.peer.hold(msg))
+        self.assertFalse(self.peer.held)
+    # end test_hold_until_gap_healed
+
+    def test_next_gap_asked_for_at_once(self):
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        for sequence in (3, 6):
+            msg = self._msg(ZreMsg.PING, sequence)
+            self.assertTrue(self.peer.messages_lost(msg))
+            self.assertTrue(self.peer.hold(msg))
+        nack = self._recv()
+        self.assertEqual((2, 1), (nack.get_sequence(), nack.get_count()))
+
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 2)))
+        released = [msg.get_sequence() for msg in self.peer.release_held()]
+        self.assertEqual([3], released)
+        nack = self._recv()
+        self.assertEqual((4, 2), (nack.get_sequence(), nack.get_count()))
+
+        # No new request while the resend is on its way
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 4)))
+        self.assertEqual([], list(self.peer.release_held()))
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.PING, 5)))
+        self.assertEqual([6], [msg.get_sequence() for msg in self.peer.release_held()])
+    # end test_next_gap_asked_for_at_once
+
+    def test_gap_gives_up_without_progress(self):
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        msg = self._msg(ZreMsg.PING, 3)
+        self.assertTrue(self.peer.messages_lost(msg))
+        self.assertTrue(self.peer.hold(msg))
+        for i in range(PyrePeer.NACK_RETRIES - 1):
+            self.assertTrue(self.peer.request_resend())
+        self.assertFalse(self.peer.request_resend())
+    # end test_gap_gives_up_without_progress
+
+    def test_no_resend_support(self):
+        self.peer.set_headers({})
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        msg = self._msg(ZreMsg.PING, 3)
+        self.assertTrue(self.peer.messages_lost(msg))
+        self.assertFalse(self.peer.hold(msg))
+    # end test_no_resend_support
+
+    def test_ping_echo(self):
+        self.peer.set_headers({PyrePeer.TIMESTAMP_HEADER: "1"})
+        self.peer.send_ping()
+        ping = self._recv()
+        self.assertIsNotNone(ping.get_timestamp())
+
+        # The reply echoes the timestamp, which gives us the round trip
+        self.peer.recv_ping(ping)
+        pong = self._recv()
+        self.assertEqual(ZreMsg.PING_OK, pong.id)
+        self.assertAlmostEqual(ping.get_timestamp(), pong.get_echo()[0], places=5)
+        self.peer.recv_ping_ok(pong)
+        self.assertGreaterEqual(self.peer.rtt, 0)
+        self.assertLess(abs(self.peer.clock_offset), 0.1)
+    # end test_ping_echo
+
+    def test_timestamps_on_request(self):
+        self.peer.send(ZreMsg(ZreMsg.WHISPER))
+        self.assertIsNone(self._recv().get_timestamp())
+
+        self.peer.set_headers({PyrePeer.LATENCY_HEADER: "1"})
+        self.peer.send(ZreMsg(ZreMsg.WHISPER))
+        msg = self._recv()
+        self.assertIsNotNone(msg.get_timestamp())
+        # No latency until we know the peer's clock offset
+        self.assertIsNone(self.peer.record_latency(msg))
+        self.peer.clock_offset = 0.0
+        self.assertGreaterEqual(self.peer.record_latency(msg), 0)
+        self.assertEqual(1, self.peer.get_latency()["latency"]["count"])
+    # end test_timestamps_on_request
+
+    def test_shared_router(self):
+        reply_to = uuid.uuid4()
+        router = PyrePeer.create_router(self.ctx, reply_to)
+        inbox = self.ctx.socket(zmq.ROUTER)
+        inbox.setsockopt(zmq.LINGER, 0)
+        inbox.setsockopt(zmq.RCVTIMEO, 1000)
+        inbox.bind("inproc://peer-test-2")
+        peers = [PyrePeer(self.ctx, uuid.uuid4()) for i in range(2)]
+        peers[0].connect(reply_to, "inproc://peer-test", router)
+        peers[1].connect(reply_to, "inproc://peer-test-2", router)
+        try:
+            for peer in peers:
+                self.assertEqual(0, peer.send(ZreMsg(ZreMsg.PING)))
+
+            # Each inbox sees our identity, as from a DEALER
+            for sock in (self.inbox, inbox):
+                msg = ZreMsg()
+                msg.recv(sock)
+                self.assertEqual(reply_to, msg.get_address())
+                self.assertEqual(1, msg.get_sequence())
+
+            peers[0].disconnect()
+            self.assertIsNone(peers[0].router)
+            self.assertEqual(-1, peers[0].send(ZreMsg(ZreMsg.PING)))
+            self.assertEqual(0, peers[1].send(ZreMsg(ZreMsg.PING)))
+            msg = ZreMsg()
+            msg.recv(inbox)
+            self.assertEqual(2, msg.get_sequence())
+        finally:
+            for peer in peers:
+                peer.disconnect()
+            router.close()
+            inbox.close()
+    # end test_shared_router
+
+    def test_gap_too_big(self):
+        self.assertFalse(self.peer.messages_lost(self._msg(ZreMsg.HELLO, 1)))
+        msg = self._msg(ZreMsg.PING, PyrePeer.RETRANSMIT_WINDOW + 2)
+        self.assertTrue(self.peer.messages_lost(msg))
+        self.assertFalse(self.peer.hold(msg))
+    # end test_gap_too_big
+# end PyrePeerTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import unittest
+import zmq
+import pyre
+from pyre import PyreReactor
+
+
+class PyreReactorTest(unittest.TestCase):
+    def setUp(self, *args, **kwargs):
+        self.threads = set(threading.enumerate())
+        self.reactor = PyreReactor(zmq.Context())
+        self.nodes = [pyre.Pyre("node{0}".format(i), reactor=self.reactor) for i in range(3)]
+        for node in self.nodes:
+            node.set_port(b"5671")
+            node.start()
+    # end setUp
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        self.reactor.destroy()
+    # end tearDown
+
+    # Wait until the node has seen all the others
+    def wait_enter(self, node, others):
+        waiting = set(other.uuid().bytes for other in others)
+        while waiting:
+            msg = node.recv()
+            if msg[0] == b'ENTER':
+                waiting.discard(msg[1])
+    # end wait_enter
+
+    def test_one_thread(self):
+        # Threads of earlier tests may still be going away, so only count
+        # new ones
+        self.assertEqual(1, len(set(threading.enumerate()) - self.threads))
+    # end test_one_thread
+
+    def test_discovery(self):
+        for node in self.nodes:
+            self.wait_enter(node, [other for other in self.nodes if other is not node])
+            self.assertEqual(2, len(node.peers()))
+    # end test_discovery
+
+    def test_whisper(self):
+        node1, node2 = self.nodes[:2]
+        self.wait_enter(node1, [node2])
+        node1.whispers(node2.uuid(), "Hi")
+        msg = node2.recv()
+        while msg[0] != b'WHISPER':
+            msg = node2.recv()
+        self.assertEqual(node1.uuid().bytes, msg[1])
+        self.assertEqual(b"Hi", msg[3])
+    # end test_whisper
+
+    def test_thread_node(self):
+        # A node in its own thread sees the reactor's nodes, and they it
+        node4 = pyre.Pyre("node4")
+        node4.set_port(b"5671")
+        node4.start()
+        try:
+            self.wait_enter(node4, self.nodes)
+            self.wait_enter(self.nodes[0], [node4])
+        finally:
+            node4.stop()
+    # end test_thread_node
+# end PyreReactorTest
+
+
+if __name__ == '__main__':
+    unittest.main()
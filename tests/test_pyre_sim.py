@@ -0,0 +1,239 @@
+import unittest
+from pyre.pyre_peer import PyrePeer
+from pyre.pyre_sim import SimNetwork
+
+
+class PyreSimTest(unittest.TestCase):
+
+    def setUp(self, *args, **kwargs):
+        self.net = SimNetwork(seed=1)
+        self.nodes = [self.net.add_node("node{0}".format(i)) for i in range(10)]
+        for node in self.nodes:
+            node.join("TEST")
+            node.start()
+    # end setUp
+
+    def _shouts(self, node):
+        shouts = []
+        msg = node.recv()
+        while msg is not None:
+            if msg[0] == b"SHOUT":
+                shouts.append(msg[-1])
+            msg = node.recv()
+        return shouts
+
+    def test_discovery(self):
+        self.assertIsNotNone(self.net.run_until(lambda: self.net.converged("TEST"), timeout=2))
+        peers = self.nodes[0].peers()
+        self.assertEqual(9, len(peers))
+        self.assertIn(self.nodes[1].uuid(), peers)
+        self.assertEqual(9, len(self.nodes[0].peers_by_group("TEST")))
+    # end test_discovery
+
+    def test_shout(self):
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        self.nodes[0].shout("TEST", b"Hi")
+        self.net.run(0.1)
+        for node in self.nodes[1:]:
+            self.assertEqual([b"Hi"], self._shouts(node))
+    # end test_shout
+
+    def test_stop(self):
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        self.nodes[0].stop()
+        # The zero port beacon tells the others straight away
+        self.net.run(0.1)
+        self.assertTrue(self.net.converged("TEST"))
+        self.assertNotIn(self.nodes[0].uuid(), self.nodes[1].peers())
+    # end test_stop
+
+    def test_partition(self):
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        self.net.partition(self.nodes[:5], self.nodes[5:])
+        self.net.run(PyrePeer.PEER_EXPIRED + 2)
+        self.assertEqual(4, len(self.nodes[0].peers()))
+        self.assertEqual(4, len(self.nodes[9].peers()))
+
+        self.net.heal()
+        self.assertIsNotNone(self.net.run_until(lambda: self.net.converged("TEST"), timeout=3))
+    # end test_partition
+
+    def test_loss(self):
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        self.net.loss = 0.05
+        sent = [str(i).encode() for i in range(50)]
+        for msg in sent:
+            self.nodes[0].shout("TEST", msg)
+        # A gap is only noticed when a later message arrives
+        self.net.run(0.1)
+        self.net.loss = 0
+        self.nodes[0].shout("TEST", b"end")
+        sent.append(b"end")
+        self.net.run(5)
+        for node in self.nodes[1:]:
+            self.assertEqual(sent, self._shouts(node))
+    # end test_loss
+
+    def test_tree_shout(self):
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        sender = self.nodes[0]
+        sender.set_shout_fanout(2)
+        # A member that doesn't pass tree SHOUTs on gets them straight away
+        for node in self.nodes:
+            if node is not self.nodes[5]:
+                node.node.peers[self.nodes[5].uuid()].headers.pop(PyrePeer.TREE_HEADER)
+        sent_before = sum(p.msgs_sent for p in sender.node.peers.values())
+        sent = [str(i).encode() for i in range(20)]
+        for msg in sent:
+            sender.shout("TEST", msg)
+        self.net.run(0.5)
+        self.assertEqual(20 * 3, sum(p.msgs_sent for p in sender.node.peers.values()) - sent_before)
+        for node in self.nodes[1:]:
+            shouts = []
+            msg = node.recv()
+            while msg is not None:
+                if msg[0] == b"SHOUT":
+                    self.assertEqual(sender.uuid().bytes, msg[1])
+                    self.assertEqual(b"node0", msg[2])
+                    shouts.append(msg[-1])
+                msg = node.recv()
+            self.assertEqual(sent, shouts)
+    # end test_tree_shout
+
+    def test_idle_mailboxes(self):
+        for node in self.nodes:
+            node.set_mailbox_idle(5)
+        self.net.run_until(lambda: self.net.converged("TEST"), timeout=2)
+        self.nodes[8].leave("TEST")
+        self.nodes[9].leave("TEST")
+        self.net.run(PyrePeer.PEER_EXPIRED + 2)
+        peers = self.nodes[0].node.peers
+        id8, id9 = self.nodes[8].uuid(), self.nodes[9].uuid()
+        self.assertEqual(9, len(self.nodes[0].peers()))
+        self.assertTrue(peers[id8].parked)
+        self.assertTrue(peers[id9].parked)
+        self.assertFalse(peers[self.nodes[1].uuid()].parked)
+
+        # A WHISPER or a shared group opens the mailbox again
+        self.nodes[0].whisper(id9, b"Hi")
+        self.nodes[8].join("TEST")
+        self.net.run(0.1)
+        self.assertFalse(peers[id8].parked)
+        self.assertFalse(peers[id9].parked)
+        msg = self.nodes[9].recv()
+        while msg[0] != b"WHISPER":
+            msg = self.nodes[9].recv()
+        self.assertEqual(b"Hi", msg[-1])
+    # end test_idle_mailboxes
+
+    def test_beacon_backoff(self):
+        net = SimNetwork(seed=2)
+        nodes = [net.add_node("node{0}".format(i)) for i in range(10)]
+        for node in nodes:
+            node.set_max_interval(30000)
+            node.join("TEST")
+            node.start()
+        self.assertIsNotNone(net.run_until(lambda: net.converged("TEST"), timeout=2))
+        beacons = net.stats["beacons"]
+        net.run(120)
+        # Once a second that would be 1200 beacons
+        self.assertLess(net.stats["beacons"] - beacons, 100)
+        self.assertTrue(net.converged("TEST"))
+        messages = net.stats["messages"]
+        net.run(60)
+        # Peers know to wait for our beacons, so they don't ping us
+        self.assertEqual(messages, net.stats["messages"])
+
+        # A new node is found as fast as before
+        node = net.add_node("late")
+        node.set_max_interval(30000)
+        node.join("TEST")
+        node.start()
+        self.assertIsNotNone(net.run_until(lambda: net.converged("TEST"), timeout=2))
+
+        # A node that went silent still expires
+        net.partition(nodes[:1], nodes[1:] + [node])
+        net.run(3 * 30 + 2)
+        self.assertNotIn(nodes[0].uuid(), nodes[1].peers())
+    # end test_beacon_backoff
+
+# end PyreSimTest
+
+
+class PyreSuperPeerSimTest(unittest.TestCase):
+
+    def setUp(self, *args, **kwargs):
+        self.net = SimNetwork(seed=1)
+        self.supers = [self.net.add_node("super{0}".format(i)) for i in range(3)]
+        self.leaves = [self.net.add_node("leaf{0}".format(i)) for i in range(12)]
+        for node in self.supers:
+            node.set_super_peer()
+        for node in self.leaves:
+            node.set_leaf()
+        for node in self.supers + self.leaves:
+            node.join("TEST")
+            node.start()
+        self.net.run(5)
+    # end setUp
+
+    # Return the frames after the event type of the given events, or of
+    # all SHOUTs and WHISPERs for None
+    def _events(self, node, event):
+        events = []
+        msg = node.recv()
+        while msg is not None:
+            if event is None and msg[0] in (b"SHOUT", b"WHISPER") or msg[0] == event:
+                events.append(msg[1:])
+            msg = node.recv()
+        return events
+
+    def test_connections(self):
+        super_ids = [node.uuid() for node in self.supers]
+        for node in self.leaves:
+            peers = node.peers()
+            self.assertEqual(1, len(peers))
+            self.assertIn(peers[0], super_ids)
+        # Super-peers see each other and their share of the leaves
+        self.assertEqual(2 * 3 + 12, sum(len(node.peers()) for node in self.supers))
+    # end test_connections
+
+    def test_relay(self):
+        sender = self.leaves[0]
+        for node in self.supers + self.leaves:
+            self._events(node, b"SHOUT")
+        sender.shout("TEST", b"Hi")
+        sender.whisper(self.leaves[-1].uuid(), b"Psst")
+        self.net.run(0.5)
+        for node in self.supers + self.leaves[1:-1]:
+            shouts = self._events(node, b"SHOUT")
+            self.assertEqual([[sender.uuid().bytes, b"leaf0", b"TEST", b"Hi"]], shouts)
+        # Both reach the last leaf, the WHISPER without being sent to others
+        self.assertEqual([[sender.uuid().bytes, b"leaf0", b"TEST", b"Hi"],
+                          [sender.uuid().bytes, b"leaf0", b"Psst"]],
+                         self._events(self.leaves[-1], None))
+    # end test_relay
+
+    def test_failover(self):
+        home = self.leaves[0].peers()[0]
+        stopped = [node for node in self.supers if node.uuid() == home][0]
+        stopped.stop()
+        self.net.run(2)
+        for node in self.leaves:
+            peers = node.peers()
+            self.assertEqual(1, len(peers))
+            self.assertNotEqual(home, peers[0])
+
+        for node in self.supers + self.leaves:
+            self._events(node, b"SHOUT")
+        self.leaves[0].shout("TEST", b"Still here")
+        self.net.run(0.5)
+        for node in self.supers + self.leaves[1:]:
+            if node is not stopped:
+                self.assertEqual(1, len(self._events(node, b"SHOUT")))
+    # end test_failover
+
+# end PyreSuperPeerSimTest
+
+
+if __name__ == '__main__':
+    unittest.main()
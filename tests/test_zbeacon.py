@@ -60,6 +60,55 @@ class ZBeaconTest(unittest.TestCase):
         req = self.node2.recv_multipart()
         self.assertEqual(self.transmit1, req[1])
 
+    def test_refresh_batch(self):
+        self.node2.send_unicode("SET REFRESH", zmq.SNDMORE)
+        self.node2.send_unicode("500")
+        self.node2.send_unicode("SUBSCRIBE", zmq.SNDMORE)
+        self.node2.send(b"ZRE")
+        self.node1.send_unicode("SET INTERVAL", zmq.SNDMORE)
+        self.node1.send_unicode("50")
+        self.node1.send_unicode("PUBLISH", zmq.SNDMORE)
+        self.node1.send(self.transmit1)
+        # The first beacon comes on its own, repeats come in one batch
+        req = self.node2.recv_multipart()
+        self.assertEqual(self.transmit1, req[1])
+        req = self.node2.recv_multipart()
+        self.assertEqual(3, len(req))
+        self.assertEqual(b"", req[0])
+        self.assertEqual(self.transmit1, req[2])
+
+    @unittest.skipUnless(hasattr(socket, "MSG_DONTWAIT"), "needs non-blocking receive")
+    def test_drain(self):
+        # A beacon whose UDP socket we feed by hand
+        class IdleBeacon(ZBeacon):
+            def run(self):
+                pass
+        ctx = zmq.Context()
+        pipe, shim = ctx.socket(zmq.PAIR), ctx.socket(zmq.PAIR)
+        pipe.bind("inproc://zbeacon-drain")
+        shim.connect("inproc://zbeacon-drain")
+        beacon = IdleBeacon(ctx, shim)
+        beacon.udpsock.bind(("127.0.0.1", 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for transmit in (self.transmit1, self.transmit2, b"XYZ"):
+                sender.sendto(transmit, beacon.udpsock.getsockname())
+            beacon.filter = b"ZRE"
+            beacon.handle_udp()
+            # Everything waiting comes in one message, without the
+            # beacon that doesn't match the filter
+            req = pipe.recv_multipart()
+            self.assertEqual([b"127.0.0.1", self.transmit1, b"127.0.0.1", self.transmit2], req)
+            # Nothing is waiting, so we don't block
+            beacon.handle_udp()
+            self.assertEqual(0, pipe.poll(100))
+        finally:
+            sender.close()
+            beacon.udpsock.close()
+            pipe.close()
+            shim.close()
+            ctx.term()
+
 # end ZBeaconTest
 
 if __name__ == '__main__':
@@ -0,0 +1,60 @@
+import unittest
+import zmq
+from pyre.zactor import ZActor
+from pyre.zgossip import ZGossip
+
+
+class ZGossipTest(unittest.TestCase):
+    def setUp(self, *args, **kwargs):
+        self.ctx = zmq.Context()
+        # A base node, with two nodes connected to it in a loop
+        self.base = ZActor(self.ctx, ZGossip)
+        self.base.send_multipart([b"BIND", b"inproc://zgossip-base"])
+        self.node1 = ZActor(self.ctx, ZGossip)
+        self.node1.send_multipart([b"BIND", b"inproc://zgossip-node1"])
+        self.node1.send_multipart([b"CONNECT", b"inproc://zgossip-base"])
+        self.node2 = ZActor(self.ctx, ZGossip)
+        self.node2.send_multipart([b"CONNECT", b"inproc://zgossip-base"])
+        self.node2.send_multipart([b"CONNECT", b"inproc://zgossip-node1"])
+        for actor in (self.base, self.node1, self.node2):
+            actor.resolve().setsockopt(zmq.RCVTIMEO, 1000)
+    # end setUp
+
+    def tearDown(self):
+        for actor in (self.node2, self.node1, self.base):
+            actor.destroy()
+        self.ctx.term()
+    # end tearDown
+
+    def test_publish(self):
+        self.node1.send_multipart([b"PUBLISH", b"key1", b"value1"])
+        self.assertEqual([b"DELIVER", b"key1", b"value1"], self.base.recv_multipart())
+        # node2 hears of it from both, but only once
+        self.assertEqual([b"DELIVER", b"key1", b"value1"], self.node2.recv_multipart())
+        self.assertRaises(zmq.Again, self.node2.recv_multipart)
+    # end test_publish
+
+    def test_hello_gets_table(self):
+        self.base.send_multipart([b"PUBLISH", b"key1", b"value1"])
+        self.assertEqual([b"DELIVER", b"key1", b"value1"], self.node1.recv_multipart())
+        node3 = ZActor(self.ctx, ZGossip)
+        node3.resolve().setsockopt(zmq.RCVTIMEO, 1000)
+        try:
+            node3.send_multipart([b"CONNECT", b"inproc://zgossip-node1"])
+            self.assertEqual([b"DELIVER", b"key1", b"value1"], node3.recv_multipart())
+        finally:
+            node3.destroy()
+    # end test_hello_gets_table
+
+    def test_retract(self):
+        self.node2.send_multipart([b"PUBLISH", b"key2", b"value2"])
+        self.assertEqual([b"DELIVER", b"key2", b"value2"], self.base.recv_multipart())
+        self.node2.send_multipart([b"PUBLISH", b"key2", b""])
+        self.assertEqual([b"DELIVER", b"key2", b""], self.base.recv_multipart())
+        self.assertRaises(zmq.Again, self.base.recv_multipart)
+    # end test_retract
+# end ZGossipTest
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,14 @@ class ZHelperTest(unittest.TestCase):
         self.assertIn('127.0.0.1', addrs)
     # end test_get_ifaddrs_loopback
 
+    @unittest.skipIf(zhelper.ifaddrs_watch() is None, "can't watch interfaces")
+    def test_get_ifaddrs_cached(self):
+        ifs = zhelper.get_ifaddrs_cached()
+        self.assertEqual(zhelper.get_ifaddrs(), ifs)
+        # Nothing changed, so no new scan
+        self.assertIs(ifs, zhelper.get_ifaddrs_cached())
+    # end test_get_ifaddrs_cached
+
 # end ZHelperTest
 
 if __name__ == '__main__':